@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+
+# times the SCC based cycle detection in brulib.graph on synthetic module
+# dependency graphs (mostly acyclic, like a real library, with a few
+# cycles planted), and compares it with python-graph-core's
+# mutual_accessibility, which graph_cycles.py used before, if that's
+# installed.
+
+import argparse
+import random
+import sys
+import time
+import brulib.graph
+
+def create_graph(node_count, arcs_per_node, cycle_count, seed = 0):
+    """ returns a dict node -> arc targets: arcs mostly point to nodes with
+        lower numbers (so to 'older' modules), plus arcs closing cycles """
+    rand = random.Random(seed)
+    graph = dict((node, set()) for node in range(node_count))
+    for node in range(1, node_count):
+        for i in range(rand.randint(0, 2 * arcs_per_node)):
+            graph[node].add(rand.randrange(node))
+    for i in range(cycle_count):
+        node = rand.randrange(1, node_count)
+        if len(graph[node]) > 0:
+            graph[min(graph[node])].add(node)
+    return dict((node, sorted(targets)) for node, targets in graph.items())
+
+def time_it(name, func, baseline = None):
+    t0 = time.time()
+    result = func()
+    duration = time.time() - t0
+    speedup = '' if baseline == None \
+              else ' ({:.1f}x)'.format(baseline / max(duration, 1e-6))
+    print('  {:<24} {:7.3f}s{}'.format(name, duration, speedup))
+    return (result, duration)
+
+def find_cycles_pygraph(graph):
+    from pygraph.classes.digraph import digraph
+    from pygraph.algorithms.accessibility import mutual_accessibility
+    py_digraph = digraph()
+    for node in graph.keys():
+        py_digraph.add_node(node)
+    for node, arc_targets in graph.items():
+        for arc_target in arc_targets:
+            py_digraph.add_edge((node, arc_target))
+    cycles = []
+    seen = set()
+    for node, cycle in mutual_accessibility(py_digraph).items():
+        if len(cycle) > 1 and not node in seen:
+            seen.update(cycle)
+            cycles.append(sorted(cycle))
+    return cycles
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--nodes', type = int, nargs = '+',
+                        default = [10000, 100000])
+    parser.add_argument('--arcs-per-node', type = int, default = 4)
+    parser.add_argument('--cycles', type = int, default = 20)
+    args = parser.parse_args()
+    try:
+        import pygraph
+        has_pygraph = True
+    except ImportError:
+        print('python-graph-core not installed, timing brulib.graph only')
+        has_pygraph = False
+
+    for node_count in args.nodes:
+        graph = create_graph(node_count, args.arcs_per_node, args.cycles)
+        arc_count = sum(len(targets) for targets in graph.values())
+        print('{} nodes, {} arcs:'.format(node_count, arc_count))
+        baseline = None
+        if has_pygraph:
+            # mutual_accessibility recurses along paths
+            sys.setrecursionlimit(max(sys.getrecursionlimit(), 10 * node_count))
+            (expected, baseline) = time_it('pygraph',
+                lambda: find_cycles_pygraph(graph))
+        (cycles, duration) = time_it('brulib.graph.find_cycles',
+            lambda: brulib.graph.find_cycles(graph), baseline)
+        if has_pygraph:
+            assert sorted(cycles) == sorted(expected)
+        print('  {} cycles with {} nodes'.format(len(cycles),
+              sum(len(cycle) for cycle in cycles)))
+        time_it('condensation', lambda: brulib.graph.condensation(graph))
+
+if __name__ == "__main__":
+    main()
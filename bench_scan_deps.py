@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+
+# compares the mmap & regex based #include scanner in brulib.includescan
+# with the line by line scanner scan_deps.py used before. By default this
+# scans all files underneath ./bru_modules/boost-* (so 'bru install' or
+# './scan_deps.py boost*' first), or pass the dirs to scan as args.
+
+import argparse
+import os
+import re
+import glob
+import time
+import brulib.includescan
+import brulib.util
+
+def legacy_get_includes_from_cpp(cpp_file_name):
+    """ the scanner as it was before brulib.includescan """
+    pattern = re.compile('\\s*#\\s*include\\s*[\\<"](.*)[\\>"]')
+    includes = []
+    try:
+        with open(cpp_file_name, 'r') as cpp_file:
+            while True:
+                line = cpp_file.readline()
+                if len(line) == 0:
+                    break # eof
+                match = pattern.search(line)
+                if match != None:
+                    includes.append(match.group(1))
+    except:
+        pass
+    return includes
+
+def get_files(dirs):
+    files = []
+    for dir in dirs:
+        for root, subdirs, names in os.walk(dir):
+            files += [os.path.join(root, name) for name in names]
+    return files
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('dirs', nargs = '*',
+        help = 'dirs to scan, defaults to ./bru_modules/boost-*')
+    parser.add_argument('--jobs', '-j', type = int,
+        default = brulib.util.get_default_job_count())
+    args = parser.parse_args()
+    dirs = args.dirs if len(args.dirs) > 0 \
+           else glob.glob(os.path.join('bru_modules', 'boost-*'))
+    files = get_files(dirs)
+    if len(files) == 0:
+        raise Exception('no files to scan, install boost-* or pass dirs as args')
+    size = sum(os.path.getsize(file) for file in files)
+    print('scanning {} files with {:.1f} MB total'.format(len(files), size / 1e6))
+
+    scanners = [
+        ('line by line', lambda files:
+            dict((file, legacy_get_includes_from_cpp(file)) for file in files)),
+        ('mmap+regex', lambda files:
+            brulib.includescan.IncludeScanner(jobs = 1).scan(files)),
+    ]
+    def scan_with_pool(files):
+        with brulib.includescan.IncludeScanner(args.jobs) as scanner:
+            return scanner.scan(files)
+    scanners.append(('mmap+regex -j{}'.format(args.jobs), scan_with_pool))
+
+    results = {}
+    for name, scan in scanners:
+        t0 = time.time()
+        results[name] = scan(files)
+        duration = time.time() - t0
+        results[name + ' duration'] = duration
+        include_count = sum(len(includes) for includes in results[name].values())
+        print('{:<20} {:7.2f}s ({:.1f}x), {} #includes'.format(name, duration,
+              results['line by line duration'] / max(duration, 1e-6),
+              include_count))
+
+    # the old scanner also finds #includes in comments & strings:
+    differing = [file for file in files
+                 if set(results['line by line'][file]) !=
+                    set(results['mmap+regex'][file])]
+    print('{} files with differing #includes, e.g. {}'.format(
+          len(differing), differing[:3]))
+
+if __name__ == "__main__":
+    main()
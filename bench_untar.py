@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+
+# compares the single-pass streaming extraction in brulib.untar with the
+# two-pass tarfile.getmembers() + extractall() it replaced. By default this
+# benchmarks the boost and openssl downloads in ~/.bru/downloads (so
+# 'bru install' these first), or pass the archives to unpack as args.
+
+import argparse
+import os
+import glob
+import time
+import shutil
+import tarfile
+import tempfile
+import brulib.untar
+import brulib.util
+
+def legacy_extract_file(path, to_directory):
+    """ the extraction as it was before brulib.untar.extract_tar_stream:
+        getmembers() decompresses the whole tar once, extractall() again """
+    if path.endswith('.tar.gz') or path.endswith('.tgz'):
+        mode = 'r:gz'
+    elif path.endswith('.tar.bz2') or path.endswith('.tbz'):
+        mode = 'r:bz2'
+    elif path.endswith('.tar.xz') or path.endswith('.txz'):
+        mode = 'r:xz'
+    else:
+        raise ValueError("cannot benchmark {}".format(path))
+    with tarfile.open(path, mode) as file:
+        nonlnk_members = []
+        lnk_members = []
+        for member in file.getmembers():
+            if member.name.startswith('..') or member.name.startswith('/') \
+                    or member.name.startswith('\\'):
+                raise Exception('invalid archive member: ' + member.name)
+            members = lnk_members if member.islnk() or member.issym() \
+                        else nonlnk_members
+            members.append(member)
+        file.extractall(to_directory, members = nonlnk_members)
+        brulib.untar.copy_link_members(to_directory, lnk_members)
+
+def get_default_archives():
+    downloads = os.path.join(os.path.expanduser('~'), '.bru', 'downloads')
+    archives = []
+    for module in ['boost-*', 'openssl']:
+        for pattern in ['*.tar.gz', '*.tgz', '*.tar.bz2', '*.tar.xz']:
+            archives += glob.glob(os.path.join(downloads, module, '*', pattern))
+    return sorted(archives)
+
+def time_extraction(extract, archive, repeat):
+    """ returns the best time in secs of repeat extractions """
+    times = []
+    for i in range(repeat):
+        to_directory = tempfile.mkdtemp(prefix='bench_untar')
+        try:
+            t0 = time.time()
+            extract(archive, to_directory)
+            times.append(time.time() - t0)
+        finally:
+            shutil.rmtree(to_directory)
+    return min(times)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('archives', nargs = '*',
+        help = 'tar files to unpack, defaults to boost & openssl downloads')
+    parser.add_argument('--repeat', type = int, default = 3)
+    parser.add_argument('--jobs', '-j', type = int,
+        default = brulib.util.get_default_job_count())
+    args = parser.parse_args()
+    archives = args.archives if len(args.archives) > 0 \
+               else get_default_archives()
+    if len(archives) == 0:
+        raise Exception('no archives to benchmark, bru install boost-* '
+                        'and openssl first or pass archives as args')
+
+    extractors = [
+        ('two-pass', legacy_extract_file),
+        ('streaming', lambda archive, to_directory:
+            brulib.untar.extract_file(archive, to_directory, args.jobs,
+                                      use_external = False)),
+        ('streaming+external', lambda archive, to_directory:
+            brulib.untar.extract_file(archive, to_directory, args.jobs,
+                                      use_external = True)),
+    ]
+    totals = dict((name, 0) for (name, extract) in extractors)
+    for archive in archives:
+        size = os.path.getsize(archive)
+        for name, extract in extractors:
+            duration = time_extraction(extract, archive, args.repeat)
+            totals[name] += duration
+            print('{:<20} {:<50} {:6.1f} MB {:7.2f}s'.format(
+                  name, os.path.basename(archive), size / 1e6, duration))
+    for name, extract in extractors:
+        print('{:<20} total {:.2f}s ({:.1f}x)'.format(
+              name, totals[name], totals['two-pass'] / max(totals[name], 1e-6)))
+
+if __name__ == "__main__":
+    main()
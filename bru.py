@@ -8,11 +8,14 @@ from __future__ import unicode_literals
 import os
 import argparse
 import pdb # only if you want to add pdb.set_trace()
+import brulib.compilercache
 import brulib.jsonc
 import brulib.library
 import brulib.install
 import brulib.make
 import brulib.runtests
+import brulib.module_downloader
+import brulib.util
 
 # http://stackoverflow.com/questions/4934806/python-how-to-find-scripts-directory
 def get_script_path():
@@ -27,6 +30,19 @@ def get_library_dir():
 def get_library():
     return brulib.library.Library(get_library_dir())
 
+def cmd_cache(action, max_size_mb, max_trees):
+    store = brulib.module_downloader.get_download_store()
+    tree_cache = brulib.module_downloader.get_tree_cache()
+    if action == 'gc':
+        evicted = store.gc(max_size_mb * 1024 * 1024)
+        print('evicted {} downloads'.format(evicted))
+        evicted = tree_cache.gc(max_trees)
+        print('evicted {} unpacked trees'.format(evicted))
+    stats = store.stats()
+    print('{} downloads with {:.1f} MB total, linked to {} locations'.format(
+          stats['objects'], stats['size'] / 1e6, stats['links']))
+    print('{} unpacked trees'.format(len(list(tree_cache.get_trees()))))
+
 def main():
     parser = argparse.ArgumentParser()
     subparsers = parser.add_subparsers(dest='command')
@@ -36,6 +52,18 @@ def main():
                                 help = 'e.g. googlemock@1.7.0')
     parser_install.add_argument('--targetPlatform', default='Native', required=False,
         help = 'targetPlatform Native | iOS')
+    parser_install.add_argument('--jobs', '-j', type=int,
+        default=brulib.util.get_default_job_count(), required=False,
+        help = 'max number of modules to download & unpack (or to build'
+               ' via their make_command) concurrently')
+    parser_install.add_argument('--lazy', default=False, action='store_true',
+        help = "only unpack the parts of tar.gzs that the modules' gyp files"
+               " refer to (include_dirs, sources, copies, ...)")
+    parser_install.add_argument('--link-trees', default=False,
+        action='store_true',
+        help = "hardlink unpacked tar.gzs from ~/.bru/trees instead of copying"
+               " them, which saves disk space but shares the (read-only)"
+               " files with other projects")
 
     parser_test = subparsers.add_parser('test')
     parser_test.add_argument("testables", default = [], nargs = '*',
@@ -51,17 +79,60 @@ def main():
         help = 'enables verbose output in underlying build toolchain (e.g. make)')
     parser_make.add_argument('--targetPlatform', default='Native', required=False,
         help = 'targetPlatform Native | iOS')
+    parser_make.add_argument('--generator', default=None, required=False,
+        choices = brulib.make.LINUX_GENERATORS,
+        help = 'build tool gyp generates files for on Linux, defaults to'
+               ' make. auto picks ninja if it is in your PATH, make otherwise')
+    parser_make.add_argument('--jobs', '-j', type=int,
+        default=brulib.util.get_default_job_count(), required=False,
+        help = 'number of parallel compile jobs for make or ninja')
+    parser_make.add_argument('--compiler-cache', nargs='?', const='auto',
+        default=None, required=False,
+        choices = ['auto'] + brulib.compilercache.COMPILER_CACHES,
+        help = 'compile via ccache or sccache (auto picks whichever is in'
+               ' your PATH) and report the cache hit rate, Linux only')
+    parser_make.add_argument('--artifact-cache', nargs='?', metavar='DIR',
+        const=brulib.module_downloader.get_artifact_root(), default=None,
+        required=False,
+        help = "link prebuilt static libs of modules from DIR (defaults to"
+               " ~/.bru/artifacts, may be a shared dir) instead of compiling"
+               " them, and store libs built from source there, Linux only")
+
+    parser_cache = subparsers.add_parser('cache',
+        help = 'inspects or garbage-collects the downloads & unpacked trees'
+               ' in ~/.bru')
+    parser_cache.add_argument('action', choices = ['stats', 'gc'])
+    parser_cache.add_argument('--max-size', type=int, default=2048,
+        required=False,
+        help = 'for gc: max size of the store in MB after evicting the least'
+               ' recently used downloads')
+    parser_cache.add_argument('--max-trees', type=int, default=50,
+        required=False,
+        help = 'for gc: max number of unpacked trees to keep')
+
+    subparsers.add_parser('index',
+        help = 'rebuilds the index of all modules & versions in ./library')
 
     args = parser.parse_args()
     library = get_library()
     if args.command == 'install':
-        brulib.install.cmd_install(library, args.installables, args.targetPlatform)
+        brulib.install.cmd_install(library, args.installables, args.targetPlatform,
+                                  args.jobs, args.lazy, args.link_trees)
     elif args.command == 'make':
-        brulib.make.cmd_make(args.config, args.verbose, args.targetPlatform)
+        brulib.make.cmd_make(args.config, args.verbose, args.targetPlatform,
+                             args.generator, args.jobs, args.compiler_cache,
+                             args.artifact_cache, library)
     elif args.command == 'test':
         brulib.runtests.cmd_test(args.testables)
+    elif args.command == 'cache':
+        cmd_cache(args.action, args.max_size, args.max_trees)
+    elif args.command == 'index':
+        index = library.build_index()
+        print('indexed {} modules in {}'.format(len(index['modules']),
+              library.get_index_file_name()))
     else:
-        raise Exception("unknown command {}, chose install | test".format(args.command))
+        raise Exception("unknown command {}, chose install | make | test | cache | index"
+                        .format(args.command))
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,274 @@
+""" a cache of the static libraries 'bru make' builds from bru_modules, so
+    that modules built before with identical inputs (e.g. boost-regex or
+    zlib in another project or an earlier CI run) don't need to be compiled
+    again. Each module's libs are stored under a key hashing everything the
+    build depends on: the module's formula & gyp, the versions of its
+    (recursive) deps, the build config, the gypi files and the compiler
+    version. On a hit the module's gyp in bru_modules is rewritten to link
+    the prebuilt libs instead of compiling the lib's sources (with the
+    original gyp kept in $module.gyp.orig until the next miss).
+    The layout of a FilesystemArtifactStore (e.g. ~/.bru/artifacts) is:
+      ab/abcdef.../libfoo.a         a lib stored under key abcdef...
+      ab/abcdef.../artifact.json    module, version & config of the libs
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import os
+import json
+import shlex
+import shutil
+import hashlib
+import platform
+import subprocess
+import brulib.compilercache
+import brulib.jsonc
+import brulib.util
+
+class FilesystemArtifactStore:
+    """ stores artifacts in a local (or a shared network) dir, see module
+        docstring. Stores elsewhere just need the same get() & put().
+    """
+
+    METADATA_FILE = 'artifact.json'
+
+    def __init__(self, root_dir):
+        """ param root_dir e.g. ~/.bru/artifacts """
+        self._root_dir = root_dir
+
+    def _get_artifact_dir(self, key):
+        return os.path.join(self._root_dir, key[:2], key)
+
+    def get(self, key, dest_dir):
+        """ copies the files stored under the key into dest_dir, returning
+            their paths, or returns None if nothing is stored under the key
+        """
+        artifact_dir = self._get_artifact_dir(key)
+        if not os.path.exists(artifact_dir):
+            return None
+        os.utime(artifact_dir, None) # for evicting least recently used ones
+        brulib.util.mkdir_p(dest_dir)
+        files = []
+        for name in sorted(os.listdir(artifact_dir)):
+            if name == FilesystemArtifactStore.METADATA_FILE:
+                continue
+            dest_file = os.path.join(dest_dir, name)
+            if os.path.exists(dest_file):
+                os.remove(dest_file)
+            brulib.util.link_or_copy(os.path.join(artifact_dir, name), dest_file)
+            files.append(dest_file)
+        return files
+
+    def put(self, key, files, metadata):
+        """ stores the files under the key, unless there are files stored
+            under the key alrdy.
+            param metadata is a dict describing the files
+        """
+        artifact_dir = self._get_artifact_dir(key)
+        if os.path.exists(artifact_dir):
+            return
+        # atomic rename so that concurrent builds (e.g. on a shared dir)
+        # never see partially stored artifacts:
+        temp_dir = '{}.tmp{}'.format(artifact_dir, os.getpid())
+        if os.path.exists(temp_dir):
+            shutil.rmtree(temp_dir)
+        brulib.util.mkdir_p(temp_dir)
+        for file in files:
+            shutil.copy2(file, os.path.join(temp_dir, os.path.basename(file)))
+        brulib.jsonc.savefile(
+            os.path.join(temp_dir, FilesystemArtifactStore.METADATA_FILE),
+            metadata)
+        try:
+            os.rename(temp_dir, artifact_dir)
+        except OSError:
+            # another build stored the same artifact in the meantime
+            shutil.rmtree(temp_dir)
+
+def get_compiler_versions(environ):
+    """ returns the output of 'cc --version' & 'c++ --version' for the
+        compilers in the CC & CXX environment variables (without a compiler
+        cache they may be wrapped by) """
+    versions = []
+    for var, default in [('CC', 'cc'), ('CXX', 'c++')]:
+        cmdline = shlex.split(environ.get(var, default))
+        if len(cmdline) > 1 and os.path.basename(cmdline[0]) in \
+           brulib.compilercache.COMPILER_CACHES:
+            cmdline = cmdline[1:]
+        try:
+            with open(os.devnull, 'w') as devnull:
+                versions.append(subprocess.check_output(
+                    cmdline + ['--version'], stderr = devnull,
+                    universal_newlines = True))
+        except (OSError, subprocess.CalledProcessError):
+            versions.append(None)
+    return versions
+
+def get_file_sha256(filename):
+    with open(filename, 'rb') as file:
+        return hashlib.sha256(file.read()).hexdigest()
+
+def locate_static_library(config, module, target_name):
+    """ returns the path of a static lib built by gyp's make or ninja
+        generators from bru_modules/$module/$module.gyp, or None if it
+        wasn't built """
+    lib = 'lib{}.a'.format(target_name)
+    candidates = [
+        os.path.join('out', config, 'obj.target', 'bru_modules', module, lib),
+        os.path.join('out', config, 'obj', 'bru_modules', module, lib),
+        os.path.join('out', config, lib)]
+    for candidate in candidates:
+        if os.path.exists(candidate):
+            return candidate
+    return None
+
+def get_static_library_targets(gyp):
+    return [target['target_name'] for target in gyp['targets']
+            if target.get('type') == 'static_library']
+
+def get_prebuilt_gyp(gyp, libs):
+    """ returns a copy of the gyp with its static_library targets turned into
+        targets of type 'none' linking the prebuilt libs instead.
+        param libs is a dict target_name -> lib file
+    """
+    gyp = json.loads(json.dumps(gyp), object_pairs_hook = type(gyp))
+    for target in gyp['targets']:
+        if target['target_name'] in libs:
+            target['type'] = 'none'
+            for prop in ['sources', 'sources!']:
+                target.pop(prop, None)
+            link_settings = target.setdefault('link_settings', {})
+            link_settings.setdefault('libraries', []).append(
+                os.path.abspath(libs[target['target_name']]))
+    return gyp
+
+class ArtifactCache:
+    """ used by 'bru make' to link prebuilt libs of modules with a stored
+        artifact, and to store the libs of all other modules after they
+        were built """
+
+    def __init__(self, library, store, config, bru_modules_root = './bru_modules'):
+        """ param library is a brulib.library.Library
+            param store is a FilesystemArtifactStore
+            param config is 'Debug' or 'Release'
+        """
+        self._library = library
+        self._store = store
+        self._config = config
+        self._bru_modules_root = bru_modules_root
+        self._misses = {} # module -> (key, formula, gyp)
+
+    def get_installed_modules(self):
+        """ returns a dict module -> version of the modules in bru_modules """
+        modules = {}
+        for module in sorted(os.listdir(self._bru_modules_root)):
+            version_file = os.path.join(self._bru_modules_root, module,
+                                        'bru-version.json')
+            if os.path.exists(version_file):
+                modules[module] = brulib.jsonc.loadfile(version_file)['version']
+        return modules
+
+    def get_recursive_deps(self, module, modules):
+        """ returns the sorted list of 'module@version' of the modules the
+            module depends on recursively
+            param modules is a dict module -> installed version
+        """
+        deps = set()
+        todo = [module]
+        while len(todo) > 0:
+            current = todo.pop()
+            formula = self._library.load_formula(current, modules[current])
+            for dep in formula.get('dependencies', {}).keys():
+                if dep in modules and not dep in deps:
+                    deps.add(dep)
+                    todo.append(dep)
+        return sorted('{}@{}'.format(dep, modules[dep]) for dep in deps)
+
+    def get_key(self, formula, gyp, deps, compiler_versions):
+        hash = hashlib.sha256()
+        hash.update(json.dumps([
+            formula, gyp, deps, self._config, compiler_versions,
+            platform.system(), os.environ.get('GYP_DEFINES')],
+            sort_keys = True).encode('utf8'))
+        for gypi in ['bru_common.gypi', 'bru_overrides.gypi']:
+            if os.path.exists(gypi):
+                hash.update(get_file_sha256(gypi).encode('ascii'))
+        return hash.hexdigest()
+
+    def _get_pristine_gyp(self, gyp_file):
+        """ returns the module's gyp as 'bru install' wrote it, which is kept
+            in $gyp_file.orig while the gyp links prebuilt libs """
+        state_file = gyp_file + '.prebuilt'
+        orig_gyp_file = gyp_file + '.orig'
+        if os.path.exists(state_file) and os.path.exists(orig_gyp_file) and \
+           brulib.jsonc.loadfile(state_file)['sha256'] == \
+           get_file_sha256(gyp_file):
+            return brulib.jsonc.loadfile(orig_gyp_file)
+        # 'bru install' overwrote the gyp since prebuilt libs were linked:
+        for file in [state_file, orig_gyp_file]:
+            if os.path.exists(file):
+                os.remove(file)
+        return brulib.jsonc.loadfile(gyp_file)
+
+    def use_prebuilt_libs(self):
+        """ rewrites the gyp of each module with stored libs to link these,
+            and restores the gyps of modules without stored libs. Call this
+            before running gyp.
+        """
+        modules = self.get_installed_modules()
+        compiler_versions = get_compiler_versions(os.environ)
+        for module, version in sorted(modules.items()):
+            gyp_file = os.path.join(self._bru_modules_root, module,
+                                    module + '.gyp')
+            if not os.path.exists(gyp_file):
+                continue
+            gyp = self._get_pristine_gyp(gyp_file)
+            targets = get_static_library_targets(gyp)
+            if len(targets) == 0:
+                continue
+            formula = self._library.load_formula(module, version)
+            key = self.get_key(formula, gyp,
+                               self.get_recursive_deps(module, modules),
+                               compiler_versions)
+            prebuilt_dir = os.path.join(self._bru_modules_root, module,
+                                        'prebuilt', self._config)
+            files = self._store.get(key, prebuilt_dir)
+            if files == None:
+                self._misses[module] = (key, formula, gyp)
+                if os.path.exists(gyp_file + '.orig'):
+                    print('building', module, 'from source again')
+                    brulib.jsonc.savefile(gyp_file, gyp)
+                    os.remove(gyp_file + '.orig')
+                    os.remove(gyp_file + '.prebuilt')
+                continue
+            print('using prebuilt libs for', module, version)
+            libs = dict((target, os.path.join(prebuilt_dir,
+                                              'lib{}.a'.format(target)))
+                        for target in targets)
+            brulib.jsonc.savefile_if_changed(gyp_file + '.orig', gyp)
+            brulib.jsonc.savefile_if_changed(gyp_file,
+                                             get_prebuilt_gyp(gyp, libs))
+            brulib.jsonc.savefile(gyp_file + '.prebuilt',
+                                  {'sha256': get_file_sha256(gyp_file)})
+
+    def store_built_libs(self):
+        """ stores the libs of modules which weren't prebuilt, call this
+            after a successful build. Returns the number of modules stored.
+        """
+        stored = 0
+        for module, (key, formula, gyp) in sorted(self._misses.items()):
+            libs = [locate_static_library(self._config, module, target)
+                    for target in get_static_library_targets(gyp)]
+            if None in libs:
+                print('WARNING: not caching libs of', module,
+                      'since not all were found')
+                continue
+            self._store.put(key, libs, {
+                'module': module,
+                'version': formula['version'],
+                'config': self._config})
+            stored += 1
+        print('stored libs of {} modules in the artifact cache'.format(stored))
+        return stored
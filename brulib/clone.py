@@ -8,13 +8,23 @@ from __future__ import unicode_literals
 
 import os
 import sys
+import errno
 if sys.version_info >= (3, 0):
     from urllib.parse import urlparse
 if sys.version_info < (3, 0):
     from urlparse import urlparse
+import re
 import subprocess
 import shutil
-    
+import hashlib
+import threading
+import time
+import brulib.util
+
+# serializes clones & fetches into the same mirror from concurrent threads
+_mirror_locks = {}
+_mirror_locks_lock = threading.Lock()
+
 def remove_url_prefix(url, prefix):
     """ param prefix e.g. 'git+' """
     assert url.startswith(prefix)
@@ -56,6 +66,224 @@ def git_clone(repo_url, clone_root_dir):
         exit_code = proc.returncode
         assert exit_code == 0, "git checkout returned error {}".format(exit_code)
 
+def _get_thread_lock(mirror_dir):
+    with _mirror_locks_lock:
+        if not mirror_dir in _mirror_locks:
+            _mirror_locks[mirror_dir] = threading.Lock()
+        return _mirror_locks[mirror_dir]
+
+def _is_process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError as exc:
+        return exc.errno != errno.ESRCH
+    return True
+
+class MirrorLock:
+    """ Context manager serializing clones & fetches into the same mirror,
+        both between the threads of concurrent installs (via a threading.Lock)
+        and between concurrent bru processes (via the lock file
+        $mirror_dir.lock, which is created with O_EXCL and holds the pid of
+        its owner). A lock file left behind by a killed bru process is
+        removed: on posix once its owner is gone, elsewhere once it's older
+        than STALE_SECONDS.
+    """
+
+    STALE_SECONDS = 3600
+
+    def __init__(self, mirror_dir):
+        self._thread_lock = _get_thread_lock(mirror_dir)
+        self._lock_file = mirror_dir + '.lock'
+
+    def _is_stale(self):
+        try:
+            with open(self._lock_file) as file:
+                pid = file.read().strip()
+            age = time.time() - os.path.getmtime(self._lock_file)
+        except (IOError, OSError):
+            return False # released in the meantime
+        if os.name == 'posix' and pid.isdigit():
+            return not _is_process_alive(int(pid))
+        return age > MirrorLock.STALE_SECONDS
+
+    def _try_create_lock_file(self):
+        try:
+            fd = os.open(self._lock_file, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except OSError as exc:
+            if exc.errno != errno.EEXIST:
+                raise
+            return False
+        os.write(fd, str(os.getpid()).encode('ascii'))
+        os.close(fd)
+        return True
+
+    def __enter__(self):
+        self._thread_lock.acquire()
+        locked = False
+        try:
+            brulib.util.mkdir_p(os.path.dirname(self._lock_file))
+            waiting = False
+            while not self._try_create_lock_file():
+                if self._is_stale():
+                    print('removing stale lock file', self._lock_file)
+                    try:
+                        os.remove(self._lock_file)
+                    except OSError:
+                        pass
+                    continue
+                if not waiting:
+                    print('waiting for another bru process to release',
+                          self._lock_file)
+                    waiting = True
+                time.sleep(0.2)
+            locked = True
+        finally:
+            if not locked:
+                self._thread_lock.release()
+        return self
+
+    def __exit__(self, etype, value, traceback):
+        try:
+            os.remove(self._lock_file)
+        finally:
+            self._thread_lock.release()
+
+def _git(args, cwd = None):
+    print('git', ' '.join(args))
+    exit_code = subprocess.call(['git'] + args, cwd = cwd)
+    assert exit_code == 0, "git {} returned error {}".format(args[0], exit_code)
+
+def is_commit_hash(changeset):
+    """ returns True if the changeset is a (possibly abbreviated) commit hash,
+        as opposed to a branch or tag name, which may move over time """
+    return re.match('^[0-9a-f]{7,40}$', changeset) != None
+
+def is_full_commit_hash(changeset):
+    """ git servers only serve single commits by their full hash """
+    return re.match('^[0-9a-f]{40}$', changeset) != None
+
+def print_clone_stats(clone_root_dir, start_time):
+    git_size = brulib.util.get_dir_size(os.path.join(clone_root_dir, '.git'))
+    print('cloned {} in {:.1f}s, .git is {:.1f} MB'.format(
+          clone_root_dir, time.time() - start_time, git_size / 1e6))
+
+def has_commit(repo_dir, changeset):
+    with open(os.devnull, 'w') as devnull:
+        exit_code = subprocess.call(
+            ['git', 'rev-parse', '--verify', '--quiet', changeset + '^{commit}'],
+            cwd = repo_dir, stdout = devnull, stderr = devnull)
+    return exit_code == 0
+
+def get_mirror_dir(mirror_root, repo_url):
+    """ param mirror_root e.g. ~/.bru/mirrors
+        param repo_url is a git url without the 'git+' prefix and without
+              the '@changeset' suffix
+    """
+    url_hash = hashlib.sha1(repo_url.encode('utf8')).hexdigest()
+    return os.path.join(mirror_root, url_hash + '.git')
+
+def is_shallow_repo(repo_dir):
+    """ param repo_dir is a bare repo or the .git dir of a clone """
+    return os.path.exists(os.path.join(repo_dir, 'shallow'))
+
+def _set_mirror_head(mirror_dir):
+    """ points the HEAD of a mirror created by fetch_commit_into_mirror() at
+        the upstream repo's default branch, like 'git clone --mirror' does """
+    output = subprocess.check_output(
+        ['git', 'ls-remote', '--symref', 'origin', 'HEAD'],
+        cwd = mirror_dir).decode('utf8')
+    match = re.search('^ref: (\\S+)\tHEAD$', output, re.MULTILINE)
+    if match != None:
+        _git(['symbolic-ref', 'HEAD', match.group(1)], cwd = mirror_dir)
+
+def fetch_commit_into_mirror(repo_url, mirror_dir, changeset):
+    """ fetches only the given commit into the mirror (creating the mirror if
+        needed) under the ref refs/bru/$changeset, so that clones from the
+        mirror can fetch it. For a new or shallow mirror the commit is
+        fetched with depth 1 instead of with the repo's whole history.
+        param changeset is a full commit hash
+        Returns False if the server refused to serve the single commit, in
+        which case the caller should fall back to fetching the whole repo.
+        Call this with the mirror's MirrorLock held.
+    """
+    args = ['fetch', 'origin', '{0}:refs/bru/{0}'.format(changeset)]
+    if not os.path.exists(mirror_dir):
+        # atomic rename in case an earlier process run left a half-mirror
+        fetch_dir = mirror_dir + ".tmp"
+        if os.path.exists(fetch_dir):
+            shutil.rmtree(fetch_dir)
+        _git(['init', '-q', '--bare', fetch_dir])
+        # the same remote config as 'git clone --mirror' creates:
+        _git(['config', 'remote.origin.url', repo_url], cwd = fetch_dir)
+        _git(['config', 'remote.origin.fetch', '+refs/*:refs/*'],
+             cwd = fetch_dir)
+        _git(['config', 'remote.origin.mirror', 'true'], cwd = fetch_dir)
+    else:
+        fetch_dir = mirror_dir
+    if fetch_dir != mirror_dir or is_shallow_repo(mirror_dir):
+        args[1:1] = ['--depth', '1']
+    print('git', ' '.join(args))
+    exit_code = subprocess.call(['git'] + args, cwd = fetch_dir)
+    if exit_code != 0:
+        print('fetch of', changeset, 'failed, falling back to fetching the repo')
+        if fetch_dir != mirror_dir:
+            shutil.rmtree(fetch_dir)
+        return False
+    if fetch_dir != mirror_dir:
+        os.rename(fetch_dir, mirror_dir)
+    return True
+
+def update_mirror(repo_url, mirror_dir, changeset):
+    """ creates a bare mirror of the repo in mirror_dir, or fetches new commits
+        into an existing mirror unless it has the changeset already. A commit
+        pinned by its full hash is fetched alone, which for repos with long
+        histories is much cheaper than creating or updating the whole mirror.
+        param changeset is None, a commit hash or a branch or tag name
+    """
+    with MirrorLock(mirror_dir):
+        if changeset != None and is_commit_hash(changeset) and \
+           os.path.exists(mirror_dir) and has_commit(mirror_dir, changeset):
+            print('git mirror of', repo_url, 'has', changeset, 'alrdy')
+        elif changeset != None and is_full_commit_hash(changeset) and \
+             fetch_commit_into_mirror(repo_url, mirror_dir, changeset):
+            pass
+        elif not os.path.exists(mirror_dir):
+            # atomic rename in case an earlier process run left a half-clone
+            mirror_dir_temp = mirror_dir + ".tmp"
+            if os.path.exists(mirror_dir_temp):
+                shutil.rmtree(mirror_dir_temp)
+            _git(['clone', '--mirror', repo_url, mirror_dir_temp])
+            os.rename(mirror_dir_temp, mirror_dir)
+        elif is_shallow_repo(mirror_dir):
+            # branches, tags & abbreviated hashes need the whole history:
+            _git(['fetch', '--unshallow', 'origin'], cwd = mirror_dir)
+            _set_mirror_head(mirror_dir)
+        else:
+            # no --prune, which would delete the refs/bru/* refs keeping
+            # commits fetched by fetch_commit_into_mirror() reachable:
+            _git(['fetch', 'origin'], cwd = mirror_dir)
+
+def git_clone_from_mirror(repo_url, clone_root_dir, mirror_root):
+    """ like git_clone(), but clones from a local bare mirror of repo_url in
+        mirror_root, so that repeated installs of the same repo only fetch
+        commits the mirror doesn't have yet. The local clone hardlinks the
+        mirror's objects, so it's cheap in both time & disk space.
+    """
+    (repo_url, changeset) = split_off_changeset(repo_url)
+    mirror_dir = get_mirror_dir(mirror_root, repo_url)
+    start_time = time.time()
+    update_mirror(repo_url, mirror_dir, changeset)
+    _git(['clone', '--local', mirror_dir, clone_root_dir])
+    if changeset != None:
+        if is_full_commit_hash(changeset) and \
+           not has_commit(clone_root_dir, changeset):
+            # only reachable via refs/bru/$changeset, which aren't cloned:
+            _git(['fetch', 'origin', changeset], cwd = clone_root_dir)
+        _git(['checkout', changeset], cwd = clone_root_dir)
+    # so that a 'git pull' in the clone talks to the real upstream repo:
+    _git(['remote', 'set-url', 'origin', repo_url], cwd = clone_root_dir)
+    print_clone_stats(clone_root_dir, start_time)
+
 def _atomic_clone_repo(repo_url, module_dir, exec_clone):
     """ This executes an svn checkout or a git clone, taking care of the atomic
         rename of the clone to deal with interrupted clones (without implementing
@@ -74,9 +302,11 @@ def _atomic_clone_repo(repo_url, module_dir, exec_clone):
         exec_clone(repo_url, svn_root_temp)
         os.rename(svn_root_temp, svn_root)
 
-def atomic_clone_repo(repo_url_with_prefix, module_dir):
+def atomic_clone_repo(repo_url_with_prefix, module_dir, mirror_root = None):
     """ param repo_url_with_prefix should have a prefix designating the
         scm tool, e.g. 'git+http://' or 'svn+http://'
+        param mirror_root is an optional dir (e.g. ~/.bru/mirrors) for bare
+              mirrors of git repos, which git clones are then made from
     """
     plus_index = repo_url_with_prefix.find('+')
     if plus_index == -1:
@@ -89,5 +319,8 @@ def atomic_clone_repo(repo_url_with_prefix, module_dir):
     if not prefix in prefix2cloner:
         raise Exception("unknown url prefix {} in {}".format(prefix, repo_url_with_prefix))
     cloner = prefix2cloner[prefix]
+    if prefix == 'git+' and mirror_root != None:
+        cloner = lambda repo_url, clone_root_dir: \
+            git_clone_from_mirror(repo_url, clone_root_dir, mirror_root)
     repo_url = remove_url_prefix(repo_url_with_prefix, prefix)
     _atomic_clone_repo(repo_url, module_dir, cloner)
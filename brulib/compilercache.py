@@ -0,0 +1,139 @@
+""" wires a compiler cache like ccache or sccache into the builds of 'bru make
+    --compiler-cache', via the CC & CXX environment variables which gyp's make
+    and ninja generators pick up. So modules compiled before with the same
+    sources & flags (e.g. in an earlier CI run) are fetched from the cache
+    instead of being compiled again. The cache's statistics before & after
+    the build yield the hit rate reported at the end of the build.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import os
+import json
+import subprocess
+import brulib.util
+
+# in order of preference for 'auto'
+COMPILER_CACHES = ['ccache', 'sccache']
+
+def find_compiler_cache(compiler_cache):
+    """ param compiler_cache is one of COMPILER_CACHES, or 'auto' for the
+        first of these which is in the PATH.
+        Returns the compiler cache, raises if it's not installed.
+    """
+    candidates = COMPILER_CACHES if compiler_cache == 'auto' \
+                 else [compiler_cache]
+    for candidate in candidates:
+        if not candidate in COMPILER_CACHES:
+            raise Exception('unknown compiler cache {}, choose one of {}'
+                            .format(candidate, COMPILER_CACHES))
+        if brulib.util.which(candidate) != None:
+            return candidate
+    raise Exception('did not find {} in your PATH, please install it'
+                    .format(' or '.join(candidates)))
+
+def get_compiler_env(compiler_cache, environ):
+    """ returns the environment variables to set for compiling via the cache,
+        e.g. {'CC': 'ccache cc', 'CXX': 'ccache c++', ...}. Compilers set in
+        environ alrdy are wrapped by the cache, unless they're wrapped alrdy.
+        The linker is set to the plain C++ compiler, since links can't be
+        cached anyway.
+        param environ is usually os.environ
+    """
+    env = {}
+    for var, default in [('CC', 'cc'), ('CXX', 'c++')]:
+        compiler = environ.get(var, default)
+        if os.path.basename(compiler.split()[0]) == compiler_cache:
+            env[var] = compiler
+        else:
+            env[var] = '{} {}'.format(compiler_cache, compiler)
+    linker = environ.get('CXX', 'c++')
+    if os.path.basename(linker.split()[0]) == compiler_cache:
+        linker = ' '.join(linker.split()[1:])
+    for var in ['LINK', 'LD']: # for gyp's make & ninja generators
+        env[var] = environ.get(var, linker)
+    return env
+
+def parse_ccache_stats(output):
+    """ param output is the output of 'ccache --print-stats', which are
+        tab-separated lines like 'direct_cache_hit\t42'
+        Returns a tuple (hits, misses)
+    """
+    stats = {}
+    for line in output.splitlines():
+        fields = line.split('\t')
+        if len(fields) == 2 and fields[1].strip().isdigit():
+            stats[fields[0]] = int(fields[1])
+    hits = stats.get('direct_cache_hit', 0) + \
+           stats.get('preprocessed_cache_hit', 0)
+    return (hits, stats.get('cache_miss', 0))
+
+def parse_sccache_stats(output):
+    """ param output is the output of 'sccache --show-stats --stats-format
+        json', which counts hits & misses per language
+        Returns a tuple (hits, misses)
+    """
+    stats = json.loads(output)['stats']
+    def get_count(key):
+        return sum(stats.get(key, {}).get('counts', {}).values())
+    return (get_count('cache_hits'), get_count('cache_misses'))
+
+def get_stats(compiler_cache):
+    """ returns a tuple (hits, misses) counted by the compiler cache so far,
+        or None if the cache's stats could not be determined (e.g. because
+        the installed version is too old to print machine-readable stats)
+    """
+    (cmdline, parse) = {
+        'ccache': (['ccache', '--print-stats'], parse_ccache_stats),
+        'sccache': (['sccache', '--show-stats', '--stats-format', 'json'],
+                    parse_sccache_stats)
+    }[compiler_cache]
+    try:
+        with open(os.devnull, 'w') as devnull:
+            output = subprocess.check_output(cmdline, stderr = devnull,
+                                             universal_newlines = True)
+        return parse(output)
+    except (OSError, ValueError, KeyError, subprocess.CalledProcessError):
+        return None
+
+def print_hit_rate(compiler_cache, stats_before, stats_after):
+    if stats_before == None or stats_after == None:
+        print('could not get the hit rate from', compiler_cache)
+        return
+    hits = stats_after[0] - stats_before[0]
+    misses = stats_after[1] - stats_before[1]
+    if hits + misses == 0:
+        print('{}: no cacheable compilations'.format(compiler_cache))
+        return
+    print('{}: {} hits, {} misses, {:.0f}% hit rate'.format(compiler_cache,
+          hits, misses, 100.0 * hits / (hits + misses)))
+
+class CompilerCacheEnv:
+    """ Context manager which sets the environment variables for compiling
+        via the compiler cache, restoring them on exit, and prints the
+        cache's hit rate for whatever was compiled in between.
+    """
+    def __init__(self, compiler_cache):
+        """ param compiler_cache is one of COMPILER_CACHES or 'auto' """
+        self.compiler_cache = find_compiler_cache(compiler_cache)
+
+    def __enter__(self):
+        env = get_compiler_env(self.compiler_cache, os.environ)
+        self.saved_env = dict((var, os.environ.get(var)) for var in env)
+        for var, value in sorted(env.items()):
+            print('{}={}'.format(var, value))
+        os.environ.update(env)
+        self.stats_before = get_stats(self.compiler_cache)
+        return self
+
+    def __exit__(self, etype, value, traceback):
+        for var, saved_value in self.saved_env.items():
+            if saved_value == None:
+                del os.environ[var]
+            else:
+                os.environ[var] = saved_value
+        print_hit_rate(self.compiler_cache, self.stats_before,
+                       get_stats(self.compiler_cache))
@@ -0,0 +1,76 @@
+""" gyp does not support glob exprs in 'sources', so copy_gyp expands them.
+    For large modules (e.g. boost-log) that's a lot of directory scans on each
+    'bru install', even though the expansions only change when the module's
+    files were unpacked again. So this here caches these expansions in
+    bru_modules/$module/bru-glob-cache.json.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import os
+import glob
+import collections
+import brulib.jsonc
+
+def get_unpack_stamp(module_dir):
+    """ returns a list of [name, mtime] for the marker files that were written
+        when the module's content was unpacked (or cloned, or configured) into
+        module_dir, e.g. bru_modules/zlib/1.2.8. Glob expansions are valid as
+        long as this stamp remains the same.
+    """
+    if not os.path.isdir(module_dir):
+        return []
+    stamp = []
+    for name in sorted(os.listdir(module_dir)):
+        if name.endswith('.unpack_done') or name.endswith('.unpack_partial') \
+           or name in ['make_command.done', 'clone']:
+            stat = os.stat(os.path.join(module_dir, name))
+            stamp.append([name, getattr(stat, 'st_mtime_ns', stat.st_mtime)])
+    return stamp
+
+class GlobCache:
+    """ caches glob expansions for a single module version """
+
+    def __init__(self, gyp_target_dir, module_version):
+        """ param gyp_target_dir is the dir the module's gyp file is stored in,
+                  e.g. bru_modules/zlib, glob exprs are relative to that dir
+            param module_version e.g. 1.2.8
+        """
+        self._gyp_target_dir = gyp_target_dir
+        self._file_name = os.path.join(gyp_target_dir, 'bru-glob-cache.json')
+        self._version = module_version
+        self._stamp = get_unpack_stamp(os.path.join(gyp_target_dir, module_version))
+        self._globs = collections.OrderedDict()
+        if os.path.exists(self._file_name):
+            cache = brulib.jsonc.loadfile(self._file_name)
+            if cache.get('version') == module_version and \
+               cache.get('stamp') == self._stamp:
+                self._globs = cache['globs']
+
+    def glob(self, glob_expr):
+        """ returns the files matching glob_expr, with glob_expr and the
+            returned file names being relative to gyp_target_dir """
+        if glob_expr in self._globs:
+            return self._globs[glob_expr]
+        matches = [os.path.relpath(filename, start=self._gyp_target_dir)
+                   .replace('\\', '/') # otherwise sources! on windows will not match
+                   for filename in
+                   glob.glob(os.path.join(self._gyp_target_dir, glob_expr))]
+        # Nothing was unpacked yet if the stamp is empty, in which case there's
+        # nothing the cached expansion could be validated against later:
+        if len(self._stamp) > 0:
+            self._globs[glob_expr] = matches
+        return matches
+
+    def save(self):
+        if len(self._stamp) == 0:
+            return
+        brulib.jsonc.savefile_if_changed(self._file_name,
+            collections.OrderedDict([
+                ('version', self._version),
+                ('stamp', self._stamp),
+                ('globs', self._globs)
+            ]))
@@ -0,0 +1,173 @@
+""" algorithms on directed graphs, like the graph of module dependencies or
+    the graph of #includes: strongly connected components (SCCs), the
+    condensation DAG of the SCCs and topological orders, all in linear time.
+    Graphs are passed as dicts mapping each node to the nodes it has arcs to
+    (nodes that are only arc targets count as nodes without arcs), and are
+    converted into a compact Digraph of node indexes internally.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+class CycleError(Exception):
+    """ raised by topological_order() if the graph has a cycle """
+
+    def __init__(self, cycle):
+        Exception.__init__(self, 'cycle in graph: {}'.format(cycle))
+        self.cycle = cycle
+
+class Digraph:
+    """ a directed graph with nodes numbered 0..n-1 in the order they were
+        added, and each node's arcs stored as a list of target node indexes.
+        Nodes can be any hashable objects.
+    """
+
+    def __init__(self):
+        self.nodes = []      # index -> node
+        self.node2index = {} # node -> index
+        self.arcs = []       # index -> list of target indexes
+
+    def add_node(self, node):
+        """ adds the node unless the graph has it alrdy, returns its index """
+        index = self.node2index.get(node)
+        if index == None:
+            index = len(self.nodes)
+            self.nodes.append(node)
+            self.node2index[node] = index
+            self.arcs.append([])
+        return index
+
+    def add_arc(self, source, target):
+        self.arcs[self.add_node(source)].append(self.add_node(target))
+
+    def __len__(self):
+        return len(self.nodes)
+
+    @staticmethod
+    def from_dict(node2arc_targets):
+        """ param node2arc_targets e.g. {'boost-regex': ['boost-config', ...]}
+            Nodes are numbered in the dict's iteration order, so pass an
+            OrderedDict for deterministic results.
+        """
+        graph = Digraph()
+        for node in node2arc_targets.keys():
+            graph.add_node(node)
+        for node, arc_targets in node2arc_targets.items():
+            for arc_target in arc_targets:
+                graph.add_arc(node, arc_target)
+        return graph
+
+def _get_digraph(graph):
+    return graph if isinstance(graph, Digraph) else Digraph.from_dict(graph)
+
+def get_scc_indexes(digraph):
+    """ returns the SCCs of the Digraph as lists of node indexes, computed
+        by an iterative version of Tarjan's algorithm (so that long chains
+        of #includes don't exceed Python's recursion limit). Each SCC comes
+        after all the SCCs it has arcs to, and the nodes within an SCC are
+        sorted by index.
+    """
+    node_count = len(digraph)
+    arcs = digraph.arcs
+    index = [-1] * node_count
+    lowlink = [0] * node_count
+    on_stack = [False] * node_count
+    stack = []
+    sccs = []
+    next_index = 0
+    for root in range(node_count):
+        if index[root] != -1:
+            continue
+        index[root] = lowlink[root] = next_index
+        next_index += 1
+        stack.append(root)
+        on_stack[root] = True
+        work = [(root, 0)] # node and the position of its next arc to visit
+        while len(work) > 0:
+            (node, arc_pos) = work[-1]
+            node_arcs = arcs[node]
+            descended = False
+            while arc_pos < len(node_arcs):
+                child = node_arcs[arc_pos]
+                arc_pos += 1
+                if index[child] == -1:
+                    work[-1] = (node, arc_pos)
+                    index[child] = lowlink[child] = next_index
+                    next_index += 1
+                    stack.append(child)
+                    on_stack[child] = True
+                    work.append((child, 0))
+                    descended = True
+                    break
+                if on_stack[child] and index[child] < lowlink[node]:
+                    lowlink[node] = index[child]
+            if descended:
+                continue
+            work.pop()
+            if len(work) > 0:
+                parent = work[-1][0]
+                if lowlink[node] < lowlink[parent]:
+                    lowlink[parent] = lowlink[node]
+            if lowlink[node] == index[node]:
+                scc = []
+                while True:
+                    member = stack.pop()
+                    on_stack[member] = False
+                    scc.append(member)
+                    if member == node:
+                        break
+                scc.sort()
+                sccs.append(scc)
+    return sccs
+
+def strongly_connected_components(graph):
+    """ param graph is a dict node -> arc targets, or a Digraph
+        Returns the SCCs as lists of nodes, each SCC after all the SCCs it
+        has arcs to. So for a graph of module deps modules come after their
+        deps, which is the order to build them in.
+    """
+    digraph = _get_digraph(graph)
+    return [[digraph.nodes[index] for index in scc]
+            for scc in get_scc_indexes(digraph)]
+
+def condensation(graph):
+    """ returns a tuple (components, component_arcs) describing the DAG of
+        the graph's SCCs: components is the list of SCCs as returned by
+        strongly_connected_components(), and component_arcs[i] the sorted
+        list of components that component i has arcs to. Since each SCC
+        comes after the ones it has arcs to these are all less than i.
+    """
+    digraph = _get_digraph(graph)
+    sccs = get_scc_indexes(digraph)
+    node2component = [0] * len(digraph)
+    for component, scc in enumerate(sccs):
+        for node in scc:
+            node2component[node] = component
+    component_arcs = []
+    for component, scc in enumerate(sccs):
+        targets = set(node2component[target]
+                      for node in scc for target in digraph.arcs[node])
+        targets.discard(component)
+        component_arcs.append(sorted(targets))
+    components = [[digraph.nodes[node] for node in scc] for scc in sccs]
+    return (components, component_arcs)
+
+def find_cycles(graph):
+    """ returns the SCCs with more than one node, i.e. the (unions of)
+        cycles in the graph, ignoring arcs from nodes to themselves """
+    return [scc for scc in strongly_connected_components(graph)
+            if len(scc) > 1]
+
+def topological_order(graph):
+    """ returns the graph's nodes ordered such that each node comes before
+        the nodes it has arcs to, raises CycleError if there's no such order
+    """
+    digraph = _get_digraph(graph)
+    ordered = []
+    for scc in reversed(get_scc_indexes(digraph)):
+        if len(scc) > 1 or scc[0] in digraph.arcs[scc[0]]:
+            raise CycleError([digraph.nodes[node] for node in scc])
+        ordered.append(digraph.nodes[scc[0]])
+    return ordered
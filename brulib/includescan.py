@@ -0,0 +1,226 @@
+""" scans C and C++ files for #includes, used by scan_deps.py. Each file is
+    mmapped and scanned by a single regex that skips over comments and
+    string literals (so that a commented out #include doesn't count) and
+    that deals with line continuations. Large sets of files are scanned by
+    a pool of processes, and the results can be cached across runs in an
+    IncludeCache.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import os
+import re
+import mmap
+import json
+import itertools
+import threading
+import multiprocessing
+import brulib.util
+
+# Whitespace within a preprocessor directive, including backslash-newline
+# line continuations:
+_WS = br'(?:[ \t]|\\\r?\n)*'
+
+# the #include directive, not including the newline preceding it:
+_INCLUDE = br'[ \t]*\#' + _WS + br'include(?:_next)?' + _WS + \
+           br'(?:<([^>\n]*)>|"([^"\n]*)")'
+
+# Comments and string literals are matched only to skip over them, only the
+# last alternative matches #include directives. Since finditer() never
+# returns overlapping matches an '#include' within a comment or string is
+# consumed as part of the comment or string. Each alternative starts with a
+# literal char, which lets the regex engine skip quickly to the next
+# candidate position. That's why #includes are matched along with the
+# preceding newline, instead of via '^'.
+_TOKEN_REGEX = re.compile(
+    br'//(?:[^\n\\]|\\.)*'                       # line comment, may be continued
+    br'|/\*[^*]*(?:\*+[^*/][^*]*)*(?:\*+/|\Z)'    # block comment
+    br'|"(?:[^"\\\n]|\\.)*"'                     # string literal
+    br"|'(?:[^'\\\n]|\\.)*'"                     # char literal
+    br'|\n' + _INCLUDE,
+    re.DOTALL)
+
+# for an #include in the first line, which isn't preceded by a newline but
+# maybe by a UTF-8 byte order mark
+_FIRST_LINE_REGEX = re.compile(br'(?:\xef\xbb\xbf)?' + _INCLUDE)
+
+def get_includes_from_buffer(buf):
+    """ returns the list of files #included in buf (bytes or an mmap), in
+        the order they are included, as unicode strings """
+    includes = []
+    # there's no need to tokenize the (often large) rest of the file after
+    # the line with the last #include:
+    last_include = buf.rfind(b'include')
+    if last_include == -1:
+        return includes
+    end = buf.find(b'\n', last_include)
+    # the line may be continued, e.g. '#include \\\n <foo.h>':
+    while end != -1 and (buf[end-1:end] == b'\\' or
+                         buf[end-2:end] == b'\\\r'):
+        end = buf.find(b'\n', end + 1)
+    end = end if end != -1 else len(buf)
+    first_line_match = _FIRST_LINE_REGEX.match(buf, 0, end)
+    matches = _TOKEN_REGEX.finditer(buf, first_line_match.end()
+                                    if first_line_match != None else 0, end)
+    if first_line_match != None:
+        matches = itertools.chain([first_line_match], matches)
+    for match in matches:
+        included_file = match.group(1) if match.group(1) != None \
+                        else match.group(2)
+        if included_file != None:
+            includes.append(included_file.decode('utf8', 'replace'))
+    return includes
+
+def get_includes(filename):
+    """ returns the list of files #included by the given cpp or hpp file.
+        Files that cannot be read are reported and yield an empty list.
+    """
+    try:
+        with open(filename, 'rb') as file:
+            if os.fstat(file.fileno()).st_size == 0:
+                return [] # mmap cannot map empty files
+            buf = mmap.mmap(file.fileno(), 0, access = mmap.ACCESS_READ)
+            try:
+                return get_includes_from_buffer(buf)
+            finally:
+                buf.close()
+    except (IOError, OSError) as err:
+        print("WARNING: could not get includes from", filename, err)
+        return []
+
+def _get_includes_item(filename):
+    """ for Pool.imap, which needs a picklable module-level func """
+    return (filename, get_includes(filename))
+
+class IncludeCache:
+    """ persists the #includes of scanned files in a JSON file (e.g. in
+        bru_modules/bru-include-cache.json), keyed by each file's path, size
+        and mtime. So files that didn't change since they were scanned last
+        (typically all of them, since unpacked modules rarely change) don't
+        need to be read again, no matter which module or scan_deps.py run
+        scans them.
+    """
+
+    CACHE_VERSION = 1
+
+    def __init__(self, cache_file):
+        self._cache_file = cache_file
+        self._files = {} # path -> [size, mtime, includes]
+        self._dirty = False
+        self._lock = threading.Lock()
+        if os.path.exists(cache_file):
+            # plain json rather than brulib.jsonc since this file can get big
+            # and is never edited by hand:
+            with open(cache_file) as file:
+                cache = json.load(file)
+            if cache.get('version') == IncludeCache.CACHE_VERSION:
+                self._files = cache['files']
+
+    @staticmethod
+    def _get_signature(filename):
+        """ returns [size, mtime] of the file, or None if it doesn't exist """
+        try:
+            stat = os.stat(filename)
+        except OSError:
+            return None
+        return [stat.st_size, getattr(stat, 'st_mtime_ns', stat.st_mtime)]
+
+    def get(self, filename):
+        """ returns the cached #includes of the file, or None if the file
+            changed since it was scanned (or was never scanned) """
+        signature = IncludeCache._get_signature(filename)
+        with self._lock:
+            entry = self._files.get(os.path.normpath(filename))
+        if signature == None or entry == None or entry[:2] != signature:
+            return None
+        return entry[2]
+
+    def put(self, filename, includes):
+        signature = IncludeCache._get_signature(filename)
+        if signature == None:
+            return
+        with self._lock:
+            self._files[os.path.normpath(filename)] = signature + [includes]
+            self._dirty = True
+
+    def save(self):
+        """ writes the cache file if anything was added since loading it """
+        with self._lock:
+            if not self._dirty:
+                return
+            dirname = os.path.dirname(self._cache_file)
+            if len(dirname) > 0:
+                brulib.util.mkdir_p(dirname)
+            temp_file = self._cache_file + '.tmp'
+            with open(temp_file, 'w') as file:
+                json.dump({'version': IncludeCache.CACHE_VERSION,
+                           'files': self._files}, file)
+            brulib.util.replace_file(temp_file, self._cache_file)
+            self._dirty = False
+
+class IncludeScanner:
+    """ scans files for #includes, using a pool of processes for large sets
+        of files. The pool is created on first use and kept until close(),
+        so a single scanner should be used for scanning many modules.
+    """
+
+    # below this many files the pool's overhead isn't worth it
+    min_files_for_pool = 64
+
+    def __init__(self, jobs = None, cache = None):
+        """ param jobs is the number of processes, defaults to the number
+                  of CPU cores
+            param cache is an optional IncludeCache, which is saved on
+                  close()
+        """
+        self._jobs = jobs if jobs != None else brulib.util.get_default_job_count()
+        self._cache = cache
+        self._pool = None
+        self._pool_lock = threading.Lock() # for scans from several threads
+
+    def _scan_uncached(self, filenames):
+        if self._jobs <= 1 or len(filenames) < IncludeScanner.min_files_for_pool:
+            return dict(_get_includes_item(filename) for filename in filenames)
+        with self._pool_lock:
+            if self._pool == None:
+                self._pool = multiprocessing.Pool(self._jobs)
+        chunksize = max(1, len(filenames) // (self._jobs * 8))
+        return dict(self._pool.imap_unordered(_get_includes_item, filenames,
+                                              chunksize))
+
+    def scan(self, filenames):
+        """ returns a dict mapping each of the filenames to the list of files
+            it #includes """
+        filenames = list(filenames)
+        if self._cache == None:
+            return self._scan_uncached(filenames)
+        result = {}
+        misses = []
+        for filename in filenames:
+            includes = self._cache.get(filename)
+            if includes != None:
+                result[filename] = includes
+            else:
+                misses.append(filename)
+        scanned = self._scan_uncached(misses)
+        for filename, includes in scanned.items():
+            self._cache.put(filename, includes)
+        result.update(scanned)
+        return result
+
+    def close(self):
+        if self._pool != None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+        if self._cache != None:
+            self._cache.save()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, etype, value, traceback):
+        self.close()
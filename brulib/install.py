@@ -11,13 +11,20 @@ import os
 import re
 import glob
 import shutil
+import copy
 import filecmp
 import platform
 import collections
 import subprocess
+import time
+import concurrent.futures
 import brulib.jsonc
+import brulib.globcache
+import brulib.graph
 import brulib.make
+import brulib.lockfile
 import brulib.module_downloader
+import brulib.resolver
 
 class Installable:
     def __init__(self, module, version):
@@ -148,22 +155,6 @@ def create_gyp_file(gyp_filename):
     ])
     brulib.jsonc.savefile(gyp_filename, gyp)
 
-# from http://stackoverflow.com/questions/431684/how-do-i-cd-in-python
-class Chdir:
-    """ Context manager for changing the current working directory.
-        Used in conjunction with os.system for executing $make_command,
-        typically used to run ./configure
-    """
-    def __init__( self, newPath ):
-        self.newPath = newPath
-
-    def __enter__(self):
-        self.savedPath = os.getcwd()
-        os.chdir(self.newPath)
-
-    def __exit__(self, etype, value, traceback):
-        os.chdir(self.savedPath)
-
 def touch(file_name, times=None):
     # http://stackoverflow.com/questions/1158076/implement-touch-using-python
     with open(file_name, 'a'):
@@ -229,23 +220,87 @@ def exec_make_command(formula, bru_modules_root, system):
 
             # exec make_command with cwd being the module_dir (so the dir the
             # gyp file is in, not that the gyp file is used here, but using the
-            # same base dir for the gyp & make_command probably makes sense)
-            with Chdir(module_dir):
-                print("building via '{}' ...".format(make_command))
-                error_code = os.system(make_command)
-                if error_code != 0:
-                    raise ValueError("build failed with error code {}".format(error_code))
+            # same base dir for the gyp & make_command probably makes sense).
+            # Several make_commands may run concurrently, so their output
+            # goes to a log file per module:
+            log_file = os.path.join(module_dir, 'make_command.log')
+            print("building {} via '{}' ... (log in {})".format(
+                  formula['module'], make_command, log_file))
+            start_time = time.time()
+            with open(log_file, 'w') as log:
+                error_code = subprocess.call(make_command, shell=True,
+                    cwd=module_dir, stdout=log, stderr=subprocess.STDOUT)
+            if error_code != 0:
+                with open(log_file) as log:
+                    print(''.join(log.readlines()[-20:]))
+                raise ValueError("build of {} failed with error code {}, see {}"
+                                 .format(formula['module'], error_code, log_file))
+            print('built {} in {:.1f}s'.format(formula['module'],
+                  time.time() - start_time))
             touch(make_done_file)
 
-def download_module(library, module_name, module_version, targetPlatform):
-    bru_modules_root = "./bru_modules"
-    formula = library.load_formula(module_name, module_version)
-    brulib.module_downloader.get_urls(library, formula, bru_modules_root)
-    if targetPlatform == 'Native':
-        exec_make_command(formula, bru_modules_root, platform.system())
-    else:
-        exec_make_command(formula, bru_modules_root, targetPlatform)
-        
+def for_each_module(func, formulas, jobs):
+    """ calls func(formula) for each formula, running up to $jobs calls
+        concurrently in a thread pool. Re-raises the first exception any of
+        these calls raised (after all calls completed).
+    """
+    if jobs <= 1:
+        for formula in formulas:
+            func(formula)
+        return
+    with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+        futures = [executor.submit(func, formula) for formula in formulas]
+        for future in futures:
+            future.result()
+
+def get_dependency_graph(formulas):
+    """ returns an OrderedDict mapping each formula's module to the list of
+        modules it depends on, ignoring dependencies on modules not in the
+        given list of formulas """
+    modules = set(formula['module'] for formula in formulas)
+    dep_graph = collections.OrderedDict()
+    for formula in formulas:
+        deps = formula['dependencies'] if 'dependencies' in formula else {}
+        dep_graph[formula['module']] = [dep for dep in deps.keys()
+                                        if dep in modules]
+    return dep_graph
+
+def get_dependency_levels(formulas):
+    """ groups the given formulas into levels such that each module's deps
+        are in earlier levels, so that the modules within a level can be
+        built concurrently. Each level is a list of lists of formulas: these
+        inner lists are single modules, except for modules in a dependency
+        cycle, which need to be built one after the other.
+    """
+    module2formula = dict((formula['module'], formula) for formula in formulas)
+    (components, component_arcs) = brulib.graph.condensation(
+        get_dependency_graph(formulas))
+    component_levels = []
+    levels = []
+    # each component only has arcs to components before it:
+    for component, arc_targets in enumerate(component_arcs):
+        level = max([component_levels[target] + 1 for target in arc_targets]
+                    + [0])
+        component_levels.append(level)
+        if level == len(levels):
+            levels.append([])
+        levels[level].append([module2formula[module]
+                              for module in components[component]])
+    return levels
+
+def exec_make_commands(formulas, bru_modules_root, system, jobs):
+    """ executes the make_commands of the given formulas, with upstream modules
+        being built before the modules depending on them, and with up to $jobs
+        make_commands of independent modules running concurrently.
+    """
+    def exec_make_commands_in_order(cycle):
+        for formula in cycle:
+            exec_make_command(formula, bru_modules_root, system)
+    for level in get_dependency_levels(formulas):
+        cycles = [cycle for cycle in level
+                  if any('make_command' in formula for formula in cycle)]
+        for_each_module(exec_make_commands_in_order, cycles, jobs)
+
 def verify_resolved_dependencies(formula, target, resolved_dependencies):
     """ param formula is the formula with a bunch of desired(!) dependencies
         which after conflict resolution across the whole set of diverse deps
@@ -288,25 +343,26 @@ def verify_resolved_dependencies(formula, target, resolved_dependencies):
         return resolved_dependencies[upstream_module]
     return list(map(map_dependency, target['dependencies']))
 
-def apply_glob_exprs(formula, sources):
+def apply_glob_exprs(formula, sources, glob_cache=None):
     """ gyp does not support glob expression or wildcards in 'sources', this
         here turns these glob expressions into a list of source files.
         param sources is target['sources'] or target['sources!']
+        param glob_cache is an optional brulib.globcache.GlobCache for this
+              formula
     """
     def is_glob_expr(source):
         return '*' in source
     gyp_target_dir = os.path.join('bru_modules', formula['module']) # that is
         # the dir the gyp file for this module is being stored in, so paths
         # in the gyp file are interpreted relative to that
+    if glob_cache == None:
+        glob_cache = brulib.globcache.GlobCache(gyp_target_dir, formula['version'])
     result = []
     for source in sources:
         if source.startswith('ant:'):
             raise Exception('Ant-style glob exprs no longer supported: ' + source)
         if is_glob_expr(source):
-            matching_sources = [os.path.relpath(filename, start=gyp_target_dir)
-                                .replace('\\', '/') # otherwise sources! on windows will not match
-                                for filename in
-                                glob.glob(os.path.join(gyp_target_dir, source))]
+            matching_sources = glob_cache.glob(source)
             assert len(matching_sources) > 0, "no matches for glob " + source
             result += matching_sources
         else:
@@ -330,13 +386,13 @@ def apply_recursive(dic, func):
         for elem in dic:
             apply_recursive(elem, func)
 
-def apply_glob_to_sources(dic, formula):
+def apply_glob_to_sources(dic, formula, glob_cache=None):
     """ param dic is a 'target' dictionary, or one of the childnodes
         in a 'conditions' list
     """
     for prop in ['sources', 'sources!']:
         if prop in dic:
-            dic[prop] = apply_glob_exprs(formula, dic[prop])
+            dic[prop] = apply_glob_exprs(formula, dic[prop], glob_cache)
 
 def copy_gyp(library, formula, resolved_dependencies):
     """
@@ -360,7 +416,9 @@ def copy_gyp(library, formula, resolved_dependencies):
     module_name = formula['module']
     assert module_name in resolved_dependencies
     resolved_version = resolved_dependencies[module_name]
-    gyp = library.load_gyp(formula)
+    gyp = copy.deepcopy(library.load_gyp(formula)) # modified below
+    glob_cache = brulib.globcache.GlobCache(
+        os.path.join('bru_modules', module_name), formula['version'])
     for target in gyp['targets']:
 
         if 'dependencies' in target:
@@ -396,8 +454,9 @@ def copy_gyp(library, formula, resolved_dependencies):
         # like that.
         # Apply the same mapping to 'sources' in the 'target' itelf and within
         # its childnodes like 'conditions':
-        apply_recursive(target, lambda dic: apply_glob_to_sources(dic, formula))
-
+        apply_recursive(target,
+            lambda dic: apply_glob_to_sources(dic, formula, glob_cache))
+    glob_cache.save()
 
     # note that library/boost-regex/1.57.0.gyp is being copied to
     # bru_modules/boost-regex/boost-regex.gyp here (with some minor
@@ -420,68 +479,78 @@ def copy_gyp(library, formula, resolved_dependencies):
             new_gyp[key] = value
         gyp = new_gyp
 
-    brulib.jsonc.savefile(gyp_target_file, gyp)
+    # Only write files whose content changed, so that a repeated install
+    # doesn't bump mtimes (which would make gyp & make redo their work):
+    if brulib.jsonc.savefile_if_changed(gyp_target_file, gyp):
+        print('updated', gyp_target_file)
 
     # this file is only saved for human reader's sake atm:
-    brulib.jsonc.savefile(os.path.join('bru_modules', module_name, 'bru-version.json'),
+    brulib.jsonc.savefile_if_changed(
+        os.path.join('bru_modules', module_name, 'bru-version.json'),
         {'version': resolved_version})
 
 def resolve_conflicts(library, dependencies, root_requestor):
-    """ takes a dict of modules and version matchers and recursively finds
-        all indirect deps. Then resolves version conflicts by picking the newer
-        of competing deps, or by picking the version that was requested by the module
-        closest to the root of the dependency tree (unsure still).
+    """ takes a dict of modules and version specs (e.g. '1.57.0', '1.57.*' or
+        '>=1.2') and recursively finds all indirect deps. Then resolves version
+        conflicts by picking a set of module versions matching all specs,
+        preferring newer versions. Raises if there is no such set.
         param root_requestor is whatever topmost *.bru listed deps, e.g. 'package.bru'
+        Returns a list of tuples (module, version, requestor).
     """
-    todo = [(module, version, root_requestor) for (module, version)
-            in dependencies.items()]
-    recursive_deps = collections.OrderedDict()
-    for module_name, version_matcher, requestor in todo:
-        module_version = version_matcher # todo: allow for npm-style version specs (e.g. '4.*')
-        #print('resolving dependency {} version {} requested by {}'
-        #      .format(module_name, module_version, requestor))
-        if module_name in recursive_deps:
-            resolved = recursive_deps[module_name]
-            resolved_version = resolved['version']
-            if module_version != resolved_version:
-                winning_requestor = resolved['requestor']
-                print("WARNING: version conflict for {} requested by first {} and then {}"
-                      .format(module_name, winning_requestor, requestor))
-                # instead of just letting the 2nd and later requestors loose
-                # the competition we could probably do something more sensible.
-                # todo?
-        else:
-            # this is the first time this module was requested, freeze that
-            # chosen version:
-            formula = library.load_formula(module_name, module_version)
-            recursive_deps[module_name] = {
-                'version' : module_version,
-                'requestor' : requestor
-            }
-
-            # then descend deeper into the dependency tree:
-            deps = formula['dependencies'] if  'dependencies' in formula else {}
-            child_requestor = module_name
-            todo += [(child_module, version, child_requestor)
-                     for (child_module, version)
-                     in deps.items()]
-
-    return [(module, resolved['version'], resolved['requestor'])
-            for (module, resolved) in recursive_deps.items()]
-
-def install_from_bru_file(bru_filename, library, targetPlatform):
+    resolver = brulib.resolver.Resolver(library)
+    return resolver.resolve(dependencies, root_requestor)
+
+def install_from_bru_file(bru_filename, library, targetPlatform, jobs=1,
+                          lazy=False, link_trees=False):
     """ this gets executed when you 'bru install': it looks for a *.bru file
-        in cwd and downloads the listed deps """
+        in cwd and downloads the listed deps.
+        param jobs is the max number of modules to download & unpack (or
+              to build via make_command) concurrently
+        param lazy: if True then only the parts of tar.gzs are unpacked
+              that the modules' gyp files refer to
+        param link_trees: if True then unpacked trees are hardlinked from
+              the per-user tree cache instead of being copied
+    """
     package_jso = brulib.jsonc.loadfile(bru_filename)
-    recursive_deps = resolve_conflicts(library, package_jso['dependencies'], bru_filename)
+    dependencies = package_jso['dependencies']
+
+    # skip resolving conflicts if the lockfile written by the last successful
+    # install is still up to date:
+    lock_filename = brulib.lockfile.get_lockfile_name(bru_filename)
+    recursive_deps = brulib.lockfile.load_lockfile(lock_filename, library,
+                                                   dependencies)
+    if recursive_deps == None:
+        recursive_deps = resolve_conflicts(library, dependencies, bru_filename)
+    else:
+        print('using dependency versions from', lock_filename)
     resolved_dependencies = dict((module, version)
         for (module, version, requestor) in recursive_deps)
+    formulas = []
     for module_name, module_version, requestor in recursive_deps:
         print('processing dependency {} version {} requested by {}'
               .format(module_name, module_version, requestor))
-        formula = library.load_formula(module_name, module_version)
-        download_module(library, module_name, module_version, targetPlatform)
-        copy_gyp(library, formula, resolved_dependencies)
+        formulas.append(library.load_formula(module_name, module_version))
+
+    # Downloading & unpacking is mostly waiting for the network and for
+    # gzip, and each module is unpacked into its own dir, so this can run
+    # for several modules concurrently. Each module's urls are still
+    # processed in order though, since 'file://' patches are unpacked on top
+    # of previously unpacked tar.gzs.
+    bru_modules_root = "./bru_modules"
+    for_each_module(
+        lambda formula: brulib.module_downloader.get_urls(
+            library, formula, bru_modules_root, lazy, link_trees),
+        formulas, jobs)
+
+    # make_commands (e.g. ./configure) run only after all downloads completed,
+    # with upstream modules being built before the modules depending on them:
+    system = platform.system() if targetPlatform == 'Native' else targetPlatform
+    exec_make_commands(formulas, bru_modules_root, system, jobs)
+
+    # copy_gyp may glob for files created by make_commands, so this comes last:
+    for_each_module(
+        lambda formula: copy_gyp(library, formula, resolved_dependencies),
+        formulas, jobs)
 
     # copy common.gypi which is referenced by module.gyp files and usually
     # also by the parent *.gyp (e.g. bru-sample:foo.gyp).
@@ -509,6 +578,9 @@ def install_from_bru_file(bru_filename, library, targetPlatform):
         print('creating empty {}'.format(overrides_gypi))
         brulib.jsonc.savefile(overrides_gypi, {})
 
+    brulib.lockfile.save_lockfile(lock_filename, library, dependencies,
+                                  recursive_deps)
+
     #for module, version, requestor in recursive_deps:
     #    for ext in ['bru', 'gyp']:
     #        print("git add -f library/{}/{}.{}".format(module, version, ext))
@@ -516,7 +588,8 @@ def install_from_bru_file(bru_filename, library, targetPlatform):
 
     # todo: clean up unused module dependencies from /bru_modules?
 
-def cmd_install(library, installables, targetPlatform="Native"):
+def cmd_install(library, installables, targetPlatform="Native", jobs=1,
+                lazy=False, link_trees=False):
     """ param installables: e.g. [] or ['googlemock@1.7.0', 'boost-regex']
         This is supposed to mimic 'npm install' syntax, see
         https://docs.npmjs.com/cli/install. Examples:
@@ -532,6 +605,15 @@ def cmd_install(library, installables, targetPlatform="Native"):
         install will end up in the local *.bru file's "dependencies" list, as
         well as in the companion *.gyp file.
         Param library is of type brulib.library.Library
+        Param jobs is the max number of modules to download & unpack (or
+        to build via make_command) concurrently.
+        Param lazy: if True then only the parts of downloaded tar.gzs are
+        unpacked that the modules' gyp files refer to, which saves time and
+        disk space e.g. on CI machines. A later install with lazy=False
+        unpacks the rest.
+        Param link_trees: if True then the files of modules unpacked into the
+        per-user tree cache are hardlinked into bru_modules instead of being
+        copied, so they are shared with other projects and are read-only.
     """
     if len(installables) == 0:
         # 'bru install'
@@ -539,7 +621,8 @@ def cmd_install(library, installables, targetPlatform="Native"):
         if bru_filename == None:
             raise Exception("no file *.bru in cwd")
         print('installing dependencies listed in', bru_filename)
-        install_from_bru_file(bru_filename, library, targetPlatform)
+        install_from_bru_file(bru_filename, library, targetPlatform, jobs,
+                              lazy, link_trees)
     else:
         # installables are ['googlemock', 'googlemock@1.7.0']
         # In this case we simply add deps to the *.bru (and *.gyp) file in
@@ -558,4 +641,5 @@ def cmd_install(library, installables, targetPlatform="Native"):
                 bru_filename, gyp_filename))
         # now download the new dependency just like 'bru install' would do
         # after we added the dep to the bru & gyp file:
-        install_from_bru_file(bru_filename, library, targetPlatform)
+        install_from_bru_file(bru_filename, library, targetPlatform, jobs,
+                              lazy, link_trees)
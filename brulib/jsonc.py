@@ -14,6 +14,7 @@ from __future__ import unicode_literals
 import json
 import collections
 import os
+import threading
 import brulib.util
 
 def drop_hash_comment(line):
@@ -69,6 +70,25 @@ def savefile(filename, jso):
     dirname = os.path.dirname(filename)
     if len(dirname) > 0:
         brulib.util.mkdir_p(dirname)
-    with open(filename, 'w') as json_file:
+    # write a temp file unique to this thread and rename it, so that
+    # concurrent readers (e.g. scan_deps.py's threads loading gyp files)
+    # never see a half-written file:
+    temp_file = '{}.{}.{}.tmp'.format(filename, os.getpid(),
+                                      threading.current_thread().ident)
+    with open(temp_file, 'w') as json_file:
         json_file.write(json_text)
-        #print("saved " + filename)
+    brulib.util.replace_file(temp_file, filename)
+
+def savefile_if_changed(filename, jso):
+    """ like savefile, but leaves the file (and its mtime) untouched if it
+        already has the content that savefile would write. This way tools
+        looking at mtimes (like make) won't consider the file modified.
+        Returns True if the file was written.
+    """
+    json_text = json.dumps(jso, indent = 4)
+    if os.path.exists(filename):
+        with open(filename) as json_file:
+            if json_file.read() == json_text:
+                return False
+    savefile(filename, jso)
+    return True
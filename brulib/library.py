@@ -11,16 +11,20 @@ from __future__ import unicode_literals
 
 import os
 import re
+import threading
 import functools
+import collections
 import brulib.jsonc
 
+def to_alphanumeric_pairs(text):
+    """ helper func for module version comparison, splits '1.0.1j' into
+        [1, '.', 0, '.', 1, 'j'] """
+    # from http://stackoverflow.com/questions/2669059/how-to-sort-alpha-numeric-set-in-python
+    convert = lambda text: int(text) if text.isdigit() else text
+    return [ convert(c) for c in re.split('([0-9]+)', text) ]
+
 def alphnumeric_lt(a, b):
     """ helper func for module version comparison """
-    # from http://stackoverflow.com/questions/2669059/how-to-sort-alpha-numeric-set-in-python
-    def to_alphanumeric_pairs(text):
-        convert = lambda text: int(text) if text.isdigit() else text
-        alphanum_key = lambda key: [ convert(c) for c in re.split('([0-9]+)', key) ]
-        return alphanum_key(text)
     return to_alphanumeric_pairs(a) < to_alphanumeric_pairs(b)
 
 @functools.total_ordering
@@ -34,15 +38,38 @@ class ModuleVersion:
         # module versions could be straightforward like 1.2.3, or they could be
         # openssl-style mixtures of numberrs & letters like 1.0.0f
         return alphnumeric_lt(lhs, rhs)
+    def __eq__(self, other):
+        return to_alphanumeric_pairs(self.version_text) == \
+               to_alphanumeric_pairs(other.version_text)
+    def __hash__(self):
+        return hash(tuple(to_alphanumeric_pairs(self.version_text)))
+
+# bump this whenever the structure of the library's index.json changes
+INDEX_VERSION = 1
+
+def _get_mtime(path):
+    stat = os.stat(path)
+    return getattr(stat, 'st_mtime_ns', stat.st_mtime)
 
 class Library:
     """ Gives access to content of ./library, getting information about modules 
         and versions
     """
     
-    def __init__(self, library_rootdir):
-        """ param library_rootdir e.g. './library' """
+    def __init__(self, library_rootdir, cache_size=512):
+        """ param library_rootdir e.g. './library'
+            param cache_size is the max number of parsed *.bru and *.gyp
+                  files to keep in memory
+        """
         self._library_rootdir = library_rootdir
+        # maps (module, version, ext) to a tuple (file signature, jso), with
+        # the least recently used entries first:
+        self._cache = collections.OrderedDict()
+        self._cache_size = cache_size
+        self._cache_lock = threading.Lock() # 'bru install' loads concurrently
+        # the content of index.json, loaded lazily:
+        self._index = None
+        self._index_lock = threading.Lock()
         
     def get_root_dir(self):
         """ return ctor param """
@@ -55,22 +82,41 @@ class Library:
         module_dir = os.path.join(self.get_root_dir(), module_name)
         return module_dir
 
+    def get_file_name(self, module_name, module_version, ext):
+        """ returns the path of a module version's file in the library,
+            ext e.g. '.bru' or '.gyp' """
+        return os.path.join(self.get_module_dir(module_name), module_version + ext)
+
     def _load_from_library(self, module_name, module_version, ext):
-        """ ext e.g. '.bru' or '.gyp' """
-        json_file_name = os.path.join(self.get_module_dir(module_name), module_version + ext)
+        """ ext e.g. '.bru' or '.gyp'. Parsed files are memoized, so that
+            loading the same file repeatedly only costs an os.stat (to detect
+            modified files). Returns the memoized dict itself, which is shared
+            by all callers: callers that modify what they loaded must modify
+            a copy.deepcopy() of it.
+        """
+        json_file_name = self.get_file_name(module_name, module_version, ext)
+        stat = os.stat(json_file_name)
+        signature = (getattr(stat, 'st_mtime_ns', stat.st_mtime), stat.st_size)
+        key = (module_name, module_version, ext)
+        with self._cache_lock:
+            cached = self._cache.pop(key, None)
+            if cached != None and cached[0] == signature:
+                self._cache[key] = cached # now most recently used
+                return cached[1]
         jso = brulib.jsonc.loadfile(json_file_name)
+        with self._cache_lock:
+            self._cache[key] = (signature, jso)
+            while len(self._cache) > self._cache_size:
+                self._cache.popitem(last = False)
         return jso
-    
+
     def has_formula(self, module_name, module_version):
-        # lame impl: throw needless exception if module doesn't exist. Revise?
-        try:
-            self.load_formula(module_name, module_version)
-            return True
-        except:
-            return False
-    
+        return os.path.exists(self.get_file_name(module_name, module_version, '.bru'))
+
     def load_formula(self, module_name, module_version):
-        """ E.g. to load recipe for module_name='zlib' module_version='1.2.8' """
+        """ E.g. to load recipe for module_name='zlib' module_version='1.2.8'
+            The returned formula is shared, see _load_from_library().
+        """
         # Recipes will be downloaded from some server some day (e..g  from github
         # directly).
         formula = self._load_from_library(module_name, module_version, '.bru')
@@ -78,7 +124,8 @@ class Library:
         return formula
     
     def load_gyp(self, formula):
-        """ to load the gyp file associated with a formula """
+        """ to load the gyp file associated with a formula, which is shared
+            (see _load_from_library()) """
         gyp = self._load_from_library(formula['module'], formula['version'], '.gyp')
         assert 'targets' in gyp # otherwise it's not a (or is an empty) gyp file
         return gyp
@@ -86,12 +133,21 @@ class Library:
     def _save_to_library(self, formula, jso, ext):
         """ param jso is the dict or OrderedDict to save, which can by the
             forumula itself, or a gyp file, or ... """
+        module_name = formula['module']
         module_version = formula['version']
-        module_dir = self.get_module_dir(formula['module'])
-        file_name = os.path.join(module_dir, module_version + ext)
+        file_name = self.get_file_name(module_name, module_version, ext)
         brulib.jsonc.savefile(file_name, jso)
-        #print("not modifying existing " + bru_file_name)
-    
+        with self._cache_lock:
+            self._cache.pop((module_name, module_version, ext), None)
+        if ext == '.bru':
+            # mtimes can be too coarse to detect this change, so let's
+            # enforce rebuilding the index:
+            with self._index_lock:
+                self._index = None
+                index_file_name = self.get_index_file_name()
+                if os.path.exists(index_file_name):
+                    os.remove(index_file_name)
+
     def save_formula(self, formula):
         """ param formula is the same dict as returned by load_formula,
             so should be an OrderedDict.
@@ -102,8 +158,15 @@ class Library:
         """ param is a dict representing gyp file content """
         self._save_to_library(formula, gyp, '.gyp')
     
-    def get_all_versions(self, module):
-        """ yield all known versions of a module """
+    def get_index_file_name(self):
+        """ the index file lists all modules, their versions and some of the
+            formula's properties, so that we don't need to scan the whole
+            library dir each time we're looking for some module's versions.
+        """
+        return os.path.join(self.get_root_dir(), 'index.json')
+
+    def _list_versions(self, module):
+        """ yields all versions of a module by scanning the module's dir """
         bru_file_names = os.listdir(self.get_module_dir(module))
         regex = re.compile('^(.+)\\.bru$') # version can be 1.2.3 or 1.2rc7 or ...
         for bru_file_name in bru_file_names:
@@ -111,13 +174,116 @@ class Library:
             if match != None:
                 version = match.group(1)
                 yield version
-    
+
+    def _get_index_entries(self):
+        """ returns the sorted names of all files and dirs in the library root
+            dir (except for the index itself)
+        """
+        index_file_basename = os.path.basename(self.get_index_file_name())
+        return sorted(entry for entry in os.listdir(self.get_root_dir())
+                      if entry != index_file_basename)
+
+    def build_index(self):
+        """ scans all modules & versions in the library dir and writes the
+            index file (which is what 'bru index' does). Returns the index.
+            Note that the index is also rebuilt automatically whenever it's
+            found to be out of date.
+        """
+        root_dir = self.get_root_dir()
+        entries = self._get_index_entries()
+        mtimes = collections.OrderedDict()
+        modules = collections.OrderedDict()
+        for module in entries:
+            module_dir = self.get_module_dir(module)
+            if not os.path.isdir(module_dir):
+                continue
+            mtimes[module] = _get_mtime(module_dir)
+            versions = []
+            for version in self._list_versions(module):
+                bru_file_name = self.get_file_name(module, version, '.bru')
+                mtimes[os.path.relpath(bru_file_name, root_dir)] = \
+                    _get_mtime(bru_file_name)
+                formula = self.load_formula(module, version)
+                entry = collections.OrderedDict([('version', version)])
+                for prop in ['dependencies', 'url', 'md5']:
+                    if prop in formula:
+                        entry[prop] = formula[prop]
+                versions.append(entry)
+            versions.sort(key = lambda entry: ModuleVersion(entry['version']))
+            modules[module] = versions
+        index = collections.OrderedDict([
+            ('index_version', INDEX_VERSION),
+            ('entries', entries),
+            ('mtimes', mtimes),
+            ('modules', modules)
+        ])
+        try:
+            brulib.jsonc.savefile(self.get_index_file_name(), index)
+        except (IOError, OSError) as err:
+            # e.g. read-only library dir, the index in memory will do
+            print('WARNING: cannot save library index:', err)
+        return index
+
+    def _is_index_up_to_date(self, index):
+        """ checks if the index still reflects the content of the library dir,
+            which means if no module or *.bru files were added or modified.
+            This costs an os.stat for each module and formula.
+        """
+        if index.get('index_version') != INDEX_VERSION:
+            return False
+        if index['entries'] != self._get_index_entries():
+            return False
+        root_dir = self.get_root_dir()
+        try:
+            for path, mtime in index['mtimes'].items():
+                if _get_mtime(os.path.join(root_dir, path)) != mtime:
+                    return False
+        except OSError:
+            return False # e.g. formula was deleted
+        return True
+
+    def _get_index(self):
+        """ loads the index file or rebuilds it if it's missing or outdated.
+            The index in memory is checked on each call too, so that a
+            long-lived Library picks up formulas added by other processes
+            (e.g. via 'git pull').
+        """
+        with self._index_lock:
+            if self._index != None and not self._is_index_up_to_date(self._index):
+                print('library {} changed, rebuilding its index'
+                      .format(self.get_root_dir()))
+                self._index = None
+            if self._index == None:
+                index = None
+                index_file_name = self.get_index_file_name()
+                if os.path.exists(index_file_name):
+                    index = brulib.jsonc.loadfile(index_file_name)
+                    if not self._is_index_up_to_date(index):
+                        print('library index {} is outdated, rebuilding it'
+                              .format(index_file_name))
+                        index = None
+                if index == None:
+                    index = self.build_index()
+                self._index = index
+            return self._index
+
+    def get_all_modules(self):
+        """ return the names of all modules in the library """
+        return list(self._get_index()['modules'].keys())
+
+    def get_all_versions(self, module):
+        """ yield all known versions of a module, oldest first """
+        modules = self._get_index()['modules']
+        for entry in modules.get(module, []):
+            yield entry['version']
+
     def get_latest_version_of(self, module):
         """ return the latest version of a module using alphanumeric comparison
             of version strings. So this works fine for versions like '3.2.1'
             but not as well when comparing '3.2.1rc1' with '3.2.1beta7'
         """
-        versions = self.get_all_versions(module)
-        return max((ModuleVersion(version_text) for version_text in versions)).version_text
-    
-
+        versions = list(self.get_all_versions(module))
+        if len(versions) == 0:
+            raise ValueError('no versions of module {} in {}'.format(
+                module, self.get_root_dir()))
+        return versions[-1] # since the index sorted versions already
@@ -0,0 +1,95 @@
+""" A lockfile (e.g. package.bru.lock next to package.bru) records the module
+    versions a 'bru install' resolved the *.bru file's dependencies to, as well
+    as hashes of the formulas and gyp files these versions were resolved from.
+    As long as neither the *.bru file's dependencies nor these library files
+    changed the next 'bru install' can skip resolve_conflicts altogether.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import os
+import json
+import hashlib
+import collections
+import brulib.jsonc
+
+# bump this whenever the structure of the lockfile changes
+LOCKFILE_VERSION = 1
+
+def get_lockfile_name(bru_filename):
+    """ e.g. returns 'package.bru.lock' for 'package.bru' """
+    return bru_filename + '.lock'
+
+def hash_file(filename):
+    """ returns the sha1 hex digest of the file's content, or None if
+        the file doesn't exist """
+    if not os.path.exists(filename):
+        return None
+    with open(filename, 'rb') as file:
+        return hashlib.sha1(file.read()).hexdigest()
+
+def hash_dependencies(dependencies):
+    """ param dependencies is the 'dependencies' dict from a *.bru file """
+    json_text = json.dumps(dependencies, sort_keys = True)
+    return hashlib.sha1(json_text.encode('utf8')).hexdigest()
+
+def get_module_hashes(library, module, version):
+    """ returns hashes of the formula & gyp a module was installed from """
+    return collections.OrderedDict([
+        ('bru', hash_file(library.get_file_name(module, version, '.bru'))),
+        ('gyp', hash_file(library.get_file_name(module, version, '.gyp')))
+    ])
+
+def save_lockfile(lock_filename, library, dependencies, recursive_deps):
+    """ param dependencies is the 'dependencies' dict from the *.bru file
+        param recursive_deps is the list of (module, version, requestor)
+              tuples returned by resolve_conflicts
+        The lockfile is only rewritten if its content changed, and the
+        *.bru file requesting the top-level dependencies is recorded by its
+        name relative to the lockfile's dir, so that the lockfile doesn't
+        change when the project is moved or checked out elsewhere.
+    """
+    modules = []
+    for module, version, requestor in recursive_deps:
+        if module in dependencies:
+            requestor = os.path.basename(requestor)
+        entry = collections.OrderedDict([
+            ('module', module),
+            ('version', version),
+            ('requestor', requestor)
+        ])
+        entry.update(get_module_hashes(library, module, version))
+        modules.append(entry)
+    lock = collections.OrderedDict([
+        ('lockfile_version', LOCKFILE_VERSION),
+        ('dependencies', hash_dependencies(dependencies)),
+        ('modules', modules)
+    ])
+    brulib.jsonc.savefile_if_changed(lock_filename, lock)
+
+def load_lockfile(lock_filename, library, dependencies):
+    """ returns the list of (module, version, requestor) tuples recorded in
+        the lockfile, or None if there is no lockfile or if it is outdated,
+        meaning if the dependencies or any locked formula or gyp changed.
+    """
+    if not os.path.exists(lock_filename):
+        return None
+    lock = brulib.jsonc.loadfile(lock_filename)
+    if lock.get('lockfile_version') != LOCKFILE_VERSION:
+        return None
+    if lock['dependencies'] != hash_dependencies(dependencies):
+        return None
+    recursive_deps = []
+    for entry in lock['modules']:
+        module = entry['module']
+        version = entry['version']
+        hashes = get_module_hashes(library, module, version)
+        if any(entry[key] != digest for (key, digest) in hashes.items()):
+            print('{}@{} changed since {} was written'.format(
+                  module, version, lock_filename))
+            return None
+        recursive_deps.append((module, version, entry['requestor']))
+    return recursive_deps
@@ -11,11 +11,33 @@ import os
 import re
 import sys
 import glob
+import json
+import hashlib
 import pdb
 import platform
+import brulib.artifacts
+import brulib.compilercache
 import brulib.install
+import brulib.jsonc
+import brulib.util
 
-def cmd_make(config, verbose, targetPlatform="Native"):
+# the build tools 'bru make' can have gyp generate files for on Linux, with
+# 'auto' picking ninja if it's installed (for its faster no-op builds), and
+# make otherwise. The default is make, so that builds don't switch their
+# output dirs & tools just because ninja got installed.
+LINUX_GENERATORS = ['auto', 'make', 'ninja']
+
+# digests of the gyp inputs of the last successful gyp run per generated
+# file (e.g. Makefile), see run_gyp()
+GYP_STAMP_FILE = os.path.join('bru_modules', 'bru-gyp-stamps.json')
+
+# environment variables that affect what gyp generates
+GYP_ENV_VARS = ['CC', 'CXX', 'LINK', 'LD', 'GYP_DEFINES', 'GYP_GENERATORS',
+                'GYP_GENERATOR_FLAGS']
+
+def cmd_make(config, verbose, targetPlatform="Native", generator=None,
+             jobs=None, compiler_cache=None, artifact_cache=None,
+             library=None):
     """ this command makes some educated guesses about which toolchain
         the user probably wants to run, then invokes gyp to create the
         makefiles for this toolchain and invokes the build. On Linux
@@ -30,6 +52,18 @@ def cmd_make(config, verbose, targetPlatform="Native"):
         param config contains 'Release' or 'Debug'
         param verbose 0 means not verbose, >= 1 means higher verbosity level
             (whatever that means in the underlying toolchain)
+        param generator is None for the platform's default build tool (make
+            on Linux), or one of LINUX_GENERATORS, which only Linux builds
+            support atm.
+        param jobs is the number of parallel compile jobs for make or ninja,
+            defaults to the number of CPU cores
+        param compiler_cache is None, 'auto' or one of
+            brulib.compilercache.COMPILER_CACHES (Linux only atm)
+        param artifact_cache is None or the dir of a
+            brulib.artifacts.FilesystemArtifactStore to fetch prebuilt libs of
+            modules from, and to store built libs in (Linux only atm)
+        param library is the brulib.library.Library the modules in
+            ./bru_modules were installed from, needed for artifact_cache
     """
     print("running 'bru make --config {} --targetPlatform {}'".format(config,targetPlatform))
 
@@ -43,7 +77,24 @@ def cmd_make(config, verbose, targetPlatform="Native"):
         raise Exception(bru_file,'has no companion *.gyp file, '
             'e.g. recreate one via "bru install googlemock"')
 
+    if jobs == None:
+        jobs = brulib.util.get_default_job_count()
     system = platform.system()
+    if generator != None and not (system == 'Linux' and
+                                    targetPlatform == 'Native'):
+        raise Exception('generator {} is not supported on platform {}'
+                        .format(generator, system))
+    if compiler_cache != None and not (system == 'Linux' and
+                                       targetPlatform == 'Native'):
+        raise Exception('compiler caches are not supported on platform {}'
+                        .format(system))
+    artifacts = None
+    if artifact_cache != None:
+        if not (system == 'Linux' and targetPlatform == 'Native'):
+            raise Exception('artifact caches are not supported on platform {}'
+                            .format(system))
+        artifacts = brulib.artifacts.ArtifactCache(library,
+            brulib.artifacts.FilesystemArtifactStore(artifact_cache), config)
     if system == 'Windows':
     	if targetPlatform == 'Native':
     		cmd_make_win(gyp_file, config)
@@ -52,7 +103,9 @@ def cmd_make(config, verbose, targetPlatform="Native"):
     		.format(targetPlatform, system))
     elif system == 'Linux':
     	if targetPlatform == 'Native':
-    		cmd_make_linux(gyp_file, config, verbose)
+    		cmd_make_linux(gyp_file, config, verbose,
+    		               generator if generator != None else 'make', jobs,
+    		               compiler_cache, artifacts)
     	else:
         	raise Exception('targetPlatform {} not supported on platform {}'\
         	.format(targetPlatform, system))
@@ -123,12 +176,55 @@ def get_latest_installed_msvs_year():
         return 2012
     return msvs_version2year[latest]
 
-def run_gyp(gyp_cmdline):
+def get_gyp_inputs(gyp_filename):
+    """ returns the files gyp reads when generating files for gyp_filename
+        (usually package.gyp) """
+    return [gyp_filename, 'bru_common.gypi', 'bru_overrides.gypi'] + \
+        sorted(glob.glob(os.path.join('bru_modules', '*', '*.gyp'))) + \
+        sorted(glob.glob(os.path.join('bru_modules', '*', '*.gypi')))
+
+def get_gyp_digest(gyp_cmdline, gyp_filename):
+    """ returns a digest over everything the files generated by the gyp
+        cmdline depend on: the cmdline itself, the gyp & gypi files as well
+        as the relevant environment variables """
+    hash = hashlib.sha256()
+    hash.update(json.dumps([gyp_cmdline] + [[var, os.environ.get(var)]
+                for var in GYP_ENV_VARS]).encode('utf8'))
+    for input in get_gyp_inputs(gyp_filename):
+        hash.update(input.encode('utf8'))
+        if os.path.exists(input):
+            with open(input, 'rb') as file:
+                hash.update(b'+' + hashlib.sha256(file.read()).digest())
+        else:
+            hash.update(b'-')
+    return hash.hexdigest()
+
+def run_gyp(gyp_cmdline, gyp_filename=None, generated_file=None):
+    """ runs gyp, unless it generated generated_file (e.g. a Makefile) with
+        the same cmdline, gyp files and environment before. Regenerating
+        the same files would otherwise take a while for large bru_modules,
+        and would make the build tools redo work.
+    """
+    digest = None
+    stamps = {}
+    if gyp_filename != None and generated_file != None:
+        digest = get_gyp_digest(gyp_cmdline, gyp_filename)
+        if os.path.exists(GYP_STAMP_FILE):
+            stamps = brulib.jsonc.loadfile(GYP_STAMP_FILE)
+        if stamps.get(generated_file) == digest and \
+           os.path.exists(generated_file):
+            print("skipping '{}', no gyp files changed since it generated {}"
+                  .format(gyp_cmdline, generated_file))
+            return
     print("running '{}'".format(gyp_cmdline))
     returncode = os.system(gyp_cmdline)
     if returncode != 0:
         raise Exception('error running gyp, did you install it?'
             ' Instructions at https://github.com/KjellSchubert/bru')
+    if digest != None and os.path.exists(generated_file):
+        stamps[generated_file] = digest
+        brulib.util.mkdir_p(os.path.dirname(GYP_STAMP_FILE))
+        brulib.jsonc.savefile(GYP_STAMP_FILE, stamps)
 
 def cmd_make_win(gyp_filename, config):
     # TODO: locate msvs version via glob
@@ -139,11 +235,11 @@ def cmd_make_win(gyp_filename, config):
         msvs_version = 2012
     gyp_cmdline = 'gyp --depth=. {} -G msvs_version={}'.format(
         gyp_filename, msvs_version)
-    run_gyp(gyp_cmdline)
+    sln_filename = gyp_filename[:-3] + 'sln'
+    run_gyp(gyp_cmdline, gyp_filename, sln_filename)
     # gyp should have created a *.sln file, verify that.
     # if it didnt that pass a msvc generator option to gyp in a more explicit
     # fashion (is -G msvs_version enough? need GYP_GENERATORS=msvs?).
-    sln_filename = gyp_filename[:-3] + 'sln'
     if not os.path.exists(sln_filename):
         raise Exception('gyp unexpectedly did not generate a *.sln file, '
             'you may wanna invoke gyp manually to generate the expected '
@@ -171,11 +267,34 @@ def cmd_make_win(gyp_filename, config):
         raise Exception('msbuild failed with errors, returncode =', returncode)
     print('Build complete.')
 
-def cmd_make_linux(gyp_filename, config, verbose):
-    # Here we could check if ninja or some such is installed to generate ninja
-    # project files. But for simplicity's sake let's just use whatever gyp
-    # defaults to.
+def get_linux_generator(generator):
+    """ resolves generator 'auto' into 'ninja' or 'make' """
+    if generator == 'auto':
+        return 'ninja' if brulib.util.which('ninja') != None else 'make'
+    if not generator in LINUX_GENERATORS:
+        raise Exception('unknown generator {}, choose one of {}'.format(
+            generator, LINUX_GENERATORS))
+    return generator
+
+def get_linux_cmdlines(gyp_filename, config, verbose, generator, jobs):
+    """ returns a tuple (gyp cmdline, build cmdline, file gyp generates)
+        param generator is 'make' or 'ninja'
+    """
+    if generator == 'ninja':
+        # gyp writes a build.ninja per config into out/<config>:
+        out_dir = os.path.join('out', config)
+        return ('gyp --depth=. -f ninja {}'.format(gyp_filename),
+                'ninja -C {} -j {}{}'.format(out_dir, jobs,
+                    ' -v' if verbose >= 1 else ''),
+                os.path.join(out_dir, 'build.ninja'))
+    return ('gyp --depth=. -f make {}'.format(gyp_filename),
+            'make BUILDTYPE={} V={} -j {}'.format(config,
+                '1' if verbose >= 1 else '', jobs),
+            'Makefile')
 
+def cmd_make_linux(gyp_filename, config, verbose, generator='make', jobs=1,
+                   compiler_cache=None, artifacts=None):
+    """ param artifacts is an optional brulib.artifacts.ArtifactCache """
     # For some odd reason passing './package.gyp' as a param to gyp will
     # generate garbage, instead you gotta pass 'package.gyp'. Se let's
     # explicitly remove a leading ./
@@ -183,17 +302,31 @@ def cmd_make_linux(gyp_filename, config, verbose):
     assert dirname == '.' or len(dirname) == 0
     gyp_filename = os.path.basename(gyp_filename)
 
-    gyp_cmdline = 'gyp --depth=. {}'.format(gyp_filename)
-    run_gyp(gyp_cmdline)
-    if not os.path.exists('Makefile'):
-        raise Exception('gyp did not generate ./Makefile, no idea how to '
-            'build with your toolchain, please build manually')
-    make_cmdline = 'make BUILDTYPE={} V={}'.format(config,
-            '1' if verbose >= 1 else '')
-    print("running '{}'".format(make_cmdline))
-    returncode = os.system(make_cmdline)
-    if returncode != 0:
-        raise Exception('Build failed: make returned', returncode)
+    generator = get_linux_generator(generator)
+    (gyp_cmdline, build_cmdline, generated_file) = get_linux_cmdlines(
+        gyp_filename, config, verbose, generator, jobs)
+    def build():
+        if artifacts != None:
+            artifacts.use_prebuilt_libs()
+        run_gyp(gyp_cmdline, gyp_filename, generated_file)
+        if not os.path.exists(generated_file):
+            raise Exception('gyp did not generate {}, no idea how to '
+                'build with your toolchain, please build manually'.format(
+                generated_file))
+        print("running '{}'".format(build_cmdline))
+        returncode = os.system(build_cmdline)
+        if returncode != 0:
+            raise Exception('Build failed: {} returned {}'.format(generator,
+                            returncode))
+        if artifacts != None:
+            artifacts.store_built_libs()
+    # the ninja generator bakes CC & CXX into build.ninja, so these need to
+    # be set for gyp as well as for the build:
+    if compiler_cache != None:
+        with brulib.compilercache.CompilerCacheEnv(compiler_cache):
+            build()
+    else:
+        build()
     print('Build complete.')
 
 def cmd_make_macos(gyp_filename, config, verbose):
@@ -208,8 +341,8 @@ def cmd_make_macos(gyp_filename, config, verbose):
     assert dirname == '.' or len(dirname) == 0
     gyp_filename = os.path.basename(gyp_filename)
     gyp_cmdline = 'gyp --depth=. -f xcode {} --generator-output=./xcode-macos'.format(gyp_filename)
-    run_gyp(gyp_cmdline)
     xcodeprj = './xcode-macos/{}xcodeproj'.format(gyp_filename[:-3])
+    run_gyp(gyp_cmdline, gyp_filename, xcodeprj)
     filepattern = xcodeprj
     files = glob.glob(filepattern)
     print(filepattern)
@@ -236,8 +369,8 @@ def cmd_make_ios(gyp_filename, config, verbose):
     assert dirname == '.' or len(dirname) == 0
     gyp_filename = os.path.basename(gyp_filename)
     gyp_cmdline = 'gyp --depth=. -f xcode -DOS=iOS {} --generator-output=./xcode-ios'.format(gyp_filename)
-    run_gyp(gyp_cmdline)
     xcodeprj = './xcode-ios/{}xcodeproj'.format(gyp_filename[:-3])
+    run_gyp(gyp_cmdline, gyp_filename, xcodeprj)
     filepattern = xcodeprj
     files = glob.glob(filepattern)
     if len(files) == 0:
@@ -14,8 +14,11 @@ if sys.version_info < (3, 0):
     from urlparse import urlparse
 import os
 import json
-import brulib.library
+import itertools
 import brulib.clone
+import brulib.jsonc
+import brulib.store
+import brulib.treecache
 import brulib.untar
 import brulib.util
 
@@ -24,17 +27,31 @@ def get_user_home_dir():
         the .bru/ dir for storing downloaded tar.gzs on a per-user basis"""
     return os.path.expanduser("~")
 
-def unpack_dependency(library, module_name, module_version, zip_url, bru_modules_root):
-    """ downloads tar.gz or zip file as given by zip_url, then unpacks it
-        under bru_modules_root """
-    module_dir = os.path.join(bru_modules_root, module_name, module_version)
-    brulib.util.mkdir_p(module_dir)
+def get_download_store():
+    """ the per-user store all downloaded tar.gzs & zips are kept in """
+    return brulib.store.DownloadStore(
+        os.path.join(get_user_home_dir(), ".bru", "store"))
 
-    parse = urlparse(zip_url)
-    if parse.scheme in [u'svn+http', u'svn+https', u'git+http', u'git+https']:
-        brulib.clone.atomic_clone_repo(zip_url, module_dir)
-        return
+def get_mirror_root():
+    """ the per-user dir of bare mirrors of git repos """
+    return os.path.join(get_user_home_dir(), ".bru", "mirrors")
+
+def get_artifact_root():
+    """ the per-user dir of prebuilt libs, see brulib.artifacts """
+    return os.path.join(get_user_home_dir(), ".bru", "artifacts")
 
+def get_tree_cache():
+    """ the per-user cache of unpacked archives """
+    return brulib.treecache.TreeCache(
+        os.path.join(get_user_home_dir(), ".bru", "trees"))
+
+def get_archive(library, module_name, module_version, zip_url, expected_digests={}):
+    """ returns the local path of the tar.gz or zip file given by zip_url,
+        downloading it first unless it was downloaded in the past alrdy.
+        param expected_digests maps 'md5' and/or 'sha256' to the hex digests
+              a downloaded tar.gz or zip must match
+    """
+    parse = urlparse(zip_url)
     if parse.scheme == u'file':
         # this is typically used to apply a patch in the form of a targ.gz
         # on top of a larger downloaded file. E.g. for ogg & speex this
@@ -43,32 +60,137 @@ def unpack_dependency(library, module_name, module_version, zip_url, bru_modules
         # pointless, so we extract this file right from the library dir:
         path = parse.netloc
         assert len(path) > 0
-        basename = os.path.basename(path)
-        assert len(path) > 0
         src_module_dir = library.get_module_dir(module_name)
-        src_tar_filename = os.path.join(src_module_dir, path)
-        brulib.untar.untar_once(src_tar_filename, module_dir)
-        return
+        return os.path.join(src_module_dir, path)
 
     # Store all downloaded tar.gz files in ~/.bru, e.g as boost-regex/1.57/foo.tar.gz
     # This ensures that multiple 'bru install foo' cmds in differet directories
     # on this machine won't download the same foo.tar.gz multiple times.
-    # MOdules for which we must clone an svn or git repo are not sharable that
-    # easily btw, they actually are cloned multiple times atm (could clone them
-    # once into ~/.bru and copy, but I'm not doing this atm).
+    # These files are hardlinks into the content-addressed ~/.bru/store, so
+    # the same tar.gz referenced by several formulas is stored only once.
+    # Modules for which we must clone a git repo are cloned from a bare mirror
+    # in ~/.bru/mirrors, so only new commits are fetched over the network.
+    # Svn checkouts on the other hand are still made once per project.
     if parse.scheme in [u'http', u'https', u'ftp']:
         tar_dir = os.path.join(get_user_home_dir(), ".bru", "downloads",
                                module_name, module_version)
-        brulib.untar.wget_and_untar_once(zip_url, tar_dir, module_dir)
-        return
+        return brulib.untar.wget_once(zip_url, tar_dir, expected_digests,
+                                      get_download_store())
 
     raise Exception('unsupported scheme in', zip_url)
 
-def get_urls(library, formula, bru_modules_root):
+def get_archive_sha256(archive):
+    """ returns the sha256 of a tar.gz or zip returned by get_archive() """
+    digests_file = archive + '.digests' # as written by brulib.untar.wget_once
+    if os.path.exists(digests_file):
+        return brulib.jsonc.loadfile(digests_file)['sha256']
+    return brulib.untar.hash_file(archive)['sha256']
+
+def unpack_dependency(library, module_name, module_version, zip_url, bru_modules_root,
+                      expected_digests={}):
+    """ downloads tar.gz or zip file as given by zip_url, then unpacks it
+        under bru_modules_root, or clones the svn or git repo given by zip_url.
+        param expected_digests maps 'md5' and/or 'sha256' to the hex digests
+              a downloaded tar.gz or zip must match
+    """
+    module_dir = os.path.join(bru_modules_root, module_name, module_version)
+    brulib.util.mkdir_p(module_dir)
+
+    parse = urlparse(zip_url)
+    if parse.scheme in [u'svn+http', u'svn+https', u'git+http', u'git+https']:
+        brulib.clone.atomic_clone_repo(zip_url, module_dir, get_mirror_root())
+        return
+
+    archive = get_archive(library, module_name, module_version, zip_url,
+                          expected_digests)
+    brulib.untar.untar_once(archive, module_dir)
+
+# gyp keys listing files rather than dirs. For these lazy unpacking unpacks
+# the files' whole dirs, since e.g. sources usually include headers next to
+# them. Keys ending in '!' or '/' are exclusions, which are ignored.
+_GYP_FILE_KEYS = ['sources', 'files', 'inputs']
+
+def get_lazy_prefixes(library, formula):
+    """ returns the sorted list of dirs in the module's tar.gz that its gyp
+        file refers to (via include_dirs, sources, copies, test cwds and so
+        on), relative to bru_modules/$module/$version. Returns None if the
+        whole tar.gz should be unpacked, e.g. because the module has no gyp
+        file or a make_command, which may need any of the files.
+    """
+    if 'make_command' in formula or not os.path.exists(library.get_file_name(
+            formula['module'], formula['version'], '.gyp')):
+        return None
+    version_prefix = formula['version'] + '/'
+    prefixes = set()
+    def add_prefix(key, path):
+        path = path.replace('\\', '/')
+        if not path.startswith(version_prefix):
+            return
+        components = path[len(version_prefix):].split('/')
+        if key in _GYP_FILE_KEYS:
+            components = components[:-1]
+        dirs = itertools.takewhile(
+            lambda component: not any(char in component for char in '*?['),
+            components)
+        prefixes.add('/'.join(dir for dir in dirs if not dir in ['', '.']))
+    def visit(key, value):
+        if isinstance(value, dict):
+            for child_key, child_value in value.items():
+                if not child_key.endswith('!') and not child_key.endswith('/'):
+                    visit(child_key.rstrip('=+?'), child_value)
+        elif isinstance(value, list):
+            for elem in value:
+                visit(key, elem)
+        elif hasattr(value, 'startswith'):
+            add_prefix(key, value)
+    visit(None, library.load_gyp(formula))
+    if len(prefixes) == 0 or '' in prefixes:
+        return None
+    # dirs underneath other listed dirs are unpacked anyway:
+    return sorted(prefix for prefix in prefixes
+                  if not brulib.untar.is_selected(prefix.rpartition('/')[0],
+                                                  prefixes))
+
+def unpack_via_tree_cache(library, formula, zip_urls, expected_digests,
+                          bru_modules_root, lazy = False, link_trees = False):
+    """ like calling unpack_dependency for each of the zip_urls, except that
+        the unpacked tree is copied from the per-user tree cache
+        param lazy: if True then downloaded tar.gzs are only partially
+              unpacked, see get_lazy_prefixes()
+        param link_trees: if True then the tree is hardlinked instead of
+              copied, see brulib.treecache
+    """
+    module = formula['module']
+    version = formula['version']
+    module_dir = os.path.join(bru_modules_root, module, version)
+    lazy_prefixes = get_lazy_prefixes(library, formula) if lazy else None
+    # file:// patches are small and may touch any file, so they are always
+    # unpacked completely:
+    url2prefixes = dict((zip_url, None if urlparse(zip_url).scheme == 'file'
+                                  else lazy_prefixes)
+                        for zip_url in zip_urls)
+    if all(brulib.untar.is_unpacked(brulib.untar.url2filename(zip_url),
+                                    module_dir, url2prefixes[zip_url])
+           for zip_url in zip_urls):
+        return # unpacked in the past alrdy
+    archives = []
+    for zip_url in zip_urls:
+        archive = get_archive(library, module, version, zip_url,
+                              expected_digests.get(zip_url, {}))
+        archives.append((archive, get_archive_sha256(archive),
+                         url2prefixes[zip_url]))
+    get_tree_cache().unpack(archives, module_dir, link_trees)
+
+def get_urls(library, formula, bru_modules_root, lazy = False,
+             link_trees = False):
     """ param formula is the retval from Library.load_formula(). This will either
             download & unpack tar.gz files or clone repos
         param bru_modules_root is the destination dir to unpack the downloaded
             content into
+        param lazy: if True then only the parts of downloaded tar.gzs that
+            the module's gyp file refers to are unpacked (where possible)
+        param link_trees: if True then trees unpacked into the per-user tree
+            cache are hardlinked into bru_modules instead of being copied
     """
     if not 'module' in formula or not 'version' in formula:
         print(json.dumps(formula, indent=4))
@@ -81,5 +203,33 @@ def get_urls(library, formula, bru_modules_root):
     if not isinstance(zip_urls, list):
         zip_urls = [zip_urls]
 
+    # A formula's 'md5' (or 'sha256') refers to its single downloaded tar.gz
+    # or zip, with any other urls being 'file://' patches from the library.
+    # For formulas downloading several files it's ambiguous which file the
+    # digest would refer to, so these aren't verified.
+    download_urls = [zip_url for zip_url in zip_urls
+                     if urlparse(zip_url).scheme in ['http', 'https', 'ftp']]
+    expected_digests = {}
+    if len(download_urls) == 1:
+        expected_digests = dict((algo, formula[algo])
+            for algo in brulib.untar.DIGEST_ALGORITHMS if algo in formula)
+
+    url2digests = dict((zip_url, expected_digests if zip_url in download_urls
+                                 else {})
+                       for zip_url in zip_urls)
+
+    # modules consisting of tar.gzs and zips only are copied (or linked) from
+    # the per-user cache of unpacked trees, unless their make_command might
+    # modify the cached files:
+    archive_urls = [zip_url for zip_url in zip_urls
+                    if urlparse(zip_url).scheme in ['http', 'https', 'ftp', 'file']]
+    if len(archive_urls) == len(zip_urls) and not 'make_command' in formula:
+        unpack_via_tree_cache(library, formula, zip_urls, url2digests,
+                              bru_modules_root, lazy, link_trees)
+        return
+
+    # files linked from the tree cache must not be modified by make_commands:
+    brulib.treecache.unlink_tree(os.path.join(bru_modules_root, module, version))
     for zip_url in zip_urls:
-        unpack_dependency(library, module, version, zip_url, bru_modules_root)
+        unpack_dependency(library, module, version, zip_url, bru_modules_root,
+                          url2digests[zip_url])
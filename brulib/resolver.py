@@ -0,0 +1,175 @@
+""" resolves the version specs in a *.bru file's (recursive) dependencies to a
+    consistent set of module versions, backtracking on conflicts.
+    Supported version specs are:
+      * exact versions like '1.57.0'
+      * wildcards like '1.57.*' or '*'
+      * comparisons like '>=1.2', '>1.2', '<=2.0', '<2.0' or '=1.2'
+      * space-separated combinations of the above, e.g. '>=1.2 <2.0'
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import re
+import fnmatch
+import collections
+import brulib.library
+
+class VersionSpec:
+    """ a parsed version spec, e.g. '1.57.*' or '>=1.2 <2.0' """
+
+    _comparison_regex = re.compile('^(>=|<=|>|<|==|=)(.+)$')
+
+    def __init__(self, text):
+        self.text = text
+        self._matchers = [self._parse_matcher(elem) for elem in text.split()]
+
+    def _parse_matcher(self, elem):
+        """ returns a func that takes a version string, returning True
+            if the version matches this element of the spec """
+        match = VersionSpec._comparison_regex.match(elem)
+        if match != None:
+            op = match.group(1)
+            rhs = brulib.library.ModuleVersion(match.group(2))
+            return {
+                '>=': lambda version: brulib.library.ModuleVersion(version) >= rhs,
+                '<=': lambda version: brulib.library.ModuleVersion(version) <= rhs,
+                '>' : lambda version: brulib.library.ModuleVersion(version) > rhs,
+                '<' : lambda version: brulib.library.ModuleVersion(version) < rhs,
+                '==': lambda version: version == rhs.version_text,
+                '=' : lambda version: version == rhs.version_text,
+            }[op]
+        if '*' in elem:
+            return lambda version: fnmatch.fnmatchcase(version, elem)
+        return lambda version: version == elem
+
+    def matches(self, version):
+        return all(matcher(version) for matcher in self._matchers)
+
+class Resolver:
+    """ Picks a version for each module in the transitive hull of a set of
+        dependencies so that each module's version matches all the version
+        specs the depending modules asked for. Prefers newer versions and
+        backtracks if a choice turns out to be inconsistent with deps
+        discovered later.
+    """
+
+    def __init__(self, library):
+        """ param library is of type brulib.library.Library """
+        self._library = library
+        # memoized sub-results:
+        self._specs = {}         # spec text -> VersionSpec
+        self._candidates = {}    # (module, spec texts) -> matching versions
+        self._dependencies = {}  # (module, version) -> formula's deps
+        # per resolve() call, since these depend on the root dependencies:
+        self._failures = set()   # sets of selections known to be unresolvable
+        self._conflict = None    # for the error msg if resolution fails
+
+    def _get_spec(self, text):
+        if not text in self._specs:
+            self._specs[text] = VersionSpec(text)
+        return self._specs[text]
+
+    def get_candidates(self, module, spec_texts):
+        """ returns all versions of module matching all given version specs,
+            newest version first """
+        key = (module, tuple(sorted(set(spec_texts))))
+        if not key in self._candidates:
+            specs = [self._get_spec(text) for text in key[1]]
+            self._candidates[key] = [version for version
+                in reversed(list(self._library.get_all_versions(module)))
+                if all(spec.matches(version) for spec in specs)]
+        return self._candidates[key]
+
+    def get_dependencies(self, module, version):
+        """ returns the formula's 'dependencies' (module -> version spec) """
+        key = (module, version)
+        if not key in self._dependencies:
+            formula = self._library.load_formula(module, version)
+            self._dependencies[key] = formula['dependencies'] \
+                if 'dependencies' in formula else collections.OrderedDict()
+        return self._dependencies[key]
+
+    def _search(self, selected, constraints, pending):
+        """ param selected is an OrderedDict module -> version for all
+                  modules whose versions were picked already
+            param constraints maps each module to the tuple of
+                  (version spec, requestor) it was requested with so far
+            param pending is a tuple of modules still needing a version
+            Returns the completed selected dict, or None if the modules
+            pending cannot be resolved consistently with selected.
+        """
+        pending = tuple(module for module in pending if not module in selected)
+        if len(pending) == 0:
+            return selected
+        failure_key = frozenset(selected.items())
+        if failure_key in self._failures:
+            return None
+
+        module = pending[0]
+        spec_texts = [spec for (spec, requestor) in constraints[module]]
+        candidates = self.get_candidates(module, spec_texts)
+        if len(candidates) == 0:
+            self._conflict = (module, constraints[module])
+        for version in candidates:
+            deps = self.get_dependencies(module, version)
+            conflicting = [dep for (dep, spec) in deps.items()
+                           if dep in selected and
+                           not self._get_spec(spec).matches(selected[dep])]
+            if len(conflicting) > 0:
+                dep = conflicting[0]
+                self._conflict = (dep, constraints[dep] +
+                                  ((deps[dep], module),))
+                continue
+            child_constraints = dict(constraints)
+            for dep, spec in deps.items():
+                child_constraints[dep] = constraints.get(dep, ()) + \
+                                         ((spec, module),)
+            child_selected = collections.OrderedDict(selected)
+            child_selected[module] = version
+            child_pending = pending[1:] + tuple(dep for dep in deps.keys()
+                                                if not dep in pending)
+            result = self._search(child_selected, child_constraints,
+                                  child_pending)
+            if result != None:
+                return result
+
+        self._failures.add(failure_key)
+        return None
+
+    def resolve(self, dependencies, root_requestor):
+        """ param dependencies maps modules to version specs, e.g. the
+                  'dependencies' of a package.bru
+            param root_requestor is whatever topmost *.bru listed deps,
+                  e.g. 'package.bru'
+            Returns a list of tuples (module, version, requestor) for all
+            recursive dependencies, in breadth-first order. The requestor
+            is the first module that asked for the module.
+        """
+        self._failures = set()
+        self._conflict = None
+        constraints = dict((module, ((spec, root_requestor),))
+                           for (module, spec) in dependencies.items())
+        selected = self._search(collections.OrderedDict(), constraints,
+                                tuple(dependencies.keys()))
+        if selected == None:
+            module, module_constraints = self._conflict
+            available = list(self._library.get_all_versions(module))
+            raise Exception("cannot resolve a consistent version for module {}"
+                " requested as {}, available versions: {}".format(
+                module,
+                ', '.join("'{}' by {}".format(spec, requestor)
+                          for (spec, requestor) in module_constraints),
+                ', '.join(available) if len(available) > 0 else 'none'))
+
+        # the constraints for the final selection are cheaper to recompute
+        # than to pass back out of the search:
+        requestors = dict((module, root_requestor) for module in dependencies)
+        for module, version in selected.items():
+            for dep in self.get_dependencies(module, version).keys():
+                if not dep in requestors:
+                    requestors[dep] = module
+        return [(module, version, requestors[module])
+                for (module, version) in selected.items()]
@@ -0,0 +1,241 @@
+""" a content-addressed store for downloaded tar.gz and zip files, located in
+    ~/.bru/store. Each download is stored once keyed by its sha256, no matter
+    how many urls or modules refer to it, and is hardlinked from there to
+    wherever it's needed (e.g. to ~/.bru/downloads/$module/$version/).
+    Downloads are linked there rather than into each project's bru_modules,
+    since bru_modules holds the unpacked trees only (which are copied from
+    the tree cache, see brulib.treecache).
+    The layout of the store is:
+      objects/ab/abcdef.../foo.tar.gz   the download for sha256 abcdef...
+      objects/ab/abcdef.../digests      md5, sha256 and size of the download
+      objects/ab/abcdef.../links        paths the download was linked to
+      urls/<sha1 of url>                sha256 of the url's content
+      md5/<md5>                         sha256 of the content with that md5
+    The mtime of each object dir is updated whenever the object is used, the
+    store's garbage collection evicts the least recently used objects.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import os
+import shutil
+import hashlib
+import brulib.jsonc
+import brulib.untar
+import brulib.util
+
+# files in an object dir that aren't the stored download itself
+_METADATA_FILES = ['digests', 'links']
+
+def _is_same_file(path, object_file, sha256):
+    """ returns True if path is a hardlink to the object_file with the given
+        sha256, or a copy of it (e.g. materialized across file systems) """
+    try:
+        if os.path.samefile(path, object_file):
+            return True
+    except AttributeError: # no os.path.samefile on py2 Windows
+        pass
+    return os.path.getsize(path) == os.path.getsize(object_file) and \
+           brulib.untar.hash_file(path)['sha256'] == sha256
+
+class DownloadStore:
+    """ see module docstring """
+
+    def __init__(self, root_dir):
+        """ param root_dir e.g. ~/.bru/store """
+        self._root_dir = root_dir
+
+    def _get_object_dir(self, sha256):
+        return os.path.join(self._root_dir, 'objects', sha256[:2], sha256)
+
+    def _get_ref_file(self, kind, key):
+        """ param kind is 'urls' or 'md5' """
+        return os.path.join(self._root_dir, kind, key)
+
+    def _read_ref(self, kind, key):
+        """ returns the sha256 a ref points to, or None """
+        ref_file = self._get_ref_file(kind, key)
+        if not os.path.exists(ref_file):
+            return None
+        with open(ref_file) as file:
+            return file.read().strip()
+
+    def _write_ref(self, kind, key, sha256):
+        ref_file = self._get_ref_file(kind, key)
+        brulib.util.mkdir_p(os.path.dirname(ref_file))
+        temp_file = ref_file + '.tmp'
+        with open(temp_file, 'w') as file:
+            file.write(sha256)
+        if os.path.exists(ref_file):
+            os.remove(ref_file) # for Windows, where rename doesn't overwrite
+        os.rename(temp_file, ref_file)
+
+    def get_object_file(self, sha256):
+        """ returns the path of the stored download with this sha256, or None
+            if the store doesn't have it """
+        object_dir = self._get_object_dir(sha256)
+        if not os.path.isdir(object_dir):
+            return None
+        for name in os.listdir(object_dir):
+            if not name in _METADATA_FILES and not name.endswith('.tmp'):
+                return os.path.join(object_dir, name)
+        return None
+
+    def get_digests(self, sha256):
+        """ returns the digests of a stored object (as passed to add()) """
+        return brulib.jsonc.loadfile(
+            os.path.join(self._get_object_dir(sha256), 'digests'))
+
+    def find(self, url, expected_digests={}):
+        """ returns the sha256 of a stored download for this url (or of one
+            matching the expected md5 or sha256 digest, e.g. the same tar.gz
+            referenced via a different url), or None. Stored downloads not
+            matching the expected digests are ignored.
+        """
+        candidates = [
+            expected_digests.get('sha256'),
+            self._read_ref('md5', expected_digests['md5'].lower())
+                if expected_digests.get('md5') != None else None,
+            self._read_ref('urls', hashlib.sha1(url.encode('utf8')).hexdigest())
+        ]
+        for sha256 in candidates:
+            if sha256 == None or self.get_object_file(sha256) == None:
+                continue
+            digests = self.get_digests(sha256)
+            if all(digests[algo].lower() == expected_digests[algo].lower()
+                   for algo in ['md5', 'sha256']
+                   if expected_digests.get(algo) != None):
+                return sha256
+        return None
+
+    def _add_refs(self, digests, url):
+        sha256 = digests['sha256']
+        self._write_ref('md5', digests['md5'].lower(), sha256)
+        self._write_ref('urls', hashlib.sha1(url.encode('utf8')).hexdigest(),
+                        sha256)
+
+    def add(self, filename, digests, url):
+        """ moves a downloaded file into the store, unless the store has a
+            file with the same content already, in which case filename is
+            deleted.
+            param digests is the dict returned by brulib.untar.wget()
+            Returns the file's sha256.
+        """
+        sha256 = digests['sha256']
+        if self.get_object_file(sha256) == None:
+            object_dir = self._get_object_dir(sha256)
+            brulib.util.mkdir_p(object_dir)
+            basename = os.path.basename(filename)
+            if basename.endswith('.tmp'):
+                basename = basename[:-len('.tmp')]
+            brulib.jsonc.savefile(os.path.join(object_dir, 'digests'), digests)
+            shutil.move(filename, os.path.join(object_dir, basename))
+        else:
+            os.remove(filename)
+        self._add_refs(digests, url)
+        return sha256
+
+    def adopt(self, filename, digests, url):
+        """ adds an existing download (e.g. from before the store existed) to
+            the store by hardlinking it. Returns the file's sha256. """
+        sha256 = digests['sha256']
+        if self.get_object_file(sha256) == None:
+            object_dir = self._get_object_dir(sha256)
+            brulib.util.mkdir_p(object_dir)
+            brulib.jsonc.savefile(os.path.join(object_dir, 'digests'), digests)
+            brulib.util.link_or_copy(
+                filename, os.path.join(object_dir, os.path.basename(filename)))
+            self._record_link(sha256, filename)
+        self._add_refs(digests, url)
+        return sha256
+
+    def touch(self, sha256):
+        """ marks the object as recently used """
+        object_dir = self._get_object_dir(sha256)
+        if os.path.isdir(object_dir):
+            os.utime(object_dir, None)
+
+    def _record_link(self, sha256, dst):
+        links_file = os.path.join(self._get_object_dir(sha256), 'links')
+        dst = os.path.abspath(dst)
+        if os.path.exists(links_file):
+            with open(links_file) as file:
+                if dst in file.read().splitlines():
+                    return
+        with open(links_file, 'a') as file:
+            file.write(dst + '\n')
+
+    def materialize(self, sha256, dst):
+        """ hardlinks (or copies) the stored object to dst """
+        object_file = self.get_object_file(sha256)
+        assert object_file != None, 'no object {} in store'.format(sha256)
+        brulib.util.mkdir_p(os.path.dirname(dst))
+        brulib.util.link_or_copy(object_file, dst)
+        self._record_link(sha256, dst)
+        self.touch(sha256)
+
+    def get_objects(self):
+        """ yields tuples (sha256, object dir, mtime) for all stored objects """
+        objects_dir = os.path.join(self._root_dir, 'objects')
+        if not os.path.isdir(objects_dir):
+            return
+        for prefix in os.listdir(objects_dir):
+            prefix_dir = os.path.join(objects_dir, prefix)
+            for sha256 in os.listdir(prefix_dir):
+                object_dir = os.path.join(prefix_dir, sha256)
+                yield (sha256, object_dir, os.path.getmtime(object_dir))
+
+    def _get_links(self, object_dir):
+        links_file = os.path.join(object_dir, 'links')
+        if not os.path.exists(links_file):
+            return []
+        with open(links_file) as file:
+            return [link for link in file.read().splitlines() if len(link) > 0]
+
+    def stats(self):
+        """ returns a dict with the store's object count, total size in bytes
+            and the number of materialized links """
+        objects = list(self.get_objects())
+        return {
+            'objects': len(objects),
+            'size': sum(brulib.util.get_dir_size(object_dir)
+                        for (sha256, object_dir, mtime) in objects),
+            'links': sum(len(self._get_links(object_dir))
+                         for (sha256, object_dir, mtime) in objects)
+        }
+
+    def _remove_object(self, sha256, object_dir):
+        """ removes the object as well as the links to it (since hardlinks
+            would otherwise keep the disk space occupied). A recorded link
+            path is only removed if it's still the object's file (or a copy
+            of it), not e.g. a different file created there in the meantime.
+        """
+        object_file = self.get_object_file(sha256)
+        for link in self._get_links(object_dir):
+            if os.path.exists(link) and object_file != None and \
+               _is_same_file(link, object_file, sha256):
+                os.remove(link)
+                digests_file = link + '.digests' # see brulib.untar
+                if os.path.exists(digests_file):
+                    os.remove(digests_file)
+        shutil.rmtree(object_dir)
+
+    def gc(self, max_size):
+        """ evicts least recently used objects until the store's size is at
+            most max_size bytes. Returns the number of evicted objects. """
+        objects = sorted(self.get_objects(), key = lambda obj: obj[2])
+        sizes = dict((sha256, brulib.util.get_dir_size(object_dir))
+                     for (sha256, object_dir, mtime) in objects)
+        total_size = sum(sizes.values())
+        evicted = 0
+        for sha256, object_dir, mtime in objects:
+            if total_size <= max_size:
+                break
+            print('evicting', self.get_object_file(sha256))
+            self._remove_object(sha256, object_dir)
+            total_size -= sizes[sha256]
+            evicted += 1
+        return evicted
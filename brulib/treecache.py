@@ -0,0 +1,209 @@
+""" a per-user cache of unpacked module trees, located in ~/.bru/trees.
+    Unpacking large archives like boost or openssl takes seconds, and without
+    this cache that's repeated for each project (e.g. for each CI build) that
+    installs the module. Instead each distinct combination of archives (e.g.
+    a downloaded tar.gz plus a 'file://' patch from the library) is unpacked
+    once into this cache, keyed by the archives' digests, and is then copied
+    into each project's bru_modules/$module/$version.
+    With 'bru install --link-trees' the files are hardlinked instead of
+    copied, which saves disk space & time but means the files are shared
+    between all projects linking the tree. Cached trees are therefore
+    read-only, and each tree's manifest (the size & mtime of each file) is
+    checked before linking it, so that a tree modified through one of its
+    links anyway (e.g. by root, who ignores the read-only bit) is unpacked
+    again instead of being linked into more projects. Modules with a
+    make_command (which may modify unpacked files in place, e.g. via
+    ./configure) don't use this cache.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import os
+import stat
+import shutil
+import hashlib
+import threading
+import brulib.jsonc
+import brulib.untar
+import brulib.util
+
+# the manifest of a cached tree, which isn't linked or copied into projects
+MANIFEST_FILE = '.bru-tree-manifest.json'
+
+# marks a module dir as linked from the tree cache, see unlink_tree()
+LINKED_MARKER = '.bru-linked-tree'
+
+def _copy_writable(src, dst):
+    if os.path.exists(dst):
+        os.remove(dst)
+    shutil.copy2(src, dst)
+    os.chmod(dst, stat.S_IMODE(os.stat(dst).st_mode) | stat.S_IWUSR)
+
+def link_tree(src_dir, dst_dir, link = False):
+    """ recreates the dirs underneath src_dir in dst_dir and copies (or with
+        link=True hardlinks) all files. The *.unpack_done and *.unpack_partial
+        markers in src_dir are copied last, so that an interrupted link_tree
+        won't leave dst_dir looking unpacked.
+    """
+    copy = brulib.util.link_or_copy if link else _copy_writable
+    markers = []
+    for root, dirs, files in os.walk(src_dir):
+        rel_root = os.path.relpath(root, src_dir)
+        dst_root = os.path.normpath(os.path.join(dst_dir, rel_root))
+        brulib.util.mkdir_p(dst_root)
+        for file in files:
+            if rel_root == '.' and file == MANIFEST_FILE:
+                continue
+            if rel_root == '.' and (file.endswith('.unpack_done') or
+                                    file.endswith('.unpack_partial')):
+                markers.append(file)
+                continue
+            copy(os.path.join(root, file), os.path.join(dst_root, file))
+    if link:
+        brulib.jsonc.savefile(os.path.join(dst_dir, LINKED_MARKER),
+                              {'tree': src_dir})
+    for marker in markers:
+        copy(os.path.join(src_dir, marker), os.path.join(dst_dir, marker))
+
+def unlink_tree(module_dir):
+    """ removes module_dir if its files are hardlinked from the tree cache,
+        so that they can be unpacked as private files instead (e.g. for a
+        module whose formula gained a make_command since it was installed).
+        Returns True if module_dir was removed.
+    """
+    if not os.path.exists(os.path.join(module_dir, LINKED_MARKER)):
+        return False
+    print('removing', module_dir, 'which is linked from the tree cache')
+    rmtree(module_dir)
+    return True
+
+def rmtree(dir):
+    """ like shutil.rmtree, but also removes read-only files on Windows """
+    def make_writable_and_retry(func, path, exc_info):
+        os.chmod(path, stat.S_IWRITE)
+        func(path)
+    shutil.rmtree(dir, onerror = make_writable_and_retry)
+
+def get_manifest(tree_dir):
+    """ returns a dict mapping the path of each file in tree_dir (relative to
+        tree_dir) to its [size, mtime] """
+    manifest = {}
+    for root, dirs, files in os.walk(tree_dir):
+        for file in files:
+            path = os.path.join(root, file)
+            rel_path = os.path.relpath(path, tree_dir).replace(os.sep, '/')
+            if rel_path == MANIFEST_FILE:
+                continue
+            stats = os.stat(path)
+            manifest[rel_path] = [stats.st_size, stats.st_mtime]
+    return manifest
+
+def make_read_only(tree_dir):
+    """ removes the write permissions of all files underneath tree_dir,
+        leaving dirs writable so that the tree can still be evicted """
+    for root, dirs, files in os.walk(tree_dir):
+        for file in files:
+            path = os.path.join(root, file)
+            mode = stat.S_IMODE(os.stat(path).st_mode)
+            os.chmod(path, mode & ~(stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH))
+
+class TreeCache:
+    """ see module docstring """
+
+    def __init__(self, root_dir):
+        """ param root_dir e.g. ~/.bru/trees """
+        self._root_dir = root_dir
+
+    def get_key(self, archives):
+        """ param archives is a list of (archive file, sha256, prefixes)
+                  tuples in the order they are unpacked into the module dir,
+                  with prefixes being None or the list of the archive's dirs
+                  to unpack, see brulib.untar.untar_once()
+            Returns the key of the tree resulting from unpacking these.
+        """
+        key_text = '\n'.join('{} {}{}'.format(sha256, os.path.basename(archive),
+            '' if prefixes == None else ' ' + ' '.join(sorted(prefixes)))
+            for (archive, sha256, prefixes) in archives)
+        return hashlib.sha256(key_text.encode('utf8')).hexdigest()
+
+    def get_tree_dir(self, key):
+        return os.path.join(self._root_dir, key)
+
+    def is_intact(self, tree_dir):
+        """ returns True if none of the tree's files was modified since it
+            was unpacked, according to the tree's manifest """
+        manifest_file = os.path.join(tree_dir, MANIFEST_FILE)
+        if not os.path.exists(manifest_file):
+            return False # unpacked by an older bru, or being evicted
+        return brulib.jsonc.loadfile(manifest_file) == get_manifest(tree_dir)
+
+    def unpack(self, archives, module_dir, link = False):
+        """ unpacks the archives into module_dir by copying (or linking) the
+            cached tree for these archives, unpacking them into the cache
+            first if needed.
+            param archives is a list of (archive file, sha256, prefixes)
+                  tuples, see get_key()
+            param link: if True then the tree's files are hardlinked into
+                  module_dir instead of being copied, see module docstring
+        """
+        key = self.get_key(archives)
+        tree_dir = self.get_tree_dir(key)
+        if os.path.isdir(tree_dir) and not self.is_intact(tree_dir):
+            print('WARNING: files in', tree_dir, 'were modified since it was'
+                  ' unpacked, unpacking it again')
+            # rename first, so that concurrent installs don't link from it:
+            stale_dir = '{}.{}.{}.tmp'.format(tree_dir, os.getpid(),
+                                              threading.current_thread().ident)
+            try:
+                os.rename(tree_dir, stale_dir)
+                rmtree(stale_dir)
+            except OSError:
+                pass # another install renamed it first
+        if not os.path.isdir(tree_dir):
+            # unpack into a temp dir unique to this thread, then rename, so
+            # that concurrent installs never see a partially unpacked tree:
+            temp_dir = '{}.{}.{}.tmp'.format(tree_dir, os.getpid(),
+                                             threading.current_thread().ident)
+            if os.path.exists(temp_dir):
+                rmtree(temp_dir)
+            for archive, sha256, prefixes in archives:
+                brulib.untar.untar_once(archive, temp_dir, prefixes)
+            make_read_only(temp_dir)
+            brulib.jsonc.savefile(os.path.join(temp_dir, MANIFEST_FILE),
+                                  get_manifest(temp_dir))
+            try:
+                os.rename(temp_dir, tree_dir)
+            except OSError:
+                if not os.path.isdir(tree_dir):
+                    raise
+                rmtree(temp_dir) # someone else was faster
+        else:
+            os.utime(tree_dir, None) # marks it as recently used
+        print("{} {} into {}".format('linking' if link else 'copying',
+                                     tree_dir, module_dir))
+        link_tree(tree_dir, module_dir, link)
+
+    def get_trees(self):
+        """ yields tuples (tree dir, mtime) for all cached trees """
+        if not os.path.isdir(self._root_dir):
+            return
+        for key in os.listdir(self._root_dir):
+            if key.endswith('.tmp'):
+                continue
+            tree_dir = self.get_tree_dir(key)
+            yield (tree_dir, os.path.getmtime(tree_dir))
+
+    def gc(self, max_count):
+        """ evicts the least recently used trees until at most max_count
+            trees remain. Projects that linked these trees keep their files.
+            Returns the number of evicted trees.
+        """
+        trees = sorted(self.get_trees(), key = lambda tree: tree[1])
+        evicted = trees[:max(0, len(trees) - max_count)]
+        for tree_dir, mtime in evicted:
+            print('evicting', tree_dir)
+            rmtree(tree_dir)
+        return len(evicted)
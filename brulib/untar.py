@@ -9,14 +9,20 @@ import os
 import sys
 if sys.version_info >= (3, 0):
     from urllib.parse import urlparse
-    from urllib.request import urlretrieve
+    from urllib.request import urlopen, Request
+    from urllib.error import HTTPError
 if sys.version_info < (3, 0):
     from urlparse import urlparse
-    from urllib import urlretrieve
+    from urllib2 import urlopen, Request, HTTPError
+import time
+import hashlib
 import tarfile
 import zipfile
 import shutil
-import pdb
+import subprocess
+import collections
+import concurrent.futures
+import brulib.jsonc
 import brulib.util
 
 def split_all(path):
@@ -50,94 +56,479 @@ def url2filename(url):
 
     return "_".join(components[-combined_component_count:])
 
-def wget(url, filename):
-    """ typically to download tar.gz or zip """
-    # from http://stackoverflow.com/questions/7243750/download-file-from-web-in-python-3
+class DigestMismatch(Exception):
+    """ raised if a download doesn't match the md5 or sha256 from the formula """
+    pass
+
+# the digests wget computes (and which formulas may specify)
+DIGEST_ALGORITHMS = ['md5', 'sha256']
+
+def verify_digests(name, digests, expected_digests):
+    """ raises DigestMismatch if any of the expected hex digests differs from
+        the computed ones.
+        param name is the url or file the digests were computed for
+    """
+    for algo, expected_digest in expected_digests.items():
+        if expected_digest != None and \
+           digests[algo].lower() != expected_digest.lower():
+            raise DigestMismatch("{} mismatch for {}: expected {} but got {}"
+                .format(algo, name, expected_digest, digests[algo]))
+
+def _new_hashes():
+    return dict((algo, hashlib.new(algo)) for algo in DIGEST_ALGORITHMS)
+
+def _hexdigests(hashes):
+    return dict((algo, hash.hexdigest()) for (algo, hash) in hashes.items())
+
+def _update_hashes(hashes, file):
+    """ feeds the remaining content of an open file into all hashes """
+    while True:
+        chunk = file.read(1024 * 1024)
+        if len(chunk) == 0:
+            break
+        for hash in hashes.values():
+            hash.update(chunk)
+
+def hash_file(filename):
+    """ returns dict mapping each of DIGEST_ALGORITHMS to the file's hex digest """
+    hashes = _new_hashes()
+    with open(filename, 'rb') as file:
+        _update_hashes(hashes, file)
+    return _hexdigests(hashes)
+
+def wget(url, filename, expected_digests={}, opener=urlopen):
+    """ typically to download tar.gz or zip. Streams the download into
+        filename, hashing chunks as they arrive. If filename exists already
+        (e.g. a partial download from an earlier interrupted process) then
+        the download resumes via an http range request, unless the server
+        doesn't support that.
+        param expected_digests maps 'md5' and/or 'sha256' to hex digests the
+              download is verified against, raising DigestMismatch (and
+              deleting filename) if any doesn't match.
+        param opener is urlopen, or a func like it for testing
+        Returns a dict mapping each of DIGEST_ALGORITHMS to the download's
+        hex digest.
+    """
+    offset = os.path.getsize(filename) if os.path.exists(filename) else 0
+    headers = {}
+    if offset > 0 and urlparse(url).scheme in ['http', 'https']:
+        headers['Range'] = 'bytes={}-'.format(offset)
     print("wget {} -> {}".format(url, filename))
-    urlretrieve(url, filename)
-
-def copy_symlink_members(to_directory, lnk_members):
-    """ instead of creating links copy these archive members """
-    for member in lnk_members:
-        assert member.issym() or member.islnk()
-        if member.isdir():
-            raise Exception("untar cannot deal with linked dirs yet (TODO?)")
-        dst = member.name
-        dstdir = os.path.dirname(dst)
-        brulib.util.mkdir_p(dstdir)
-        src = os.path.join(dstdir, member.linkname)
-        shutil.copyfile(os.path.join(to_directory, src).replace('\\', '/'), os.path.join(to_directory, dst).replace('\\', '/'))
-
-def extract_file(path, to_directory):
-    # from http://code.activestate.com/recipes/576714-extract-a-compressed-file/
-    # with slight modifications (without the cwd mess)
+    t0 = time.time()
+    try:
+        response = opener(Request(url, headers = headers))
+    except HTTPError as err:
+        # 416 means the partial download is complete alrdy (e.g. the process
+        # was killed before renaming it), but it may just as well be stale:
+        if err.code != 416 or not 'Range' in headers:
+            raise
+        print("cannot resume download of {}, starting over".format(url))
+        os.remove(filename)
+        return wget(url, filename, expected_digests, opener)
+    try:
+        hashes = _new_hashes()
+        if 'Range' in headers and response.getcode() == 206:
+            print("resuming download at byte {}".format(offset))
+            with open(filename, 'rb') as partial_file:
+                _update_hashes(hashes, partial_file)
+            mode = 'ab'
+        else:
+            mode = 'wb'
+        byte_count = 0
+        with open(filename, mode) as file:
+            while True:
+                chunk = response.read(256 * 1024)
+                if len(chunk) == 0:
+                    break
+                file.write(chunk)
+                for hash in hashes.values():
+                    hash.update(chunk)
+                byte_count += len(chunk)
+    finally:
+        response.close()
+
+    duration = max(time.time() - t0, 0.001)
+    print("downloaded {:.1f} MB in {:.1f}s ({:.1f} MB/s)".format(
+          byte_count / 1e6, duration, byte_count / 1e6 / duration))
+    digests = _hexdigests(hashes)
+    try:
+        verify_digests(url, digests, expected_digests)
+    except DigestMismatch:
+        os.remove(filename) # so that the next attempt starts from scratch
+        raise
+    return digests
+
+# External decompressors for tar archives, tried in this order. These run in
+# a separate process (pigz, pbzip2 and xz -T0 even on several cores), so that
+# decompression overlaps with writing the unpacked files. If none of them
+# are in the PATH (e.g. on Windows) the tarfile module decompresses instead.
+TAR_DECOMPRESSORS = [
+    (['.tar.gz', '.tgz'], 'gz', [['pigz', '-dc'], ['gzip', '-dc']]),
+    (['.tar.bz2', '.tbz'], 'bz2', [['pbzip2', '-dc'], ['bzip2', '-dc']]),
+    (['.tar.xz', '.txz'], 'xz', [['xz', '-dc', '-T0']]),
+]
+
+# max bytes of file content read from the tar stream but not written yet
+_MAX_PENDING_WRITE_BYTES = 64 * 1024 * 1024
+# unpacked files are handed to writer threads in batches of these sizes,
+# since handing off small files (e.g. boost headers) one by one costs more
+# than writing them:
+_WRITE_BATCH_FILES = 256
+_WRITE_BATCH_BYTES = 4 * 1024 * 1024
+# bigger files are copied from the tar stream in chunks right away instead
+# of being read into memory for the writer threads:
+_MAX_BUFFERED_FILE_BYTES = 1024 * 1024
+
+def get_tar_decompressor(path, use_external = True):
+    """ returns a tuple (tarfile compression e.g. 'gz', cmdline of external
+        decompressor or None) for the tar file path, or None if path isn't
+        a compressed tar file.
+    """
+    for suffixes, compression, cmdlines in TAR_DECOMPRESSORS:
+        if any(path.endswith(suffix) for suffix in suffixes):
+            if use_external:
+                for cmdline in cmdlines:
+                    if brulib.util.which(cmdline[0]) != None:
+                        return (compression, cmdline)
+            return (compression, None)
+    return None
+
+class UnresolvedLinks(Exception):
+    """ raised if archive links point to files that weren't unpacked """
+    pass
+
+def is_selected(name, prefixes):
+    """ returns True if the archive member name is one of the prefixes, or
+        underneath one of them.
+        param prefixes is None to select all members, or a set of dirs (or
+              files) in the archive, e.g. set(['boost-1.57.0/include'])
+    """
+    if prefixes == None:
+        return True
+    path = name.replace('\\', '/').rstrip('/')
+    while len(path) > 0:
+        if path in prefixes:
+            return True
+        path = path.rpartition('/')[0]
+    return False
+
+def check_member_name(name):
+    """ raises if the archive member would be unpacked outside of the
+        target dir. Link targets are checked by copy_link_members(). """
+    if name.startswith('..') or name.startswith('/') or name.startswith('\\') \
+            or '..' in name.replace('\\', '/').split('/'):
+        raise Exception('invalid archive member: ' + name)
+
+def _set_mode_and_mtime(dst, mode, mtime):
+    os.chmod(dst, mode & 0o777)
+    os.utime(dst, (mtime, mtime))
+
+def _write_members(batch):
+    """ param batch is a list of tuples (dst, content, mode, mtime) """
+    for dst, content, mode, mtime in batch:
+        with open(dst, 'wb') as file:
+            file.write(content)
+        _set_mode_and_mtime(dst, mode, mtime)
+
+def _copy_member(tar, member, dst):
+    """ writes the content of a file member in chunks as it's read from the
+        tar stream """
+    with open(dst, 'wb') as file:
+        shutil.copyfileobj(tar.extractfile(member), file)
+    _set_mode_and_mtime(dst, member.mode, member.mtime)
+
+def copy_link_members(to_directory, lnk_members):
+    """ instead of creating links copy the files (or dirs) these archive
+        members link to. Links to links are resolved by copying the
+        links' targets first.
+    """
+    pending = list(lnk_members)
+    while len(pending) > 0:
+        unresolved = []
+        for member in pending:
+            assert member.issym() or member.islnk()
+            if member.issym():
+                src = os.path.join(os.path.dirname(member.name), member.linkname)
+            else:
+                src = member.linkname # hardlinks are relative to the archive root
+            src = os.path.normpath(os.path.join(to_directory, src))
+            if os.path.relpath(src, to_directory).split(os.sep)[0] == '..':
+                raise Exception('invalid archive link: {} -> {}'.format(
+                                member.name, member.linkname))
+            dst = os.path.join(to_directory, member.name)
+            if not os.path.exists(src):
+                unresolved.append(member)
+                continue
+            brulib.util.mkdir_p(os.path.dirname(dst))
+            if os.path.isdir(src):
+                shutil.copytree(src, dst)
+            else:
+                shutil.copy2(src, dst)
+        if len(unresolved) == len(pending):
+            raise UnresolvedLinks('cannot resolve archive links ' + ', '.join(
+                '{} -> {}'.format(member.name, member.linkname)
+                for member in unresolved))
+        pending = unresolved
+
+def extract_tar_stream(tar, to_directory, jobs, prefixes = None):
+    """ extracts all members of a tar opened in streaming mode in a single
+        pass over the stream, handing off file writes in batches to a pool
+        of jobs threads (or writing them right away if jobs is 1). Files
+        bigger than _MAX_BUFFERED_FILE_BYTES are always written right away.
+        Link members are copied at the end.
+        param prefixes is None or a set of the archive's dirs to extract,
+              see is_selected()
+    """
+    lnk_members = []
+    created_dirs = set()
+    def mkdir_once(dir):
+        if not dir in created_dirs:
+            brulib.util.mkdir_p(dir)
+            created_dirs.add(dir)
+    pending_writes = collections.deque() # tuples (future, byte count)
+    pending_bytes = [0]
+    batch = []
+    batch_bytes = [0]
+    def flush_batch(executor):
+        if executor == None:
+            _write_members(batch)
+        else:
+            pending_writes.append((executor.submit(_write_members, list(batch)),
+                                   batch_bytes[0]))
+            pending_bytes[0] += batch_bytes[0]
+            while pending_bytes[0] > _MAX_PENDING_WRITE_BYTES:
+                future, byte_count = pending_writes.popleft()
+                future.result()
+                pending_bytes[0] -= byte_count
+        del batch[:]
+        batch_bytes[0] = 0
+
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers = jobs) \
+               if jobs > 1 else None
+    try:
+        for member in tar:
+            check_member_name(member.name)
+            if not is_selected(member.name, prefixes):
+                continue
+            dst = os.path.join(to_directory, member.name)
+            if member.isdir():
+                mkdir_once(os.path.normpath(dst))
+            elif member.issym() or member.islnk():
+                # the openssl tar created annoying symlinks on Windows which
+                # the Windows compiler toolchain couldn't read, so links are
+                # resolved by creating file copies (on Linux also for
+                # consistency's sake):
+                lnk_members.append(member)
+            elif member.isfile():
+                mkdir_once(os.path.normpath(os.path.dirname(dst)))
+                # in streaming mode the content must be read before advancing
+                # to the next member:
+                if executor == None or member.size > _MAX_BUFFERED_FILE_BYTES:
+                    _copy_member(tar, member, dst)
+                    continue
+                content = tar.extractfile(member).read()
+                batch.append((dst, content, member.mode, member.mtime))
+                batch_bytes[0] += len(content)
+                if len(batch) >= _WRITE_BATCH_FILES or \
+                   batch_bytes[0] >= _WRITE_BATCH_BYTES:
+                    flush_batch(executor)
+            # other member types (e.g. devices & fifos) are skipped
+        flush_batch(executor)
+        for future, byte_count in pending_writes:
+            future.result() # raises exceptions from failed writes
+    finally:
+        if executor != None:
+            executor.shutdown()
+    copy_link_members(to_directory, lnk_members)
+
+def extract_file(path, to_directory, jobs = None, use_external = None,
+                 prefixes = None):
+    """ unpacks a zip or (compressed) tar file into to_directory. Tar files
+        are read in a single streaming pass, decompressed by an external
+        process if available (see TAR_DECOMPRESSORS).
+        param jobs is the number of threads writing unpacked files, defaults
+              to the number of CPU cores.
+        param use_external can be set to False to always decompress via the
+              tarfile module, or True to use an external decompressor if
+              available. Defaults to using one only if there are several
+              CPU cores, since otherwise the decompressor competes with the
+              unpacking for the single core.
+        param prefixes is None to extract the whole archive, or a list of
+              the archive's dirs to extract, see is_selected()
+    """
+    if prefixes != None:
+        prefixes = set(prefixes)
+    if jobs == None:
+        jobs = brulib.util.get_default_job_count()
+    if use_external == None:
+        use_external = brulib.util.get_default_job_count() > 1
     if path.endswith('.zip'):
-        opener, mode = zipfile.ZipFile, 'r'
-    elif path.endswith('.tar.gz') or path.endswith('.tgz'):
-        opener, mode = tarfile.open, 'r:gz'
-    elif path.endswith('.tar.bz2') or path.endswith('.tbz'):
-        opener, mode = tarfile.open, 'r:bz2'
-    elif path.endswith('.tar.xz') or path.endswith('.txz'):
-        opener, mode = tarfile.open, 'r:xz'
-    else:
+        # zip files don't support symlinks, and their central directory
+        # already allows extracting them in one pass:
+        with zipfile.ZipFile(path, 'r') as file:
+            names = file.namelist()
+            for name in names:
+                check_member_name(name)
+            file.extractall(to_directory, members = [name for name in names
+                                          if is_selected(name, prefixes)])
+        return
+
+    decompressor = get_tar_decompressor(path, use_external)
+    if decompressor == None:
         raise ValueError("Could not extract {} as no appropriate extractor is found".format(path))
+    compression, cmdline = decompressor
+    if cmdline == None:
+        with tarfile.open(path, 'r|' + compression) as tar:
+            extract_tar_stream(tar, to_directory, jobs, prefixes)
+        return
 
-    with opener(path, mode) as file:
-        # initially all I did here was:
-        #   file.extractall(to_directory)
-        # but the openssl tar created annoying symlinks on Windows which
-        # the Windows compiler toolchain couldn't read.
-        # So let's resolve symlinks here, creating a copy instead:
-        if callable(getattr(file, "getmembers", None)): # e.g. tar files have that
-            nonlnk_members = []
-            lnk_members = []
-            for member in file.getmembers():
-                # TODO: http://stackoverflow.com/questions/10060069/safely-extract-zip-or-tar-using-python
-                if member.name.startswith('..') or member.name.startswith('/') \
-                        or member.name.startswith('\\'):
-                    raise Exception('invalid archive member: ' + member.name)
-                members = lnk_members if member.islnk() or member.issym() \
-                            else nonlnk_members
-                members.append(member)
-            file.extractall(to_directory, members = nonlnk_members)
-            # Instead of letting the tarfile impl create symlinks create file copies.
-            # This is only needed on Windows (otherwise openssl won't compile),
-            # but doing the same on Linux for consistency's sake:
-            copy_symlink_members(to_directory, lnk_members)
-        else:
-            # e.g. zip files don't have getmembers and don't support symlinks
-            file.extractall(to_directory)
-        file.close()
+    with open(path, 'rb') as compressed:
+        proc = subprocess.Popen(cmdline, stdin = compressed,
+                                stdout = subprocess.PIPE,
+                                bufsize = 1024 * 1024)
+        try:
+            with tarfile.open(fileobj = proc.stdout, mode = 'r|') as tar:
+                extract_tar_stream(tar, to_directory, jobs, prefixes)
+                # drains trailing padding so the decompressor can exit:
+                while len(proc.stdout.read(64 * 1024)) > 0:
+                    pass
+        except:
+            proc.kill()
+            raise
+        finally:
+            proc.stdout.close()
+            exit_code = proc.wait()
+    if exit_code != 0:
+        raise Exception("{} returned error {} for {}".format(
+                        ' '.join(cmdline), exit_code, path))
 
 def touch(file_name, times=None):
     # http://stackoverflow.com/questions/1158076/implement-touch-using-python
     with open(file_name, 'a'):
         os.utime(file_name, times)
 
-def untar_once(zip_file, module_dir):
-    """ unpacks tar or zip file unless we unpacked it in the past alrdy """
+def get_unpack_markers(zip_file_basename, module_dir):
+    """ returns the paths of the marker files written after unpacking the
+        whole archive or only parts of it into module_dir """
+    return (os.path.join(module_dir, zip_file_basename + ".unpack_done"),
+            os.path.join(module_dir, zip_file_basename + ".unpack_partial"))
+
+def is_unpacked(zip_file_basename, module_dir, prefixes = None):
+    """ returns True if the archive (or at least its dirs listed in prefixes)
+        was unpacked into module_dir in the past alrdy """
+    (extract_done_file, partial_file) = get_unpack_markers(zip_file_basename,
+                                                           module_dir)
+    if os.path.exists(extract_done_file):
+        return True
+    if prefixes == None or not os.path.exists(partial_file):
+        return False
+    unpacked_prefixes = brulib.jsonc.loadfile(partial_file)['prefixes']
+    return set(prefixes).issubset(unpacked_prefixes)
+
+def untar_once(zip_file, module_dir, prefixes = None):
+    """ unpacks tar or zip file unless we unpacked it in the past alrdy
+        param prefixes is None to unpack the whole archive, or a list of the
+              archive's dirs to unpack, in which case unpacking them adds to
+              the dirs unpacked by earlier calls. If links in these dirs point
+              outside of them the whole archive is unpacked after all.
+    """
     zip_file_basename = os.path.basename(zip_file)
     assert len(zip_file_basename) > 0
-    extract_done_file = os.path.join(module_dir, zip_file_basename + ".unpack_done")
-    if not os.path.exists(extract_done_file):
-        print("unpacking {}".format(zip_file))
-        extract_file(zip_file, module_dir)
-        touch(extract_done_file)
+    if is_unpacked(zip_file_basename, module_dir, prefixes):
+        return
+    (extract_done_file, partial_file) = get_unpack_markers(zip_file_basename,
+                                                           module_dir)
+    if prefixes != None:
+        if os.path.exists(partial_file):
+            prefixes = set(prefixes).union(
+                brulib.jsonc.loadfile(partial_file)['prefixes'])
+        print("unpacking {} partially".format(zip_file))
+        try:
+            extract_file(zip_file, module_dir, prefixes = prefixes)
+            brulib.jsonc.savefile(partial_file, {'prefixes': sorted(prefixes)})
+            return
+        except UnresolvedLinks as err:
+            print('WARNING: {}, unpacking all of {}'.format(err, zip_file))
+    print("unpacking {}".format(zip_file))
+    extract_file(zip_file, module_dir)
+    touch(extract_done_file)
+    if os.path.exists(partial_file):
+        os.remove(partial_file)
 
-def wget_and_untar_once(zip_url, tar_dir, module_dir):
-    """ Does a wget to download a tar.gz or zip file, then unzips the download
-        into the given target dir. Both the wget and unzip will happen only
-        if they hadn't completed in the past yet.
+def is_verified_download(zip_file, expected_digests):
+    """ returns True if the previously downloaded zip_file is complete and
+        matches the expected digests. Digests are recorded in a *.digests
+        file next to each download, so usually this costs a single os.stat,
+        except for downloads from older bru versions which get hashed once.
+    """
+    digests_file = zip_file + '.digests'
+    size = os.path.getsize(zip_file)
+    if os.path.exists(digests_file):
+        digests = brulib.jsonc.loadfile(digests_file)
+        if digests.get('size') != size:
+            return False # e.g. truncated
+    else:
+        digests = hash_file(zip_file)
+        digests['size'] = size
+        brulib.jsonc.savefile(digests_file, digests)
+    try:
+        verify_digests(zip_file, digests, expected_digests)
+    except DigestMismatch as err:
+        print('WARNING:', err)
+        return False
+    return True
+
+def wget_once(zip_url, tar_dir, expected_digests={}, store=None):
+    """ Does a wget to download a tar.gz or zip file unless it was downloaded
+        in the past already. Returns the path of the downloaded file.
         param zip_url e.g. http://bla/foo.tar.gz
         param tar_dir is the dir in which to stored the downloaded tar
               (e.g. ~/.bru/cached_downloads)
-        param module_dir is the dir to unpack the tar into
+        param expected_digests maps 'md5' and/or 'sha256' to the hex digests
+              the download must match, see wget()
+        param store is an optional brulib.store.DownloadStore: downloads are
+              then kept in the store and hardlinked into tar_dir, and are
+              only downloaded if the store doesn't have them yet.
     """
     zip_file = os.path.join(tar_dir, url2filename(zip_url))
-    if not os.path.exists(zip_file):
+    if os.path.exists(zip_file) and \
+       not is_verified_download(zip_file, expected_digests):
+        print('discarding corrupt or outdated download', zip_file)
+        os.remove(zip_file)
+    if os.path.exists(zip_file):
+        if store != None:
+            digests = brulib.jsonc.loadfile(zip_file + '.digests')
+            if store.find(zip_url, digests) == None:
+                store.adopt(zip_file, digests, zip_url)
+            store.touch(digests['sha256'])
+    else:
         brulib.util.mkdir_p(tar_dir)
         zip_file_temp = zip_file + ".tmp"
-        wget(zip_url, zip_file_temp)
-        os.rename(zip_file_temp, zip_file)
+        sha256 = store.find(zip_url, expected_digests) if store != None else None
+        if sha256 != None:
+            print("using {} from {}".format(url2filename(zip_url),
+                                            store.get_object_file(sha256)))
+            digests = store.get_digests(sha256)
+        else:
+            digests = wget(zip_url, zip_file_temp, expected_digests)
+            digests['size'] = os.path.getsize(zip_file_temp)
+            if store != None:
+                sha256 = store.add(zip_file_temp, digests, zip_url)
+        brulib.jsonc.savefile(zip_file + '.digests', digests)
+        if store != None:
+            store.materialize(sha256, zip_file)
+        else:
+            os.rename(zip_file_temp, zip_file)
 
+    return zip_file
+
+def wget_and_untar_once(zip_url, tar_dir, module_dir, expected_digests={},
+                        store=None):
+    """ Does a wget to download a tar.gz or zip file, then unzips the download
+        into the given target dir. Both the wget and unzip will happen only
+        if they hadn't completed in the past yet.
+        param module_dir is the dir to unpack the tar into
+        See wget_once() for the other params.
+    """
+    zip_file = wget_once(zip_url, tar_dir, expected_digests, store)
     untar_once(zip_file, module_dir)
@@ -1,6 +1,8 @@
 import sys
 import os
 import errno
+import shutil
+import multiprocessing
 
 def mkdir_p(path):
     if sys.version_info < (3, 0):
@@ -13,4 +15,51 @@ def mkdir_p(path):
             else: raise
         
     else:
-        os.makedirs(path, exist_ok=True)
\ No newline at end of file
+        os.makedirs(path, exist_ok=True)
+
+def link_or_copy(src, dst):
+    """ hardlinks src to dst, falling back to a copy if src and dst are on
+        different file systems (or the file system doesn't do hardlinks) """
+    if os.path.exists(dst):
+        os.remove(dst)
+    try:
+        os.link(src, dst)
+    except (OSError, AttributeError): # AttributeError: no os.link on py2 Windows
+        shutil.copy2(src, dst)
+
+def replace_file(src, dst):
+    """ renames src to dst, overwriting dst if it exists. That's atomic
+        except on py2 Windows, where rename doesn't overwrite. """
+    if hasattr(os, 'replace'):
+        os.replace(src, dst)
+        return
+    if sys.platform == 'win32' and os.path.exists(dst):
+        os.remove(dst)
+    os.rename(src, dst)
+
+def get_dir_size(dir):
+    """ returns the total size of all files underneath dir """
+    size = 0
+    for root, dirs, files in os.walk(dir):
+        for file in files:
+            size += os.path.getsize(os.path.join(root, file))
+    return size
+
+def get_default_job_count():
+    """ the default for the --jobs option of 'bru install': one job per
+        CPU core """
+    try:
+        return multiprocessing.cpu_count()
+    except NotImplementedError:
+        return 1
+
+def which(program):
+    """ returns the full path of the executable program if it's found in the
+        PATH, otherwise None. Like shutil.which, which py2 doesn't have. """
+    if hasattr(shutil, 'which'):
+        return shutil.which(program)
+    for dir in os.environ.get('PATH', '').split(os.pathsep):
+        path = os.path.join(dir, program)
+        if os.path.isfile(path) and os.access(path, os.X_OK):
+            return path
+    return None
@@ -59,7 +59,7 @@ def main():
     # at the latest one for simplicity's sake.
     module2formula = {}
     library = get_library()
-    for module in os.listdir('library'):
+    for module in library.get_all_modules():
         version = library.get_latest_version_of(module)
         formula = library.load_formula(module, version)
         module2formula[module] = formula
@@ -83,10 +83,11 @@ def fix_annoying_dependency_cycle(module_names, target_module, version):
     print('merging dependency cycle:', module_names, 'into', target_module)
     library = get_library()
     formulas = list(map(
-        lambda module_name: library.load_formula(module_name, version), 
+        lambda module_name: copy.deepcopy(
+            library.load_formula(module_name, version)),
         module_names))
     gyps = list(map(
-        lambda formula: library.load_gyp(formula),
+        lambda formula: copy.deepcopy(library.load_gyp(formula)),
         formulas))
 
     # Merge the *.bru files.
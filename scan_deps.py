@@ -35,12 +35,21 @@ import os
 import re
 import os.path
 import glob
+import copy
 import collections
 import itertools
 import functools # @total_ordering
 import subprocess
+import hashlib
+import threading
+import concurrent.futures
+import brulib.globcache
+import brulib.graph
+import brulib.includescan
+import brulib.jsonc
 import brulib.library
 import brulib.module_downloader
+import brulib.util
 import pdb # only if you want to add pdb.set_trace()
 
 def get_library():
@@ -49,25 +58,7 @@ def get_library():
 def get_includes_from_cpp(cpp_file_name):
     """ open cpp or hpp file and scans it for #includes, returning the
         list of #includes """
-
-    # the regex is suboptimal? Should match a large percentage of #includes
-    #print("reading " + cpp_file_name)
-    pattern = re.compile('\\s*#\\s*include\\s*[\\<"](.*)[\\>"]')
-    try:
-        with open(cpp_file_name, 'r') as cpp_file:
-            while True:
-                line = cpp_file.readline()
-                if len(line) == 0:
-                    break # eof
-                match = pattern.search(line)
-                if match != None:
-                    included_file = match.group(1)
-                    #print("  includes " + included_file)
-                    yield included_file
-    except:
-        # Some files we open experimentally assuming they are a utf8 cpp file
-        # may not actually be one. Ignore these.
-        print("WARNING: could not get includes from ", cpp_file_name)
+    return brulib.includescan.get_includes(cpp_file_name)
 
 def get_all_modules(library_path):
     return (dir for dir in os.listdir(library_path) 
@@ -134,9 +125,33 @@ def collect_includes(formula):
         print("WARNING: no includes for module ", module)
     return include_files
 
+def get_module_hash(library, formula, bru_modules_path):
+    """ returns a hash over everything the #include files of a module version
+        depend on: its *.bru and *.gyp files in the library, as well as the
+        markers written when its archives were unpacked (or cloned) """
+    module = formula['module']
+    version = formula['version']
+    hash = hashlib.sha1()
+    for ext in ['.bru', '.gyp']:
+        filename = library.get_file_name(module, version, ext)
+        if os.path.exists(filename):
+            with open(filename, 'rb') as file:
+                hash.update(file.read())
+    stamp = brulib.globcache.get_unpack_stamp(
+        os.path.join(bru_modules_path, module, version))
+    hash.update(json.dumps(stamp).encode('utf8'))
+    return hash.hexdigest()
+
 class IncludeFileIndex:
     """ created from a list of modules, each of which has a set of #include
-        files. Quickly can find which module offers which #include file """
+        files. Quickly can find which module offers which #include file.
+        The #include files of each module version are persisted in
+        bru_modules/bru-include-index.json along with a hash of the module's
+        formula, gyp & unpacked archives, so that only modules for which
+        these changed are downloaded & scanned again.
+    """
+
+    INDEX_VERSION = 1
 
     def __init__(self, library_path, bru_modules_path):
         # different module_versions may end up with different sets if
@@ -144,17 +159,36 @@ class IncludeFileIndex:
         # Only the latest known version of each module? All modules
         # whose tar.gz was downloaded already anyway?
         self.include2modules = {} 
-        library = get_library()
-        for module in get_all_modules(library_path):
-            print('scanning #includes for', module)
+        library = brulib.library.Library(library_path)
+        index_file = os.path.join(bru_modules_path, 'bru-include-index.json')
+        old_entries = {}
+        if os.path.exists(index_file):
+            index = brulib.jsonc.loadfile(index_file)
+            if index.get('version') == IncludeFileIndex.INDEX_VERSION:
+                old_entries = index['entries']
+        entries = collections.OrderedDict()
+        for module in sorted(get_all_modules(library_path)):
             for version in library.get_all_versions(module):
                 formula = library.load_formula(module, version)
-                brulib.module_downloader.get_urls(library, formula, bru_modules_path)
-                includes = [two_component_path.path 
-                    for two_component_path in collect_includes(formula)]
-                includes.sort()
-                #print("includes for ", module, ": ", includes)
-                self._remember_includes(module, includes)
+                key = '{}@{}'.format(module, version)
+                entry = old_entries.get(key)
+                if entry == None or entry['hash'] != get_module_hash(
+                        library, formula, bru_modules_path):
+                    print('scanning #includes for', module, version)
+                    brulib.module_downloader.get_urls(library, formula, bru_modules_path)
+                    includes = [two_component_path.path 
+                        for two_component_path in collect_includes(formula)]
+                    includes.sort()
+                    #print("includes for ", module, ": ", includes)
+                    entry = collections.OrderedDict([
+                        ('hash', get_module_hash(library, formula,
+                                                 bru_modules_path)),
+                        ('includes', includes)])
+                entries[key] = entry
+                self._remember_includes(module, entry['includes'])
+        brulib.jsonc.savefile_if_changed(index_file, collections.OrderedDict([
+            ('version', IncludeFileIndex.INDEX_VERSION),
+            ('entries', entries)]))
 
     def _remember_includes(self, module, includes):
         for include in includes:
@@ -195,8 +229,262 @@ def find_includes(include_root_dir):
             includes.append(include_file)
     return includes
 
-def scan_deps(formula, include_file_index):
-    """ param module like "boost-asio", version like "1.57.0" """
+class IncludeGraph:
+    """ the graph of files #including other files across all modules, which
+        is built incrementally (scanning each file once via an IncludeScanner)
+        and shared by all scanned modules. Instead of mapping each #include
+        of a module's files to a module directly, this follows #includes of
+        the module's own files transitively, and reduces the other modules
+        reached this way to the minimal set: a module that is #included
+        (transitively) by another dep anyway isn't listed as a dep itself.
+        The modules reachable from each file are memoized, so that the
+        closures of headers #included by many modules (e.g. boost-config's)
+        are computed only once. Include cycles are dealt with by computing
+        closures per strongly connected component of the graph (see
+        brulib.graph).
+    """
+
+    def __init__(self, include_file_index, scanner, library,
+                 bru_modules_path = './bru_modules'):
+        self._index = include_file_index
+        self._scanner = scanner
+        self._library = library
+        self._bru_modules_path = os.path.normpath(bru_modules_path)
+        self._file2includes = {} # file -> list of files it #includes
+        self._file2unknown_includes = {} # file -> #includes found nowhere
+        self._file2module = {}
+        self._file2modules_closure = {} # memoized modules reachable from file
+        self._module2include_dirs = {}
+        self._resolved = {} # (dir, #include) -> list of files
+        # modules are scanned concurrently by scan_arg_modules(), the lock
+        # guards all changes to the graph (files & their closures):
+        self._lock = threading.Lock()
+
+    def get_module(self, filename):
+        """ returns the module a file in bru_modules belongs to """
+        if not filename in self._file2module:
+            path = os.path.relpath(filename, self._bru_modules_path)
+            self._file2module[filename] = path.split(os.sep)[0]
+        return self._file2module[filename]
+
+    def _get_include_dirs(self, module):
+        """ returns the include dirs of the latest version of the module """
+        if not module in self._module2include_dirs:
+            formula = self._library.load_formula(module,
+                self._library.get_latest_version_of(module))
+            gyp_root = os.path.join(self._bru_modules_path, module)
+            self._module2include_dirs[module] = [
+                os.path.join(gyp_root, include_dir)
+                for target in self._library.load_gyp(formula)['targets']
+                for include_dir in target.get('include_dirs', [])]
+        return self._module2include_dirs[module]
+
+    def _resolve(self, filename, include):
+        """ returns the list of files an #include in filename refers to,
+            which is empty if no module contains the #include. Since the
+            scanner doesn't distinguish between #include <...> and "..."
+            any #include is first searched for relative to the including
+            file, which may overestimate deps slightly.
+        """
+        key = (os.path.dirname(filename), include)
+        if key in self._resolved:
+            return self._resolved[key]
+        relative = os.path.normpath(os.path.join(key[0], include))
+        if os.path.isfile(relative):
+            files = [relative]
+        else:
+            files = []
+            for module in sorted(self._index.get_modules_containing(include)):
+                for include_dir in self._get_include_dirs(module):
+                    path = os.path.normpath(os.path.join(include_dir, include))
+                    if os.path.isfile(path):
+                        files.append(path)
+                        break
+                else:
+                    # the module's latest version doesn't have the file on
+                    # disk, so it's a file without #includes of that module:
+                    path = os.path.normpath(os.path.join(
+                        self._bru_modules_path, module, include))
+                    if not path in self._file2includes:
+                        self._file2includes[path] = []
+                        self._file2unknown_includes[path] = set()
+                    files.append(path)
+        self._resolved[key] = files
+        return files
+
+    def _get_unscanned(self, filenames, seen):
+        """ returns the set of files not in the graph yet among the given
+            files and the files these #include transitively, skipping (and
+            adding to) the set of files seen before. Call this with the lock
+            held.
+        """
+        unscanned = set()
+        todo = [filename for filename in filenames if not filename in seen]
+        seen.update(todo)
+        while len(todo) > 0:
+            filename = todo.pop()
+            if not filename in self._file2includes:
+                unscanned.add(filename)
+                continue
+            for child in self._file2includes[filename]:
+                if not child in seen:
+                    seen.add(child)
+                    todo.append(child)
+        return unscanned
+
+    def _add_files(self, filenames):
+        """ scans the files and all files they #include transitively, in one
+            batch per level of #includes. Scanning happens without holding
+            the lock, so that modules are scanned concurrently. Two threads
+            may therefore scan the same file, which the scanner's cache makes
+            cheap, and only the first result is added to the graph.
+        """
+        seen = set()
+        with self._lock:
+            todo = self._get_unscanned(filenames, seen)
+        while len(todo) > 0:
+            scanned = self._scanner.scan(sorted(todo))
+            with self._lock:
+                for filename, includes in sorted(scanned.items()):
+                    if filename in self._file2includes:
+                        continue # added by another thread in the meantime
+                    resolved = []
+                    unknown = set()
+                    for include in includes:
+                        files = self._resolve(filename, include)
+                        if len(files) == 0:
+                            unknown.add(include)
+                        resolved += files
+                    self._file2includes[filename] = resolved
+                    self._file2unknown_includes[filename] = unknown
+                todo = self._get_unscanned(itertools.chain.from_iterable(
+                    self._file2includes[filename] for filename in scanned),
+                    seen)
+
+    def _update_closures(self, filenames):
+        """ memoizes the set of modules reachable from each of the files and
+            the files they #include transitively, including each file's own
+            module. The files of an SCC all share the same closure, and each
+            SCC is processed after the ones it #includes. Call this with the
+            lock held, after _add_files(filenames).
+        """
+        closures = self._file2modules_closure
+        graph = collections.OrderedDict()
+        todo = [filename for filename in filenames if not filename in closures]
+        while len(todo) > 0:
+            filename = todo.pop()
+            if filename in graph:
+                continue
+            graph[filename] = [child for child in self._file2includes[filename]
+                               if not child in closures]
+            todo += graph[filename]
+        for scc in brulib.graph.strongly_connected_components(graph):
+            modules = set(self.get_module(member) for member in scc)
+            for member in scc:
+                for child in self._file2includes[member]:
+                    if child in closures:
+                        modules.update(closures[child])
+            closure = frozenset(modules)
+            for member in scc:
+                closures[member] = closure
+
+    def _get_entry_files(self, module, filenames):
+        """ follows #includes from the module's files through the module's
+            own files, returning the set of files in other modules reached
+            this way, as well as the set of #includes found in no module """
+        entry_files = set()
+        unknown = set()
+        seen = set(filenames)
+        todo = list(filenames)
+        while len(todo) > 0:
+            filename = todo.pop()
+            unknown.update(self._file2unknown_includes[filename])
+            for child in self._file2includes[filename]:
+                if self.get_module(child) != module:
+                    entry_files.add(child)
+                elif not child in seen:
+                    seen.add(child)
+                    todo.append(child)
+        return (entry_files, unknown)
+
+    def _get_reachable_modules(self, entry_files):
+        """ returns dict module -> set of modules reachable from the entry
+            files in that module """
+        module2reachable = collections.defaultdict(set)
+        for entry_file in entry_files:
+            module2reachable[self.get_module(entry_file)].update(
+                self._file2modules_closure[entry_file])
+        return module2reachable
+
+    def _get_minimal_modules(self, module, entry_files):
+        """ returns the modules of the entry files minus the ones reachable
+            via another of these modules (a transitive reduction). Of modules
+            reachable from each other only the alphabetically first is kept.
+        """
+        module2reachable = self._get_reachable_modules(entry_files)
+        minimal = set()
+        for dep in module2reachable:
+            if dep == module:
+                continue
+            redundant = any(dep in reachable and (
+                                not other in module2reachable[dep] or
+                                other < dep)
+                            for other, reachable in module2reachable.items()
+                            if other != dep and other != module)
+            if not redundant:
+                minimal.add(dep)
+        return minimal
+
+    def get_module_deps(self, module, include_files, src_files):
+        """ returns a tuple (public deps, private deps, unknown #includes)
+            for the module with the given header and source files, where
+            public deps are the minimal set of modules reached from the
+            headers, and private deps the additional ones reached from the
+            sources.
+        """
+        include_files = [os.path.normpath(file) for file in include_files]
+        src_files = [os.path.normpath(file) for file in src_files]
+        self._add_files(include_files + src_files)
+        with self._lock:
+            self._update_closures(include_files + src_files)
+        # the rest only reads the parts of the graph that are complete now,
+        # which other threads only add to:
+        (hpp_entry_files, unknown_from_hpp) = self._get_entry_files(
+            module, include_files)
+        (cpp_entry_files, unknown_from_cpp) = self._get_entry_files(
+            module, src_files)
+        public = self._get_minimal_modules(module, hpp_entry_files)
+        reachable_from_hpp = set(itertools.chain.from_iterable(
+            self._get_reachable_modules(hpp_entry_files).values()))
+        private = self._get_minimal_modules(module,
+            hpp_entry_files.union(cpp_entry_files))
+        private.difference_update(public)
+        private.difference_update(reachable_from_hpp)
+        return (public, private, unknown_from_hpp.union(unknown_from_cpp))
+
+class ModuleDeps:
+    """ the result of scanning a module's files for #includes """
+
+    def __init__(self, module, include_files, src_files):
+        self.module = module
+        self.include_files = include_files
+        self.src_files = src_files
+        self.public = set()  # modules #included by the module's headers
+        self.private = set() # modules #included only by its sources
+        self.unknown_includes = set()
+
+def scan_module_deps(formula, include_file_index, scanner = None,
+                     include_graph = None):
+    """ scans the #includes of a module's header and source files, returning
+        a ModuleDeps. The modules #included by the headers are the module's
+        public deps, the ones #included by the sources only are private deps
+        (see the comment at the top of this file).
+        param scanner is an optional brulib.includescan.IncludeScanner
+        param include_graph is an optional IncludeGraph, which yields the
+              minimal deps instead of the modules of all direct #includes
+    """
+    if scanner == None:
+        scanner = brulib.includescan.IncludeScanner(jobs = 1)
     
     module = formula['module']
     version = formula['version']
@@ -227,40 +515,42 @@ def scan_deps(formula, include_file_index):
                 # relative to gyp_root
                 src_files += glob.glob(os.path.join(gyp_root, src_filename))
 
-    def abbreviate_list(elems):
-        max_len = 5
-        if len(elems) <= max_len:
-            return elems
-        return elems[:max_len] + ['...']
-    print('include_files:\n', '\n'.join(abbreviate_list(include_files)))
-    print('src files:\n', '\n'.join(abbreviate_list(src_files)))
+    module_deps = ModuleDeps(module, include_files, src_files)
+    if include_graph != None:
+        (module_deps.public, module_deps.private,
+         module_deps.unknown_includes) = include_graph.get_module_deps(
+            module, include_files, src_files)
+        return module_deps
 
     def get_included_files(cpp_files):
         return set(itertools.chain.from_iterable(
-                      get_includes_from_cpp(file) 
-                      for file in include_files))
+                      scanner.scan(cpp_files).values()))
 
     included_files_from_hpp = get_included_files(include_files)
     included_files_from_cpp = get_included_files(src_files)
 
-    #for included_file in included_files_from_hpp:
-    #    print(included_file, include_file_index.get_modules_containing(included_file))
-
     # now we know what #include files are needed by the module let's 
     # automatically find out which (other) modules are providing these
     # includes:
-    included_files = included_files_from_hpp.union(included_files_from_cpp)
-    included_modules, unknown_includes = get_modules_for_includes(
-        included_files, 
-        include_file_index)
+    module_deps.public, unknown_from_hpp = get_modules_for_includes(
+        included_files_from_hpp, include_file_index)
+    module_deps.private, unknown_from_cpp = get_modules_for_includes(
+        included_files_from_cpp, include_file_index)
+    module_deps.unknown_includes = unknown_from_hpp.union(unknown_from_cpp)
 
     # remove the obvious dep to the same module:
-    def remove_if_exists(set, elem):
-        if elem in set:
-             set.remove(elem)
-    remove_if_exists(included_modules, module)
-
-    return (included_modules, unknown_includes)
+    module_deps.public.discard(module)
+    module_deps.private.discard(module)
+    module_deps.private.difference_update(module_deps.public)
+    return module_deps
+
+def scan_deps(formula, include_file_index, scanner = None):
+    """ param module like "boost-asio", version like "1.57.0"
+        Returns a tuple (public & private module deps, unknown includes)
+    """
+    module_deps = scan_module_deps(formula, include_file_index, scanner)
+    return (module_deps.public.union(module_deps.private),
+            module_deps.unknown_includes)
 
 def is_in_scm(path):
     """ return true if the file is (git) versioned """
@@ -280,7 +570,8 @@ def get_arg_modules(module, version):
     library = get_library()
     if module.endswith('*'):
         lib_dir = './library'
-        matching_dirs = glob.glob(os.path.join(lib_dir, module))
+        matching_dirs = [dir for dir in glob.glob(os.path.join(lib_dir, module))
+                         if os.path.isdir(dir)]
         modules = [os.path.relpath(dir, start=lib_dir) for dir in matching_dirs]
         return [(module, version or library.get_latest_version_of(module)) 
                 for module in modules]
@@ -295,74 +586,125 @@ def main():
         help = "version of module, e.g. 1.57.0, defaults to latest if unspecified")
     parser.add_argument('--recursive', '-r', action='store_true', 
         help='recursively find dependencies')
+    parser.add_argument('--minimal', action='store_true',
+        help='follow #includes transitively and list only the minimal set '
+             'of deps, omitting modules #included via other deps anyway')
+    parser.add_argument('--jobs', '-j', type=int,
+        default=brulib.util.get_default_job_count(),
+        help='number of modules to scan concurrently, as well as the number'
+             ' of processes scanning files for #includes')
     args = parser.parse_args()
-    index = IncludeFileIndex('./library', './bru_modules')
-    library = get_library()
-
-    todo_module_version = get_arg_modules(args.module, args.version)
-    done_modules = set()
-    while len(todo_module_version) > 0:
-        module, version = todo_module_version.pop()
-        if module in done_modules:
-            continue
-        
-        print("scanning module {} version {}".format(module, version))
-        formula = library.load_formula(module, version)
-        (deps, missing_includes) = scan_deps(formula, index)
-        print("dependencies: ")
+    # the #includes of each file are cached across runs, so that e.g.
+    # recursive scans only read files that changed since the last run:
+    cache = brulib.includescan.IncludeCache(
+        os.path.join('./bru_modules', 'bru-include-cache.json'))
+    with brulib.includescan.IncludeScanner(args.jobs, cache) as scanner:
+        scan_arg_modules(args, scanner)
+
+def abbreviate_list(elems):
+    max_len = 5
+    if len(elems) <= max_len:
+        return elems
+    return elems[:max_len] + ['...']
+
+def save_module_deps(library, formula, module_deps):
+    """ prints the scanned deps of a module and adds them to its formula
+        and gyp file, unless these list deps alrdy.
+        param module_deps is a ModuleDeps
+    """
+    module = formula['module']
+    version = formula['version']
+    print("scanned module {} version {}".format(module, version))
+    print('include_files:\n', '\n'.join(abbreviate_list(module_deps.include_files)))
+    print('src files:\n', '\n'.join(abbreviate_list(module_deps.src_files)))
+    for kind, deps in [('public', module_deps.public),
+                       ('private', module_deps.private)]:
+        print("{} dependencies: ".format(kind))
         for dep in sorted(deps):
             # show for each dep if it was git added alrdy
             print(dep, '' if is_in_scm(os.path.join('library', dep)) else '*')
-        if len(missing_includes) > 0:
-            print("missing includes: ", missing_includes)
-
-        # now add the computed dependencies to the formula, unless
-        # the formula alrdy epxlicitly lists deps:
-        if not 'dependencies' in formula:
-            def annotate_with_latest_version(modules):
-                dependency2version = collections.OrderedDict()
-                for module in sorted(modules):
-                    dependency2version[module] = library.get_latest_version_of(module)
-                return dependency2version
-
-            # remove deps we consider builtin, like C++ stdlib and C lib. 
-            # This here is kinda fuzzy and differs between OSs.
-            builtin_deps = set([
-                'llvm-libcxx'
-            ])
-            deps = deps.difference(builtin_deps)
-
-            formula['dependencies'] = annotate_with_latest_version(deps)
-            print(formula)
-            library.save_formula(formula)
-
-        # also add the deps to the gyp in a sloppy & ad-hoc way for now:
-        # this works sort of ok for modules with a single target only (e.g.
-        # the boost modules after boost_import.py): add the all found
-        # deps to the first gyp target's dependencies.
-        if len(deps) > 0:
-            gyp = library.load_gyp(formula)
-            first_target = gyp['targets'][0]
-            if not 'dependencies' in first_target:
-                # Todo: reconsider the ':*' dependency on all targets in 
-                # upstream modules. May wanna exclude test targets from this,
-                # which we cannot do here easily though. Maybe bru.py can
-                # exclude test targets later on? Test targets give extra
-                # confidence that things are wired up fine, but will increase
-                # initial compile times after 'bru install'.
-                first_target['dependencies'] = [
-                    "../{}/{}.gyp:*".format(dep, dep) for dep in deps]
-                library.save_gyp(formula, gyp)
-
-        done_modules.add(module)
-
-        if args.recursive:
-            direct_dependency_modules = list(item for item in deps)
-            todo_module_version += ((module, library.get_latest_version_of(module)) 
-                                   for module in direct_dependency_modules)
+    if len(module_deps.unknown_includes) > 0:
+        print("missing includes: ", module_deps.unknown_includes)
+    deps = module_deps.public.union(module_deps.private)
+
+    # now add the computed dependencies to the formula, unless
+    # the formula alrdy epxlicitly lists deps:
+    if not 'dependencies' in formula:
+        def annotate_with_latest_version(modules):
+            dependency2version = collections.OrderedDict()
+            for module in sorted(modules):
+                dependency2version[module] = library.get_latest_version_of(module)
+            return dependency2version
+
+        # remove deps we consider builtin, like C++ stdlib and C lib. 
+        # This here is kinda fuzzy and differs between OSs.
+        builtin_deps = set([
+            'llvm-libcxx'
+        ])
+        deps = deps.difference(builtin_deps)
+
+        formula = copy.deepcopy(formula) # the library's is shared
+        formula['dependencies'] = annotate_with_latest_version(deps)
+        print(formula)
+        library.save_formula(formula)
+
+    # also add the deps to the gyp in a sloppy & ad-hoc way for now:
+    # this works sort of ok for modules with a single target only (e.g.
+    # the boost modules after boost_import.py): add the all found
+    # deps to the first gyp target's dependencies.
+    if len(deps) > 0:
+        gyp = copy.deepcopy(library.load_gyp(formula))
+        first_target = gyp['targets'][0]
+        if not 'dependencies' in first_target:
+            # Todo: reconsider the ':*' dependency on all targets in 
+            # upstream modules. May wanna exclude test targets from this,
+            # which we cannot do here easily though. Maybe bru.py can
+            # exclude test targets later on? Test targets give extra
+            # confidence that things are wired up fine, but will increase
+            # initial compile times after 'bru install'.
+            first_target['dependencies'] = [
+                "../{}/{}.gyp:*".format(dep, dep) for dep in sorted(deps)]
+            library.save_gyp(formula, gyp)
+
+def scan_arg_modules(args, scanner):
+    """ scans the modules given by args, and with args.recursive also the
+        modules they depend on. Each module is scheduled on a pool of
+        threads as soon as it's discovered, while results are printed and
+        saved by this thread (so that formulas are never saved concurrently)
+        in the order the scans complete.
+    """
+    index = IncludeFileIndex('./library', './bru_modules')
+    library = get_library()
+    include_graph = IncludeGraph(index, scanner, library) \
+                    if args.minimal else None
+
+    scheduled_modules = set()
+    futures = {} # future -> formula
+    def schedule(executor, module, version):
+        if module in scheduled_modules:
+            return
+        scheduled_modules.add(module)
+        formula = library.load_formula(module, version)
+        future = executor.submit(scan_module_deps, formula, index, scanner,
+                                 include_graph)
+        futures[future] = formula
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=args.jobs) as executor:
+        for module, version in get_arg_modules(args.module, args.version):
+            schedule(executor, module, version)
+        while len(futures) > 0:
+            done, not_done = concurrent.futures.wait(
+                futures, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                formula = futures.pop(future)
+                module_deps = future.result()
+                save_module_deps(library, formula, module_deps)
+                if args.recursive:
+                    for dep in sorted(module_deps.public.union(module_deps.private)):
+                        schedule(executor, dep, library.get_latest_version_of(dep))
 
     if args.recursive:
-        print("recursive module dependencies: ", done_modules)
+        print("recursive module dependencies: ", sorted(scheduled_modules))
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,108 @@
+import unittest
+import brulib.artifacts
+import brulib.jsonc
+import brulib.library
+import os
+import shutil
+
+temp_root = os.path.abspath('./temp_artifacts')
+
+class ArtifactsTestCase(unittest.TestCase):
+    """ 'bru make' works on ./bru_modules and ./out, so these tests run in a
+        temp dir """
+
+    def setUp(self):
+        if os.path.exists(temp_root):
+            shutil.rmtree(temp_root)
+        os.makedirs(temp_root)
+        self.cwd = os.getcwd()
+        os.chdir(temp_root)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(temp_root)
+
+    def install_module(self, module, deps):
+        """ adds version 1.0 of the module to ./library and a gyp with a
+            static_library target to ./bru_modules, like 'bru install' """
+        formula = {'module': module, 'version': '1.0',
+                   'dependencies': dict((dep, '1.0') for dep in deps)}
+        brulib.jsonc.savefile(os.path.join('library', module, '1.0.bru'),
+                              formula)
+        module_dir = os.path.join('bru_modules', module)
+        brulib.jsonc.savefile(os.path.join(module_dir, module + '.gyp'), {
+            'targets': [{
+                'target_name': module,
+                'type': 'static_library',
+                'sources': ['1.0/{}.c'.format(module)],
+                'dependencies': ['../{0}/{0}.gyp:*'.format(dep) for dep in deps]
+            }]
+        })
+        brulib.jsonc.savefile(os.path.join(module_dir, 'bru-version.json'),
+                              {'version': '1.0'})
+
+    def build(self, module, content):
+        """ stands in for make, which would build the module's lib """
+        lib = os.path.join('out', 'Debug', 'obj.target', 'bru_modules', module,
+                           'lib{}.a'.format(module))
+        if not os.path.exists(os.path.dirname(lib)):
+            os.makedirs(os.path.dirname(lib))
+        with open(lib, 'w') as file:
+            file.write(content)
+
+    def test_filesystem_artifact_store(self):
+        store = brulib.artifacts.FilesystemArtifactStore('artifacts')
+        self.assertEqual(store.get('abcd', 'dest'), None)
+        with open('libfoo.a', 'w') as file:
+            file.write('foo')
+        store.put('abcd', ['libfoo.a'], {'module': 'foo'})
+        self.assertEqual(store.get('abcd', 'dest'),
+                         [os.path.join('dest', 'libfoo.a')])
+        with open(os.path.join('dest', 'libfoo.a')) as file:
+            self.assertEqual(file.read(), 'foo')
+
+    def test_artifact_cache(self):
+        self.install_module('bar', [])
+        self.install_module('foo', ['bar'])
+        gyp_file = os.path.join('bru_modules', 'foo', 'foo.gyp')
+        pristine_gyp = brulib.jsonc.loadfile(gyp_file)
+        library = brulib.library.Library('./library')
+        store = brulib.artifacts.FilesystemArtifactStore('artifacts')
+        def make(config = 'Debug'):
+            artifacts = brulib.artifacts.ArtifactCache(library, store, config)
+            artifacts.use_prebuilt_libs()
+            return artifacts
+
+        # the first build stores the libs:
+        artifacts = make()
+        self.build('foo', 'foo')
+        self.build('bar', 'bar')
+        self.assertEqual(artifacts.store_built_libs(), 2)
+        shutil.rmtree('out')
+
+        # the next build links these instead of compiling the sources:
+        artifacts = make()
+        gyp = brulib.jsonc.loadfile(gyp_file)
+        target = gyp['targets'][0]
+        self.assertEqual(target['type'], 'none')
+        assert not 'sources' in target
+        prebuilt_lib = target['link_settings']['libraries'][0]
+        self.assertEqual(prebuilt_lib, os.path.abspath(os.path.join(
+            'bru_modules', 'foo', 'prebuilt', 'Debug', 'libfoo.a')))
+        with open(prebuilt_lib) as file:
+            self.assertEqual(file.read(), 'foo')
+        self.assertEqual(artifacts.store_built_libs(), 0)
+        make()
+        self.assertEqual(brulib.jsonc.loadfile(gyp_file), gyp)
+
+        # other configs or changed deps are built from source again:
+        make('Release')
+        self.assertEqual(brulib.jsonc.loadfile(gyp_file), pristine_gyp)
+        make()
+        self.install_module('bar', ['baz'])
+        self.install_module('baz', [])
+        make()
+        self.assertEqual(brulib.jsonc.loadfile(gyp_file), pristine_gyp)
+
+if __name__ == '__main__':
+    unittest.main()
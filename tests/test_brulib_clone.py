@@ -2,6 +2,9 @@ import unittest
 import brulib.clone
 import os
 import shutil
+import subprocess
+import threading
+import time
 
 temp_root = './temp_clone'
 
@@ -27,3 +30,83 @@ class LibraryTestCase(unittest.TestCase):
         repo_url_with_prefix = "svn+http://tiny-js.googlecode.com/svn/trunk@81"
         brulib.clone.atomic_clone_repo(repo_url_with_prefix, temp_root)
         assert os.path.exists(os.path.join(temp_root, 'clone', 'readme.md'))
+
+    def create_upstream_repo(self):
+        """ a local 'upstream' repo, so tests don't need network access.
+            Returns the repo dir and a func that commits a new readme.md to
+            the repo, returning the commit hash.
+        """
+        self.tearDownClass() # starts from an empty temp_root
+        upstream = os.path.abspath(os.path.join(temp_root, 'upstream'))
+        os.makedirs(upstream)
+        def git(*args):
+            subprocess.check_call(('git', '-c', 'user.name=test',
+                                   '-c', 'user.email=test@example.com') + args,
+                                  cwd = upstream)
+        def commit(text):
+            with open(os.path.join(upstream, 'readme.md'), 'w') as file:
+                file.write(text)
+            git('add', 'readme.md')
+            git('commit', '-q', '-m', text)
+            return subprocess.check_output(['git', 'rev-parse', 'HEAD'],
+                                           cwd = upstream).decode('ascii').strip()
+        git('init', '-q', '-b', 'main')
+        return (upstream, commit)
+
+    def assert_readme(self, module_dir, text):
+        with open(os.path.join(module_dir, 'clone', 'readme.md')) as file:
+            self.assertEqual(file.read(), text)
+
+    def test_atomic_clone_repo_git_mirror(self):
+        (upstream, commit) = self.create_upstream_repo()
+        changesets = [commit('v1'), commit('v2')]
+        mirror_root = os.path.join(temp_root, 'mirrors')
+        repo_url = 'git+file://' + upstream
+        mirror_dir = brulib.clone.get_mirror_dir(mirror_root, 'file://' + upstream)
+        def clone(i, changeset, expected_readme):
+            module_dir = os.path.join(temp_root, 'modules', str(i))
+            brulib.clone.atomic_clone_repo(
+                repo_url if changeset == None else repo_url + '@' + changeset,
+                module_dir, mirror_root)
+            self.assert_readme(module_dir, expected_readme)
+
+        # a commit pinned by its full hash creates a shallow mirror:
+        clone(0, changesets[0], 'v1')
+        self.assertEqual(os.listdir(mirror_root), [os.path.basename(mirror_dir)])
+        assert brulib.clone.is_shallow_repo(mirror_dir)
+
+        # a branch needs the whole history, which is fetched into the mirror
+        # without deleting the ref of the commit fetched alone:
+        clone(1, 'main', 'v2')
+        assert not brulib.clone.is_shallow_repo(mirror_dir)
+        clone(2, None, 'v2')
+        subprocess.check_call(['git', 'show-ref', '--verify', '--quiet',
+                               'refs/bru/' + changesets[0]], cwd = mirror_dir)
+
+        # a commit not in the mirror yet is fetched into the mirror, and
+        # abbreviated commit hashes are found there:
+        changeset = commit('v3')
+        clone(3, changeset, 'v3')
+        assert not brulib.clone.is_shallow_repo(mirror_dir)
+        clone(4, changeset[:10], 'v3')
+
+    def test_mirror_lock(self):
+        self.tearDownClass()
+        mirror_dir = os.path.join(temp_root, 'mirrors', 'foo.git')
+        lock_file = mirror_dir + '.lock'
+        # a lock file of a running process is waited for until that process
+        # exits without removing it (as if killed), then it's stale:
+        owner = subprocess.Popen(['sleep', '1'])
+        os.makedirs(os.path.dirname(lock_file))
+        with open(lock_file, 'w') as file:
+            file.write(str(owner.pid))
+        # reaps the owner, so that its pid doesn't linger as a zombie:
+        reaper = threading.Thread(target = owner.wait)
+        reaper.start()
+        start_time = time.time()
+        with brulib.clone.MirrorLock(mirror_dir):
+            assert time.time() - start_time > 0.5
+            with open(lock_file) as file:
+                self.assertEqual(file.read(), str(os.getpid()))
+        reaper.join()
+        assert not os.path.exists(lock_file)
@@ -0,0 +1,63 @@
+import unittest
+import brulib.compilercache
+import os
+import shutil
+import stat
+
+temp_root = os.path.abspath('./temp_compilercache')
+
+class CompilerCacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        if os.path.exists(temp_root):
+            shutil.rmtree(temp_root)
+        os.makedirs(temp_root)
+
+    def tearDown(self):
+        shutil.rmtree(temp_root)
+
+    def test_get_compiler_env(self):
+        self.assertEqual(brulib.compilercache.get_compiler_env('ccache', {}), {
+            'CC': 'ccache cc', 'CXX': 'ccache c++',
+            'LINK': 'c++', 'LD': 'c++'})
+        self.assertEqual(brulib.compilercache.get_compiler_env('sccache', {
+                'CC': 'clang', 'CXX': '/usr/bin/sccache clang++'}), {
+            'CC': 'sccache clang', 'CXX': '/usr/bin/sccache clang++',
+            'LINK': 'clang++', 'LD': 'clang++'})
+
+    def test_parse_stats(self):
+        self.assertEqual(brulib.compilercache.parse_ccache_stats(
+            'stats_updated_timestamp\t1700000000\n'
+            'direct_cache_hit\t5\n'
+            'preprocessed_cache_hit\t2\n'
+            'cache_miss\t3\n'), (7, 3))
+        self.assertEqual(brulib.compilercache.parse_sccache_stats(
+            '{"stats": {"cache_hits": {"counts": {"C/C++": 4, "Rust": 1}},'
+            ' "cache_misses": {"counts": {"C/C++": 2}}}}'), (5, 2))
+
+    def test_compiler_cache_env(self):
+        # a fake ccache, counting a hit per call of --print-stats:
+        fake_ccache = os.path.join(temp_root, 'ccache')
+        with open(fake_ccache, 'w') as file:
+            file.write('#!/bin/sh\n'
+                       'echo x >> {0}/calls\n'
+                       'printf "direct_cache_hit\\t$(wc -l < {0}/calls)\\n"\n'
+                       'printf "cache_miss\\t1\\n"\n'.format(temp_root))
+        os.chmod(fake_ccache, os.stat(fake_ccache).st_mode | stat.S_IEXEC)
+        saved_path = os.environ['PATH']
+        saved_cc = os.environ.pop('CC', None)
+        os.environ['PATH'] = temp_root + os.pathsep + saved_path
+        try:
+            with brulib.compilercache.CompilerCacheEnv('auto') as env:
+                self.assertEqual(env.compiler_cache, 'ccache')
+                self.assertEqual(os.environ['CC'], 'ccache cc')
+                self.assertEqual(env.stats_before, (1, 1))
+            assert not 'CC' in os.environ
+            self.assertEqual(brulib.compilercache.get_stats('ccache'), (3, 1))
+        finally:
+            os.environ['PATH'] = saved_path
+            if saved_cc != None:
+                os.environ['CC'] = saved_cc
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,42 @@
+import unittest
+import brulib.globcache
+import os
+import shutil
+import time
+
+temp_root = './temp_globcache'
+
+def touch(filename):
+    with open(filename, 'a'):
+        pass
+
+class GlobCacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        if os.path.exists(temp_root):
+            shutil.rmtree(temp_root)
+        os.makedirs(os.path.join(temp_root, '1.0', 'src'))
+
+    def tearDown(self):
+        shutil.rmtree(temp_root)
+
+    def test_glob_cache(self):
+        module_dir = os.path.join(temp_root, '1.0')
+        touch(os.path.join(module_dir, 'src', 'a.c'))
+        touch(os.path.join(module_dir, 'foo.tar.gz.unpack_done'))
+        glob_cache = brulib.globcache.GlobCache(temp_root, '1.0')
+        self.assertEqual(glob_cache.glob('1.0/src/*.c'), ['1.0/src/a.c'])
+        glob_cache.save()
+
+        # expansions are reused as long as nothing was unpacked again:
+        touch(os.path.join(module_dir, 'src', 'b.c'))
+        glob_cache = brulib.globcache.GlobCache(temp_root, '1.0')
+        self.assertEqual(glob_cache.glob('1.0/src/*.c'), ['1.0/src/a.c'])
+
+        # but not after unpacking again:
+        time.sleep(0.01)
+        os.remove(os.path.join(module_dir, 'foo.tar.gz.unpack_done'))
+        touch(os.path.join(module_dir, 'foo.tar.gz.unpack_done'))
+        glob_cache = brulib.globcache.GlobCache(temp_root, '1.0')
+        self.assertEqual(sorted(glob_cache.glob('1.0/src/*.c')),
+                         ['1.0/src/a.c', '1.0/src/b.c'])
@@ -0,0 +1,50 @@
+import unittest
+import collections
+import brulib.graph
+
+class GraphTestCase(unittest.TestCase):
+
+    def get_graph(self):
+        # a -> b -> c -> b is a cycle, d -> d is a self loop
+        return collections.OrderedDict([
+            ('a', ['b', 'd']),
+            ('b', ['c']),
+            ('c', ['b', 'e']),
+            ('d', ['d']),
+        ])
+
+    def test_strongly_connected_components(self):
+        sccs = brulib.graph.strongly_connected_components(self.get_graph())
+        self.assertEqual(sccs, [['e'], ['b', 'c'], ['d'], ['a']])
+        self.assertEqual(brulib.graph.find_cycles(self.get_graph()),
+                         [['b', 'c']])
+
+    def test_condensation(self):
+        (components, component_arcs) = brulib.graph.condensation(
+            self.get_graph())
+        self.assertEqual(components, [['e'], ['b', 'c'], ['d'], ['a']])
+        self.assertEqual(component_arcs, [[], [0], [], [1, 2]])
+
+    def test_topological_order(self):
+        graph = collections.OrderedDict([
+            ('a', ['b', 'c']),
+            ('b', ['c']),
+            ('d', []),
+        ])
+        self.assertEqual(brulib.graph.topological_order(graph),
+                         ['d', 'a', 'b', 'c'])
+        with self.assertRaises(brulib.graph.CycleError) as context:
+            brulib.graph.topological_order(self.get_graph())
+        self.assertEqual(context.exception.cycle, ['d'])
+
+    def test_long_chain(self):
+        # deeper than Python's recursion limit
+        node_count = 100000
+        graph = dict((node, [node + 1]) for node in range(node_count))
+        graph[node_count] = [0]
+        sccs = brulib.graph.strongly_connected_components(graph)
+        self.assertEqual(len(sccs), 1)
+        self.assertEqual(len(sccs[0]), node_count + 1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,98 @@
+import unittest
+import brulib.includescan
+import os
+import shutil
+
+temp_root = './temp_includescan'
+
+class IncludeScanTestCase(unittest.TestCase):
+
+    def setUp(self):
+        if os.path.exists(temp_root):
+            shutil.rmtree(temp_root)
+        os.makedirs(temp_root)
+
+    def tearDown(self):
+        shutil.rmtree(temp_root)
+
+    def test_get_includes_from_buffer(self):
+        cpp = b'''#include <first.h>
+  #  include "foo/bar.h"
+// #include <line_comment.h>
+/* #include <block_comment.h> **
+   #include <block_comment2.h> */
+const char* s = "#include <string.h>";
+#include_next <next.h>
+#include \\
+   <continued.h>
+// comment \\
+#include <continued_comment.h>
+#if 0 // it's
+#include <ifdefed_out.h> // don't care about the preprocessor
+#endif
+char c = '"';
+#include MACRO
+/* unterminated #include <unterminated.h>'''
+        self.assertEqual(brulib.includescan.get_includes_from_buffer(cpp),
+            ['first.h', 'foo/bar.h', 'next.h', 'continued.h', 'ifdefed_out.h'])
+        self.assertEqual(brulib.includescan.get_includes_from_buffer(b''), [])
+        # the last #include continued on the next line:
+        self.assertEqual(brulib.includescan.get_includes_from_buffer(
+            b'#include \\\n <h.h>\n'), ['h.h'])
+        self.assertEqual(brulib.includescan.get_includes_from_buffer(
+            b'int i;\r\n#include \\\r\n <h.h>'), ['h.h'])
+        # an #include in the first line after a UTF-8 byte order mark:
+        self.assertEqual(brulib.includescan.get_includes_from_buffer(
+            b'\xef\xbb\xbf#include <bom.h>\n'), ['bom.h'])
+
+    def test_scanner(self):
+        filenames = []
+        for i in range(100):
+            filename = os.path.join(temp_root, 'file{}.h'.format(i))
+            with open(filename, 'w') as file:
+                file.write('#pragma once\n#include "file{}.h"\n'.format(i + 1))
+            filenames.append(filename)
+        empty_file = os.path.join(temp_root, 'empty.h')
+        open(empty_file, 'w').close()
+        filenames.append(empty_file)
+        missing_file = os.path.join(temp_root, 'missing.h')
+        filenames.append(missing_file)
+
+        # with enough files to use the pool of processes:
+        with brulib.includescan.IncludeScanner(jobs = 2) as scanner:
+            includes = scanner.scan(filenames)
+        self.assertEqual(len(includes), len(filenames))
+        self.assertEqual(includes[filenames[3]], ['file4.h'])
+        self.assertEqual(includes[empty_file], [])
+        self.assertEqual(includes[missing_file], [])
+
+    def test_include_cache(self):
+        header = os.path.join(temp_root, 'foo.h')
+        with open(header, 'w') as file:
+            file.write('#include "bar.h"\n')
+        cache_file = os.path.join(temp_root, 'cache', 'include-cache.json')
+        cache = brulib.includescan.IncludeCache(cache_file)
+        with brulib.includescan.IncludeScanner(1, cache) as scanner:
+            self.assertEqual(scanner.scan([header]), {header: ['bar.h']})
+        assert os.path.exists(cache_file)
+
+        # a file with the same size & mtime is not read again, even if its
+        # content changed (which is not supposed to happen):
+        stat = os.stat(header)
+        with open(header, 'w') as file:
+            file.write('#include "baz.h"\n')
+        os.utime(header, ns = (stat.st_atime_ns, stat.st_mtime_ns))
+        cache = brulib.includescan.IncludeCache(cache_file)
+        self.assertEqual(cache.get(header), ['bar.h'])
+
+        # whereas files with a different size or mtime are scanned again:
+        with open(header, 'w') as file:
+            file.write('#include "bazz.h"\n')
+        self.assertEqual(cache.get(header), None)
+        with brulib.includescan.IncludeScanner(1, cache) as scanner:
+            self.assertEqual(scanner.scan([header]), {header: ['bazz.h']})
+        self.assertEqual(brulib.includescan.IncludeCache(cache_file).get(header),
+                         ['bazz.h'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,6 +1,7 @@
 import unittest
 import brulib.jsonc
 import os
+import threading
 
 class JsoncTestCase(unittest.TestCase):
 
@@ -25,4 +26,32 @@ class JsoncTestCase(unittest.TestCase):
         brulib.jsonc.savefile(filename, jso)
         dic = brulib.jsonc.loadfile(filename)
         self.assertEqual(dic, jso)
-        os.remove(filename)
\ No newline at end of file
+        os.remove(filename)
+        self.assertEqual([file for file in os.listdir('.')
+                          if file.startswith(filename)], [])
+
+    def test_savefile_is_atomic(self):
+        filename = 'test.tmp'
+        brulib.jsonc.savefile(filename, {'foo': 'bar'})
+        jsos = [{'foo': 'x' * 10000}, {'foo': 'bar'}]
+        def save():
+            for i in range(200):
+                brulib.jsonc.savefile(filename, jsos[i % 2])
+        thread = threading.Thread(target = save)
+        thread.start()
+        try:
+            # a reader never sees a half-written file:
+            while thread.is_alive():
+                assert brulib.jsonc.loadfile(filename) in jsos
+        finally:
+            thread.join()
+            os.remove(filename)
+
+    def test_savefile_if_changed(self):
+        filename = 'test.tmp'
+        jso = {'foo': 'bar'}
+        self.assertTrue(brulib.jsonc.savefile_if_changed(filename, jso))
+        self.assertFalse(brulib.jsonc.savefile_if_changed(filename, jso))
+        self.assertTrue(brulib.jsonc.savefile_if_changed(filename, {'foo': 'baz'}))
+        self.assertEqual(brulib.jsonc.loadfile(filename), {'foo': 'baz'})
+        os.remove(filename)
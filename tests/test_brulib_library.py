@@ -1,5 +1,6 @@
 import unittest
 import brulib.library
+import copy
 import os
 import shutil
 
@@ -67,5 +68,48 @@ class LibraryTestCase(unittest.TestCase):
     def test_ModuleVersion(self):
         ModuleVersion = brulib.library.ModuleVersion
         assert ModuleVersion('0.1') < ModuleVersion('0.2')
-        #? assert ModuleVersion('0.1') == ModuleVersion('0.1')
-        assert ModuleVersion('0.2') > ModuleVersion('0.1')
\ No newline at end of file
+        assert ModuleVersion('0.1') == ModuleVersion('0.1')
+        assert not ModuleVersion('0.1') > ModuleVersion('0.1')
+        assert ModuleVersion('0.2') > ModuleVersion('0.1')
+
+    def test_load_formula_cache(self):
+        lib = brulib.library.Library(temp_root, cache_size=1)
+        lib.save_formula({'module': 'bar', 'version': '1.0'})
+        lib.save_formula({'module': 'bar', 'version': '2.0'})
+
+        # repeated loads share the memoized formula, which callers only
+        # modify copies of:
+        formula = lib.load_formula('bar', '1.0')
+        assert lib.load_formula('bar', '1.0') is formula
+        formula = copy.deepcopy(formula)
+        formula['dependencies'] = {'foo': '0.1'}
+        self.assertEqual(lib.load_formula('bar', '1.0'),
+            {'module': 'bar', 'version': '1.0'})
+
+        # saving a formula must not leave a stale copy in the cache:
+        lib.save_formula(formula)
+        self.assertEqual(lib.load_formula('bar', '1.0'), formula)
+
+        # evicts the other cache entry, which should be transparent:
+        self.assertEqual(lib.load_formula('bar', '2.0'),
+            {'module': 'bar', 'version': '2.0'})
+        self.assertEqual(lib.load_formula('bar', '1.0'), formula)
+        self.assertEqual(len(lib._cache), 1)
+
+    def test_index(self):
+        lib = brulib.library.Library(temp_root)
+        lib.save_formula({'module': 'baz', 'version': '1.0',
+                          'url': 'http://example.com/baz-1.0.tar.gz'})
+        self.assertEqual(lib.get_latest_version_of('baz'), '1.0')
+        assert os.path.exists(lib.get_index_file_name())
+        assert 'baz' in lib.get_all_modules()
+        self.assertEqual(list(lib.get_all_versions('nonexisting')), [])
+
+        # a formula added by someone else (e.g. via 'git pull') must be
+        # picked up by a Library instance that loaded the index alrdy:
+        brulib.jsonc.savefile(lib.get_file_name('baz', '1.1', '.bru'),
+                              {'module': 'baz', 'version': '1.1'})
+        self.assertEqual(lib.get_latest_version_of('baz'), '1.1')
+        index = brulib.jsonc.loadfile(lib.get_index_file_name())
+        self.assertEqual(index['modules']['baz'][0]['url'],
+                         'http://example.com/baz-1.0.tar.gz')
@@ -0,0 +1,74 @@
+import unittest
+import brulib.install
+import brulib.library
+import brulib.lockfile
+import os
+import shutil
+
+temp_root = './temp_lockfile'
+
+class LockfileTestCase(unittest.TestCase):
+
+    def setUp(self):
+        if os.path.exists(temp_root):
+            shutil.rmtree(temp_root)
+        os.makedirs(temp_root)
+
+    def tearDown(self):
+        shutil.rmtree(temp_root)
+
+    def test_save_load_lockfile(self):
+        library = brulib.library.Library('./library')
+        lock_filename = os.path.join(temp_root, 'package.bru.lock')
+        deps = {'boost-assert': '1.57.0'}
+        self.assertEqual(
+            brulib.lockfile.load_lockfile(lock_filename, library, deps), None)
+
+        recursive_deps = brulib.install.resolve_conflicts(library, deps,
+                                                          'package.bru')
+        brulib.lockfile.save_lockfile(lock_filename, library, deps,
+                                      recursive_deps)
+        self.assertEqual(
+            brulib.lockfile.load_lockfile(lock_filename, library, deps),
+            recursive_deps)
+
+        # changed *.bru dependencies invalidate the lockfile:
+        self.assertEqual(
+            brulib.lockfile.load_lockfile(lock_filename, library,
+                                          {'boost-assert': '1.57.*'}),
+            None)
+
+    def test_changed_formula_invalidates_lockfile(self):
+        library = brulib.library.Library(temp_root)
+        library.save_formula({'module': 'foo', 'version': '1.0'})
+        lock_filename = os.path.join(temp_root, 'package.bru.lock')
+        deps = {'foo': '1.0'}
+        recursive_deps = [('foo', '1.0', 'package.bru')]
+        brulib.lockfile.save_lockfile(lock_filename, library, deps,
+                                      recursive_deps)
+        self.assertEqual(
+            brulib.lockfile.load_lockfile(lock_filename, library, deps),
+            recursive_deps)
+
+        library.save_formula({'module': 'foo', 'version': '1.0',
+                              'dependencies': {'bar': '1.0'}})
+        self.assertEqual(
+            brulib.lockfile.load_lockfile(lock_filename, library, deps), None)
+
+    def test_lockfile_is_independent_of_project_dir(self):
+        library = brulib.library.Library(temp_root)
+        library.save_formula({'module': 'foo', 'version': '1.0'})
+        lock_filename = os.path.join(temp_root, 'package.bru.lock')
+        deps = {'foo': '1.0'}
+        bru_filename = os.path.abspath(os.path.join(temp_root, 'package.bru'))
+        brulib.lockfile.save_lockfile(lock_filename, library, deps,
+                                      [('foo', '1.0', bru_filename)])
+        self.assertEqual(
+            brulib.lockfile.load_lockfile(lock_filename, library, deps),
+            [('foo', '1.0', 'package.bru')])
+
+        # saving the same lock again leaves the file untouched:
+        os.utime(lock_filename, (0, 0))
+        brulib.lockfile.save_lockfile(lock_filename, library, deps,
+                                      [('foo', '1.0', 'package.bru')])
+        self.assertEqual(os.path.getmtime(lock_filename), 0)
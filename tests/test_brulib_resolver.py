@@ -0,0 +1,73 @@
+import unittest
+import brulib.library
+import brulib.resolver
+import os
+import shutil
+
+temp_root = './temp_resolver'
+
+class ResolverTestCase(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        if os.path.exists(temp_root):
+            shutil.rmtree(temp_root)
+        cls.library = brulib.library.Library(temp_root)
+        def save(module, version, dependencies={}):
+            cls.library.save_formula({
+                'module': module,
+                'version': version,
+                'dependencies': dependencies})
+        save('x', '1.0', {'z': '1.*'})
+        save('x', '2.0', {'z': '2.*'})
+        save('y', '1.0', {'z': '1.0'})
+        save('z', '1.0')
+        save('z', '1.1')
+        save('z', '2.0')
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(temp_root)
+
+    def test_version_spec(self):
+        VersionSpec = brulib.resolver.VersionSpec
+        assert VersionSpec('1.57.0').matches('1.57.0')
+        assert not VersionSpec('1.57.0').matches('1.57.1')
+        assert VersionSpec('1.57.*').matches('1.57.1')
+        assert not VersionSpec('1.57.*').matches('1.58.0')
+        assert VersionSpec('*').matches('0.1alpha')
+        assert VersionSpec('>=1.2').matches('1.10')
+        assert not VersionSpec('>1.2').matches('1.2')
+        assert VersionSpec('>=1.2 <2.0').matches('1.9')
+        assert not VersionSpec('>=1.2 <2.0').matches('2.0')
+        assert VersionSpec('=1.0.1j').matches('1.0.1j')
+
+    def test_resolve_picks_newest(self):
+        resolver = brulib.resolver.Resolver(self.library)
+        self.assertEqual(
+            resolver.resolve({'x': '*'}, 'test.bru'),
+            [('x', '2.0', 'test.bru'), ('z', '2.0', 'x')])
+
+    def test_resolve_backtracks(self):
+        # the newest x wants z 2.*, which conflicts with what y wants
+        resolver = brulib.resolver.Resolver(self.library)
+        self.assertEqual(
+            resolver.resolve({'x': '*', 'y': '1.0'}, 'test.bru'),
+            [('x', '1.0', 'test.bru'), ('y', '1.0', 'test.bru'),
+             ('z', '1.0', 'x')])
+
+    def test_resolve_conflict(self):
+        resolver = brulib.resolver.Resolver(self.library)
+        self.assertRaises(Exception,
+            lambda: resolver.resolve({'x': '2.0', 'y': '1.0'}, 'test.bru'))
+        self.assertRaises(Exception,
+            lambda: resolver.resolve({'nonexisting': '1.0'}, 'test.bru'))
+
+    def test_resolve_twice(self):
+        # failures memoized by the first resolve() mustn't affect the second
+        resolver = brulib.resolver.Resolver(self.library)
+        self.assertRaises(Exception,
+            lambda: resolver.resolve({'x': '2.0', 'y': '1.0'}, 'test.bru'))
+        self.assertEqual(
+            resolver.resolve({'x': '*'}, 'test.bru'),
+            [('x', '2.0', 'test.bru'), ('z', '2.0', 'x')])
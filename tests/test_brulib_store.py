@@ -0,0 +1,63 @@
+import unittest
+import brulib.store
+import brulib.untar
+import os
+import shutil
+
+temp_root = './temp_store'
+
+class StoreTestCase(unittest.TestCase):
+
+    def setUp(self):
+        if os.path.exists(temp_root):
+            shutil.rmtree(temp_root)
+        os.makedirs(temp_root)
+
+    def tearDown(self):
+        shutil.rmtree(temp_root)
+
+    def test_add_find_materialize_gc(self):
+        store = brulib.store.DownloadStore(os.path.join(temp_root, 'store'))
+        download = os.path.join(temp_root, 'foo-1.0.tar.gz.tmp')
+        with open(download, 'wb') as file:
+            file.write(b'not really a tar.gz')
+        digests = brulib.untar.hash_file(download)
+        url = 'http://example.com/foo-1.0.tar.gz'
+        self.assertEqual(store.find(url), None)
+
+        sha256 = store.add(download, digests, url)
+        assert not os.path.exists(download)
+        self.assertEqual(store.find(url), sha256)
+        self.assertEqual(store.find('http://mirror/foo.tar.gz',
+                                    {'md5': digests['md5']}), sha256)
+        self.assertEqual(store.find(url, {'md5': '0' * 32}), None)
+        self.assertEqual(
+            os.path.basename(store.get_object_file(sha256)), 'foo-1.0.tar.gz')
+
+        # the same content is only stored once, no matter how often it's used:
+        links = [os.path.join(temp_root, 'a', 'foo.tar.gz'),
+                 os.path.join(temp_root, 'b', 'foo.tar.gz')]
+        for link in links:
+            store.materialize(sha256, link)
+            with open(link, 'rb') as file:
+                self.assertEqual(file.read(), b'not really a tar.gz')
+        stats = store.stats()
+        self.assertEqual(stats['objects'], 1)
+        self.assertEqual(stats['links'], 2)
+
+        self.assertEqual(store.gc(1024 * 1024), 0)
+        # gc removes links & copies of the object, but leaves alone other
+        # files replacing a link in the meantime, even of the same size:
+        os.remove(links[1])
+        with open(links[1], 'wb') as file:
+            file.write(b'not really a tar.gx')
+        copy = os.path.join(temp_root, 'c', 'foo.tar.gz')
+        store.materialize(sha256, copy)
+        os.remove(copy)
+        shutil.copy(store.get_object_file(sha256), copy)
+        self.assertEqual(store.gc(0), 1)
+        self.assertEqual(store.find(url), None)
+        assert not os.path.exists(links[0])
+        assert not os.path.exists(copy)
+        with open(links[1], 'rb') as file:
+            self.assertEqual(file.read(), b'not really a tar.gx')
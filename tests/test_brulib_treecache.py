@@ -0,0 +1,107 @@
+import unittest
+import brulib.treecache
+import brulib.untar
+import os
+import stat
+import tarfile
+
+temp_root = './temp_treecache'
+
+class TreeCacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        if os.path.exists(temp_root):
+            brulib.treecache.rmtree(temp_root)
+        os.makedirs(temp_root)
+
+    def tearDown(self):
+        brulib.treecache.rmtree(temp_root)
+
+    def create_tar_gz(self):
+        src_dir = os.path.join(temp_root, 'src', 'foo-1.0')
+        os.makedirs(os.path.join(src_dir, 'include'))
+        with open(os.path.join(src_dir, 'include', 'foo.h'), 'w') as file:
+            file.write('int foo();\n')
+        tar_gz = os.path.join(temp_root, 'foo-1.0.tar.gz')
+        with tarfile.open(tar_gz, 'w:gz') as tar:
+            tar.add(src_dir, arcname='foo-1.0')
+        return tar_gz
+
+    def read_foo_h(self, dir):
+        with open(os.path.join(dir, 'foo-1.0', 'include', 'foo.h')) as file:
+            return file.read()
+
+    def write_foo_h(self, dir, text):
+        path = os.path.join(dir, 'foo-1.0', 'include', 'foo.h')
+        os.chmod(path, stat.S_IREAD | stat.S_IWRITE)
+        with open(path, 'w') as file:
+            file.write(text)
+
+    def test_unpack_copies_cached_tree(self):
+        tar_gz = self.create_tar_gz()
+        archives = [(tar_gz, brulib.untar.hash_file(tar_gz)['sha256'], None)]
+        cache = brulib.treecache.TreeCache(os.path.join(temp_root, 'trees'))
+        module_dirs = [os.path.join(temp_root, project, 'bru_modules', 'foo', '1.0')
+                       for project in ['a', 'b']]
+        for module_dir in module_dirs:
+            cache.unpack(archives, module_dir)
+            assert os.path.exists(os.path.join(module_dir,
+                                               'foo-1.0.tar.gz.unpack_done'))
+            with open(os.path.join(module_dir, 'foo-1.0', 'include', 'foo.h')) as file:
+                self.assertEqual(file.read(), 'int foo();\n')
+
+        # the archive was unpacked only once, into the cache:
+        trees = list(cache.get_trees())
+        self.assertEqual(len(trees), 1)
+        self.assertEqual(os.path.basename(trees[0][0]), cache.get_key(archives))
+
+        # evicting the tree leaves the projects' files intact:
+        self.assertEqual(cache.gc(0), 1)
+        self.assertEqual(list(cache.get_trees()), [])
+        assert os.path.exists(os.path.join(module_dirs[1], 'foo-1.0',
+                                           'include', 'foo.h'))
+
+    def test_edited_copy_leaves_cache_unchanged(self):
+        tar_gz = self.create_tar_gz()
+        archives = [(tar_gz, brulib.untar.hash_file(tar_gz)['sha256'], None)]
+        cache = brulib.treecache.TreeCache(os.path.join(temp_root, 'trees'))
+        module_dir = os.path.join(temp_root, 'a', 'bru_modules', 'foo', '1.0')
+        cache.unpack(archives, module_dir)
+        tree_dir = cache.get_tree_dir(cache.get_key(archives))
+        # copies are writable, the cached tree isn't:
+        with open(os.path.join(module_dir, 'foo-1.0', 'include', 'foo.h'),
+                  'a') as file:
+            file.write('int bar();\n')
+        self.assertEqual(self.read_foo_h(tree_dir), 'int foo();\n')
+        self.assertEqual(os.stat(os.path.join(tree_dir, 'foo-1.0', 'include',
+                                              'foo.h')).st_mode & stat.S_IWUSR, 0)
+        assert cache.is_intact(tree_dir)
+
+    def test_modified_linked_tree_is_unpacked_again(self):
+        tar_gz = self.create_tar_gz()
+        archives = [(tar_gz, brulib.untar.hash_file(tar_gz)['sha256'], None)]
+        cache = brulib.treecache.TreeCache(os.path.join(temp_root, 'trees'))
+        module_dirs = [os.path.join(temp_root, project, 'bru_modules', 'foo', '1.0')
+                       for project in ['a', 'b']]
+        cache.unpack(archives, module_dirs[0], link = True)
+        tree_dir = cache.get_tree_dir(cache.get_key(archives))
+        assert os.path.exists(os.path.join(module_dirs[0],
+                                           brulib.treecache.LINKED_MARKER))
+
+        # a user forcing an edit of a linked file modifies the cached tree,
+        # which is detected before the tree is linked into other projects:
+        self.write_foo_h(module_dirs[0], 'int foo(int);\n')
+        assert not cache.is_intact(tree_dir)
+        cache.unpack(archives, module_dirs[1], link = True)
+        self.assertEqual(self.read_foo_h(module_dirs[1]), 'int foo();\n')
+        self.assertEqual(self.read_foo_h(tree_dir), 'int foo();\n')
+        assert cache.is_intact(tree_dir)
+
+        # unlinking leaves the cached tree alone:
+        assert brulib.treecache.unlink_tree(module_dirs[1])
+        assert not os.path.exists(module_dirs[1])
+        assert not brulib.treecache.unlink_tree(module_dirs[1])
+        assert cache.is_intact(tree_dir)
+
+if __name__ == '__main__':
+    unittest.main()
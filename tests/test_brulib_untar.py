@@ -1,7 +1,12 @@
 import unittest
 import brulib.untar
+import brulib.util
+import hashlib
+import io
 import os
 import shutil
+import stat
+import tarfile
 
 temp_root = './temp_untar'
 
@@ -31,3 +36,148 @@ class LibraryTestCase(unittest.TestCase):
         
         # a repeated call shouldnt do anything (how to assert that?):
         brulib.untar.wget_and_untar_once(zip_url, tar_dir, module_dir)
+
+    def test_wget_verifies_digests(self):
+        # a local file url so that this test doesn't need network access
+        src_file = os.path.join(temp_root, 'src.txt')
+        brulib.util.mkdir_p(temp_root)
+        with open(src_file, 'wb') as file:
+            file.write(b'hello bru\n')
+        url = 'file://' + os.path.abspath(src_file)
+        md5 = hashlib.md5(b'hello bru\n').hexdigest()
+
+        dst_file = os.path.join(temp_root, 'dst.txt')
+        digests = brulib.untar.wget(url, dst_file, {'md5': md5})
+        self.assertEqual(digests['md5'], md5)
+        self.assertEqual(digests['sha256'],
+                         hashlib.sha256(b'hello bru\n').hexdigest())
+
+        # an existing partial download is restarted if the url doesn't
+        # support range requests:
+        with open(dst_file, 'wb') as file:
+            file.write(b'garbage')
+        brulib.untar.wget(url, dst_file, {'md5': md5})
+        with open(dst_file, 'rb') as file:
+            self.assertEqual(file.read(), b'hello bru\n')
+
+        self.assertRaises(brulib.untar.DigestMismatch,
+            lambda: brulib.untar.wget(url, dst_file, {'md5': '0' * 32}))
+        assert not os.path.exists(dst_file)
+
+    def test_wget_restarts_unsatisfiable_range(self):
+        content = b'hello bru\n'
+        requests = []
+        def fake_opener(request):
+            # like a server for which the partial download is complete:
+            requests.append(request.get_header('Range'))
+            if request.get_header('Range') != None:
+                raise brulib.untar.HTTPError(request.get_full_url(), 416,
+                    'Requested Range Not Satisfiable', {}, None)
+            response = io.BytesIO(content)
+            response.getcode = lambda: 200
+            return response
+        brulib.util.mkdir_p(temp_root)
+        dst_file = os.path.join(temp_root, 'complete.txt')
+        with open(dst_file, 'wb') as file:
+            file.write(content)
+        digests = brulib.untar.wget('http://example.com/complete.txt',
+                                    dst_file, opener = fake_opener)
+        self.assertEqual(requests, ['bytes=10-', None])
+        self.assertEqual(digests['md5'], hashlib.md5(content).hexdigest())
+        with open(dst_file, 'rb') as file:
+            self.assertEqual(file.read(), content)
+
+    def create_tar(self, suffix, mode):
+        """ creates a tar with a nested dir, an executable, a file too big to
+            be buffered, a symlink and a hardlink """
+        src_dir = os.path.join(temp_root, 'src', 'foo-1.0')
+        brulib.util.mkdir_p(os.path.join(src_dir, 'include', 'foo'))
+        with open(os.path.join(src_dir, 'include', 'foo', 'foo.h'), 'w') as file:
+            file.write('int foo();\n')
+        configure = os.path.join(src_dir, 'configure')
+        with open(configure, 'w') as file:
+            file.write('#!/bin/sh\n')
+        os.chmod(configure, 0o755)
+        with open(os.path.join(src_dir, 'foo.dat'), 'wb') as file:
+            file.write(self.get_big_content())
+        tar_file = os.path.join(temp_root, 'foo-1.0' + suffix)
+        with tarfile.open(tar_file, mode) as tar:
+            tar.add(src_dir, arcname='foo-1.0')
+            symlink = tarfile.TarInfo('foo-1.0/include/foo.hpp')
+            symlink.type = tarfile.SYMTYPE
+            symlink.linkname = 'foo/foo.h'
+            tar.addfile(symlink)
+            hardlink = tarfile.TarInfo('foo-1.0/configure.sh')
+            hardlink.type = tarfile.LNKTYPE
+            hardlink.linkname = 'foo-1.0/configure'
+            tar.addfile(hardlink)
+        return tar_file
+
+    def get_big_content(self):
+        return b'0123456789abcdef' * (brulib.untar._MAX_BUFFERED_FILE_BYTES // 8)
+
+    def test_extract_file(self):
+        for suffix, mode in [('.tar.gz', 'w:gz'), ('.tar.bz2', 'w:bz2'),
+                             ('.tar.xz', 'w:xz')]:
+            for use_external in [True, False]:
+                self.tearDownClass()
+                tar_file = self.create_tar(suffix, mode)
+                module_dir = os.path.join(temp_root, 'unpacked')
+                brulib.untar.extract_file(tar_file, module_dir, jobs = 2,
+                                          use_external = use_external)
+                foo_dir = os.path.join(module_dir, 'foo-1.0')
+                for header in ['foo/foo.h', 'foo.hpp']:
+                    with open(os.path.join(foo_dir, 'include', header)) as file:
+                        self.assertEqual(file.read(), 'int foo();\n')
+                # links are unpacked as copies:
+                assert not os.path.islink(os.path.join(foo_dir, 'include', 'foo.hpp'))
+                for script in ['configure', 'configure.sh']:
+                    mode_bits = os.stat(os.path.join(foo_dir, script)).st_mode
+                    assert mode_bits & stat.S_IXUSR, script
+                with open(os.path.join(foo_dir, 'foo.dat'), 'rb') as file:
+                    self.assertEqual(file.read(), self.get_big_content())
+
+    def test_extract_file_rejects_unsafe_members(self):
+        self.tearDownClass()
+        brulib.util.mkdir_p(temp_root)
+        tar_file = os.path.join(temp_root, 'evil.tar.gz')
+        with tarfile.open(tar_file, 'w:gz') as tar:
+            member = tarfile.TarInfo('foo/../../evil.txt')
+            tar.addfile(member)
+        self.assertRaises(Exception, brulib.untar.extract_file, tar_file,
+                          os.path.join(temp_root, 'unpacked'))
+        assert not os.path.exists(os.path.join(temp_root, '..', 'evil.txt'))
+
+        # links are resolved by copying their targets, which must not be
+        # outside of the unpacked archive either:
+        with open(os.path.join(temp_root, 'secret.txt'), 'w') as file:
+            file.write('secret\n')
+        with tarfile.open(tar_file, 'w:gz') as tar:
+            member = tarfile.TarInfo('foo/secret.txt')
+            member.type = tarfile.SYMTYPE
+            member.linkname = '../../secret.txt'
+            tar.addfile(member)
+        module_dir = os.path.join(temp_root, 'unpacked2')
+        self.assertRaises(Exception, brulib.untar.extract_file, tar_file,
+                          module_dir)
+        assert not os.path.exists(os.path.join(module_dir, 'foo', 'secret.txt'))
+
+    def test_untar_once_partially(self):
+        self.tearDownClass()
+        tar_file = self.create_tar('.tar.gz', 'w:gz')
+        module_dir = os.path.join(temp_root, 'unpacked')
+        foo_dir = os.path.join(module_dir, 'foo-1.0')
+        brulib.untar.untar_once(tar_file, module_dir, ['foo-1.0/include/foo'])
+        assert os.path.exists(os.path.join(foo_dir, 'include', 'foo', 'foo.h'))
+        assert not os.path.exists(os.path.join(foo_dir, 'configure'))
+        assert brulib.untar.is_unpacked('foo-1.0.tar.gz', module_dir,
+                                        ['foo-1.0/include/foo'])
+        assert not brulib.untar.is_unpacked('foo-1.0.tar.gz', module_dir)
+
+        # the link to a file outside of the selected dirs can't be resolved,
+        # so the whole archive is unpacked after all:
+        brulib.untar.untar_once(tar_file, module_dir, ['foo-1.0/configure.sh'])
+        assert os.path.exists(os.path.join(foo_dir, 'configure'))
+        assert brulib.untar.is_unpacked('foo-1.0.tar.gz', module_dir)
+        assert not os.path.exists(os.path.join(module_dir,
+                                               'foo-1.0.tar.gz.unpack_partial'))
@@ -139,6 +139,44 @@ class InstallTestCase(unittest.TestCase):
         # verify cmd was executed with the expected cwd:
         assert os.path.exists(os.path.join(module_dir, 'foo.txt'))
 
+    def test_exec_make_commands(self):
+        platform = "Linux"
+        def create_formula(module, make_command, deps):
+            os.makedirs(os.path.join(temp_root, module, '1'))
+            formula = {'module': module, 'version': '1',
+                       'dependencies': dict((dep, '1') for dep in deps)}
+            if make_command != None:
+                formula['make_command'] = {platform: make_command}
+            return formula
+        # c is built before a, even though b (without make_command) is
+        # inbetween:
+        formulas = [
+            create_formula('a', 'test -f ../../c/1/c.txt && touch a.txt', ['b']),
+            create_formula('b', None, ['c']),
+            create_formula('c', 'echo c > c.txt', []),
+            create_formula('d', 'echo d > d.txt', []),
+        ]
+        self.assertEqual(
+            [[[formula['module'] for formula in cycle] for cycle in level]
+             for level in install.get_dependency_levels(formulas)],
+            [[['c'], ['d']], [['b']], [['a']]])
+        install.exec_make_commands(formulas, temp_root, platform, 4)
+        for module in ['a', 'c', 'd']:
+            module_dir = os.path.join(temp_root, module, '1')
+            assert os.path.exists(os.path.join(module_dir, module + '.txt'))
+            assert os.path.exists(os.path.join(module_dir, 'make_command.done'))
+        with open(os.path.join(temp_root, 'c', '1', 'make_command.log')) as log:
+            self.assertEqual(log.read(), '')
+
+        # a failing make_command raises, with its output in the log:
+        formula = create_formula('e', 'echo oops; exit 3', [])
+        with self.assertRaises(ValueError):
+            install.exec_make_commands([formula], temp_root, platform, 4)
+        module_dir = os.path.join(temp_root, 'e', '1')
+        assert not os.path.exists(os.path.join(module_dir, 'make_command.done'))
+        with open(os.path.join(module_dir, 'make_command.log')) as log:
+            self.assertEqual(log.read(), 'oops\n')
+
     def test_resolve_conflicts(self):
         library = brulib.library.Library('./library')
         # we could create a library mock that actually needs to resolve
@@ -172,3 +210,18 @@ class InstallTestCase(unittest.TestCase):
         install.cmd_install(library, []) # should be a NOP
         assert os.path.exists(zlib_module_dir)
         assert os.path.exists(os.path.join(zlib_module_dir, 'zlib.gyp'))
+
+    def test_get_dependency_levels(self):
+        formulas = [
+            {'module': 'a', 'version': '1', 'dependencies': {'b': '1', 'c': '1'}},
+            {'module': 'b', 'version': '1', 'dependencies': {'c': '1'}},
+            {'module': 'c', 'version': '1'},
+            # a cycle, which is built as one unit after its deps:
+            {'module': 'd', 'version': '1', 'dependencies': {'e': '1'}},
+            {'module': 'e', 'version': '1', 'dependencies': {'d': '1', 'c': '1'}},
+        ]
+        levels = install.get_dependency_levels(formulas)
+        self.assertEqual(
+            [[[formula['module'] for formula in cycle] for cycle in level]
+             for level in levels],
+            [[['c']], [['b'], ['d', 'e']], [['a']]])
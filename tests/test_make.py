@@ -3,6 +3,7 @@ import brulib.install
 import brulib.make
 import brulib.runtests
 import brulib.library
+import brulib.util
 import os
 import pdb
 import shutil
@@ -35,3 +36,54 @@ class MakeTestCase(unittest.TestCase):
         # as well:
         brulib.runtests.cmd_test(['tiny-js'])
         brulib.runtests.cmd_test([]) # runs tests for all modules
+
+    def test_get_linux_cmdlines(self):
+        self.assertEqual(
+            brulib.make.get_linux_cmdlines('package.gyp', 'Debug', 0, 'ninja', 8),
+            ('gyp --depth=. -f ninja package.gyp',
+             'ninja -C out/Debug -j 8',
+             'out/Debug/build.ninja'))
+        self.assertEqual(
+            brulib.make.get_linux_cmdlines('package.gyp', 'Release', 1, 'make', 4),
+            ('gyp --depth=. -f make package.gyp',
+             'make BUILDTYPE=Release V=1 -j 4',
+             'Makefile'))
+
+    def test_get_linux_generator(self):
+        self.assertEqual(brulib.make.get_linux_generator('make'), 'make')
+        self.assertEqual(brulib.make.get_linux_generator('auto'),
+            'ninja' if brulib.util.which('ninja') != None else 'make')
+        with self.assertRaises(Exception):
+            brulib.make.get_linux_generator('scons')
+
+    def test_run_gyp_skips_unchanged_inputs(self):
+        os.makedirs(os.path.join(temp_root, 'bru_modules', 'foo'))
+        cwd = os.getcwd()
+        os.chdir(temp_root)
+        try:
+            for gyp_file in ['package.gyp', 'bru_overrides.gypi',
+                             os.path.join('bru_modules', 'foo', 'foo.gyp')]:
+                with open(gyp_file, 'w') as file:
+                    file.write('{}')
+            # stands in for gyp, which would generate the Makefile:
+            gyp_cmdline = 'echo run >> gyp.log && touch Makefile'
+            def get_run_count():
+                brulib.make.run_gyp(gyp_cmdline, 'package.gyp', 'Makefile')
+                with open('gyp.log') as file:
+                    return len(file.readlines())
+            self.assertEqual(get_run_count(), 1)
+            self.assertEqual(get_run_count(), 1)
+
+            # gyp files that changed, that got added and a missing Makefile
+            # make gyp run again:
+            with open(os.path.join('bru_modules', 'foo', 'foo.gyp'), 'w') as file:
+                file.write('{"targets": []}')
+            self.assertEqual(get_run_count(), 2)
+            with open('bru_common.gypi', 'w') as file:
+                file.write('{}')
+            self.assertEqual(get_run_count(), 3)
+            os.remove('Makefile')
+            self.assertEqual(get_run_count(), 4)
+            self.assertEqual(get_run_count(), 4)
+        finally:
+            os.chdir(cwd)
@@ -1,8 +1,11 @@
 import unittest
+import brulib.library
 import brulib.module_downloader
+import brulib.treecache
 import os
 import pdb
 import shutil
+import tarfile
 
 temp_root = './temp_module_downloader'
 
@@ -15,7 +18,20 @@ class LibraryTestCase(unittest.TestCase):
     @classmethod
     def tearDownClass(cls):
         if os.path.exists(temp_root):
-            shutil.rmtree(temp_root)
+            brulib.treecache.rmtree(temp_root)
+
+    def setUp(self):
+        # so that tests don't touch the real ~/.bru:
+        home = os.path.abspath(os.path.join(temp_root, 'home'))
+        for var in ['HOME', 'USERPROFILE']:
+            self.addCleanup(self.restore_env, var, os.environ.get(var))
+            os.environ[var] = home
+
+    def restore_env(self, var, value):
+        if value == None:
+            del os.environ[var]
+        else:
+            os.environ[var] = value
 
     def test_get_urls_tar_gz(self):
         library = brulib.library.Library('./library')
@@ -47,3 +63,65 @@ class LibraryTestCase(unittest.TestCase):
         assert os.path.exists(os.path.join(temp_root, 'bru_modules', 
             'ogg', '1.3.2', 'libogg-1.3.2', 'src'))
 
+    def test_get_lazy_prefixes(self):
+        library = brulib.library.Library('./library')
+        formula = library.load_formula('boost-regex', '1.57.0')
+        self.assertEqual(
+            brulib.module_downloader.get_lazy_prefixes(library, formula),
+            ['regex-boost-1.57.0/example/snippets',
+             'regex-boost-1.57.0/include', 'regex-boost-1.57.0/src'])
+        # nested dirs are covered by their parent dir:
+        formula = library.load_formula('zlib', '1.2.8')
+        self.assertEqual(
+            brulib.module_downloader.get_lazy_prefixes(library, formula),
+            ['zlib-1.2.8'])
+        # modules with a make_command need all their files:
+        formula = library.load_formula('openssl', '1.0.1m')
+        self.assertEqual(
+            brulib.module_downloader.get_lazy_prefixes(library, formula), None)
+
+    def test_get_urls_shares_no_files_between_projects(self):
+        # two modules sharing the same archive, as if a module was renamed:
+        library = brulib.library.Library(os.path.join(temp_root, 'library'))
+        src_dir = os.path.join(temp_root, 'src', 'foo-1.0', 'src')
+        os.makedirs(src_dir)
+        with open(os.path.join(src_dir, 'a.c'), 'w') as file:
+            file.write('int a;\n')
+        formulas = [{'module': module, 'version': version,
+                     'url': 'file://foo-1.0.tar.gz'}
+                    for (module, version) in [('bar', '2.0'), ('foo', '1.1')]]
+        for formula in formulas:
+            library.save_formula(formula)
+            with tarfile.open(os.path.join(library.get_module_dir(
+                    formula['module']), 'foo-1.0.tar.gz'), 'w:gz') as tar:
+                tar.add(os.path.dirname(src_dir), arcname='foo-1.0')
+        bru_modules_root = os.path.join(temp_root, 'bru_modules')
+        def get_a_c(module, version):
+            return os.path.join(bru_modules_root, module, version,
+                                'foo-1.0', 'src', 'a.c')
+        def read(path):
+            with open(path) as file:
+                return file.read()
+
+        # editing a file of one module leaves the other and the cache alone:
+        for formula in formulas:
+            brulib.module_downloader.get_urls(library, formula, bru_modules_root)
+        with open(get_a_c('foo', '1.1'), 'w') as file:
+            file.write('int a = 1;\n')
+        self.assertEqual(read(get_a_c('bar', '2.0')), 'int a;\n')
+        trees = list(brulib.module_downloader.get_tree_cache().get_trees())
+        self.assertEqual(len(trees), 1)
+        self.assertEqual(read(os.path.join(trees[0][0], 'foo-1.0', 'src', 'a.c')),
+                         'int a;\n')
+
+        # a linked module whose formula gained a make_command is unpacked
+        # again as private files:
+        formula = dict(formulas[1], version = '1.2')
+        library.save_formula(formula)
+        brulib.module_downloader.get_urls(library, formula, bru_modules_root,
+                                          link_trees = True)
+        self.assertEqual(os.stat(get_a_c('foo', '1.2')).st_nlink, 2)
+        formula['make_command'] = {'Linux': 'true'}
+        brulib.module_downloader.get_urls(library, formula, bru_modules_root)
+        self.assertEqual(os.stat(get_a_c('foo', '1.2')).st_nlink, 1)
+        self.assertEqual(read(get_a_c('foo', '1.2')), 'int a;\n')
@@ -0,0 +1,180 @@
+import unittest
+import brulib.jsonc
+import scan_deps
+import brulib.includescan
+import argparse
+import concurrent.futures
+import os
+import shutil
+import tarfile
+
+temp_root = os.path.abspath('./temp_scan_deps')
+
+class ScanDepsTestCase(unittest.TestCase):
+    """ scan_deps.py works on ./library and ./bru_modules, so these tests
+        run in a temp dir with a small library of local tar.gzs """
+
+    def setUp(self):
+        if os.path.exists(temp_root):
+            shutil.rmtree(temp_root)
+        os.makedirs(temp_root)
+        self.cwd = os.getcwd()
+        os.chdir(temp_root)
+        self.add_module('foo', {'foo/foo.h': '#include "bar/bar.h"\n'})
+        self.add_module('bar', {'bar/bar.h': '#include <vector>\n'})
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(temp_root)
+
+    def add_module(self, module, headers, sources = {}):
+        """ adds version 1.0 of the module to ./library, with its tar.gz
+            containing the given headers and sources (dicts path -> content,
+            with headers in the include dir and sources in the src dir) """
+        module_dir = os.path.join('library', module)
+        src_dir = os.path.join(temp_root, 'src', module + '-1.0')
+        files = [(os.path.join('include', header), content)
+                 for header, content in headers.items()] + \
+                [(os.path.join('src', source), content)
+                 for source, content in sources.items()]
+        for path, content in files:
+            filename = os.path.join(src_dir, path)
+            if not os.path.exists(os.path.dirname(filename)):
+                os.makedirs(os.path.dirname(filename))
+            with open(filename, 'w') as file:
+                file.write(content)
+        os.makedirs(module_dir)
+        with tarfile.open(os.path.join(module_dir, module + '-1.0.tar.gz'),
+                          'w:gz') as tar:
+            tar.add(src_dir, arcname = module + '-1.0')
+        brulib.jsonc.savefile(os.path.join(module_dir, '1.0.bru'), {
+            'module': module,
+            'version': '1.0',
+            'url': 'file://{}-1.0.tar.gz'.format(module)
+        })
+        self.save_gyp(module, ['1.0/{}-1.0/include'.format(module)],
+                      ['1.0/{}-1.0/src/{}'.format(module, source)
+                       for source in sorted(sources)])
+
+    def save_gyp(self, module, include_dirs, sources = []):
+        target = {
+            'target_name': module,
+            'type': 'none',
+            'include_dirs': include_dirs
+        }
+        if len(sources) > 0:
+            target['sources'] = sources
+        brulib.jsonc.savefile(os.path.join('library', module, '1.0.gyp'), {
+            'targets': [target]
+        })
+
+    def test_include_file_index(self):
+        index = scan_deps.IncludeFileIndex('./library', './bru_modules')
+        self.assertEqual(index.get_modules_containing('foo/foo.h'), set(['foo']))
+        self.assertEqual(index.get_modules_containing('bar/bar.h'), set(['bar']))
+        assert os.path.exists(os.path.join('bru_modules', 'bru-include-index.json'))
+
+        # the persisted index is reused without scanning modules again:
+        collect_includes = scan_deps.collect_includes
+        scanned = []
+        def collect_includes_spy(formula):
+            scanned.append(formula['module'])
+            return collect_includes(formula)
+        scan_deps.collect_includes = collect_includes_spy
+        try:
+            index = scan_deps.IncludeFileIndex('./library', './bru_modules')
+            self.assertEqual(scanned, [])
+            self.assertEqual(index.get_modules_containing('foo/foo.h'),
+                             set(['foo']))
+
+            # modules whose gyp changed get scanned again:
+            self.save_gyp('foo', ['1.0/foo-1.0/include/foo'])
+            index = scan_deps.IncludeFileIndex('./library', './bru_modules')
+            self.assertEqual(scanned, ['foo'])
+            self.assertEqual(index.get_modules_containing('foo/foo.h'), set())
+            self.assertEqual(index.get_modules_containing('foo.h'), set(['foo']))
+        finally:
+            scan_deps.collect_includes = collect_includes
+
+    def test_scan_module_deps(self):
+        self.add_module('baz', {'baz/baz.h': '#include "foo/foo.h"\n'},
+                        {'baz.cpp': '#include "baz/baz.h"\n'
+                                    '#include "bar/bar.h"\n'})
+        index = scan_deps.IncludeFileIndex('./library', './bru_modules')
+        formula = scan_deps.get_library().load_formula('baz', '1.0')
+        module_deps = scan_deps.scan_module_deps(formula, index)
+        self.assertEqual(module_deps.public, set(['foo']))
+        self.assertEqual(module_deps.private, set(['bar']))
+        self.assertEqual(module_deps.unknown_includes, set())
+
+    def test_scan_arg_modules_recursive(self):
+        self.add_module('baz', {'baz/baz.h': '#include "foo/foo.h"\n'},
+                        {'baz.cpp': '#include "baz/baz.h"\n'})
+        args = argparse.Namespace(module = 'baz', version = None,
+                                  recursive = True, minimal = False,
+                                  jobs = 2)
+        with brulib.includescan.IncludeScanner(jobs = 2) as scanner:
+            scan_deps.scan_arg_modules(args, scanner)
+        library = scan_deps.get_library()
+        def get_deps(module):
+            return dict(library.load_formula(module, '1.0')['dependencies'])
+        self.assertEqual(get_deps('baz'), {'foo': '1.0'})
+        self.assertEqual(get_deps('foo'), {'bar': '1.0'})
+        self.assertEqual(get_deps('bar'), {})
+        self.assertEqual(library.load_gyp(library.load_formula('baz', '1.0'))
+                         ['targets'][0]['dependencies'], ['../foo/foo.gyp:*'])
+
+    def test_scan_module_deps_minimal(self):
+        # qux has an #include cycle and #includes foo, which #includes bar
+        self.add_module('qux', {'qux/qux.h': '#include "detail.h"\n',
+                                'qux/detail.h': '#include "qux/qux.h"\n'
+                                                '#include "foo/foo.h"\n'})
+        self.add_module('baz', {'baz/baz.h': '#include "foo/foo.h"\n'
+                                             '#include "bar/bar.h"\n'},
+                        {'baz.cpp': '#include "baz/baz.h"\n'
+                                    '#include "qux/qux.h"\n'
+                                    '#include <cstdio>\n'})
+        index = scan_deps.IncludeFileIndex('./library', './bru_modules')
+        library = scan_deps.get_library()
+        formula = library.load_formula('baz', '1.0')
+        module_deps = scan_deps.scan_module_deps(formula, index)
+        self.assertEqual(module_deps.public, set(['foo', 'bar']))
+        self.assertEqual(module_deps.private, set(['qux']))
+
+        with brulib.includescan.IncludeScanner(jobs = 1) as scanner:
+            graph = scan_deps.IncludeGraph(index, scanner, library)
+            module_deps = scan_deps.scan_module_deps(formula, index,
+                                                     include_graph = graph)
+            self.assertEqual(module_deps.public, set(['foo']))
+            self.assertEqual(module_deps.private, set(['qux']))
+            self.assertEqual(module_deps.unknown_includes, set(['cstdio']))
+            module_deps = scan_deps.scan_module_deps(
+                library.load_formula('qux', '1.0'), index,
+                include_graph = graph)
+            self.assertEqual(module_deps.public, set(['foo']))
+
+    def test_include_graph_scans_concurrently(self):
+        self.add_module('qux', {'qux/qux.h': '#include "foo/foo.h"\n'})
+        self.add_module('baz', {'baz/baz.h': '#include "foo/foo.h"\n'
+                                             '#include "bar/bar.h"\n'})
+        index = scan_deps.IncludeFileIndex('./library', './bru_modules')
+        library = scan_deps.get_library()
+        test = self
+        class ScannerSpy(brulib.includescan.IncludeScanner):
+            def scan(self, filenames):
+                # files are scanned without blocking other modules' scans:
+                assert not test.graph._lock.locked()
+                return brulib.includescan.IncludeScanner.scan(self, filenames)
+        with ScannerSpy(jobs = 1) as scanner:
+            self.graph = scan_deps.IncludeGraph(index, scanner, library)
+            with concurrent.futures.ThreadPoolExecutor(2) as executor:
+                futures = dict((module, executor.submit(
+                    scan_deps.scan_module_deps,
+                    library.load_formula(module, '1.0'), index,
+                    include_graph = self.graph))
+                    for module in ['qux', 'baz'])
+            self.assertEqual(futures['qux'].result().public, set(['foo']))
+            self.assertEqual(futures['baz'].result().public, set(['foo']))
+
+if __name__ == '__main__':
+    unittest.main()